@@ -0,0 +1,272 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from redis.exceptions import RedisError
+import metrics
+from redis_config import async_redis_client
+
+# Cold requests (cache misses) running at once; more wait in a bounded queue
+ADMISSION_MAX_ACTIVE = int(os.getenv("ADMISSION_MAX_ACTIVE", 32))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 128))
+# Longest a cold request waits for a slot before it is shed with 503
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 10))
+
+# Requests per second (and burst) per client; 0 disables the limit
+CLIENT_RATE_LIMIT = float(os.getenv("CLIENT_RATE_LIMIT", 0))
+CLIENT_RATE_BURST = float(os.getenv("CLIENT_RATE_BURST", 20))
+# Clients are told apart by this header (e.g. an API key), falling back to their address
+CLIENT_ID_HEADER = os.getenv("CLIENT_ID_HEADER", "X-API-Key")
+# Behind one trusted proxy (such as workers.py) that appends to X-Forwarded-For, count the
+# address it saw (the last entry); earlier entries come from the caller and can be forged
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "false").lower() == "true"
+MAX_LOCAL_CLIENT_BUCKETS = 10000
+
+# Calls per second each upstream may receive across all replicas; 0 disables the limit
+UPSTREAM_RATE_LIMITS = {
+    "wikipedia": float(os.getenv("WIKIPEDIA_RATE_LIMIT", 0)),
+    "tavily": float(os.getenv("TAVILY_RATE_LIMIT", 0)),
+    "llm": float(os.getenv("LLM_RATE_LIMIT", 0)),
+}
+UPSTREAM_RATE_BURST = float(os.getenv("UPSTREAM_RATE_BURST", 5))
+
+# Lower numbers are admitted first, and shed last
+PRIORITIES = {"interactive": 0, "batch": 1, "background": 2}
+
+# Refills the bucket for the time since its last use, then takes one token if there is one.
+# Returns the seconds until a token will be available (0 when one was taken).
+_TAKE_SCRIPT = """
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+class Overloaded(Exception):
+    """A cold request was shed because the admission queue was full or it waited too long."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Server overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class RateLimited(Exception):
+    """A client exceeded its request rate."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limit exceeded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+def retry_after_seconds(wait):
+    """Whole seconds for a Retry-After header (at least 1)."""
+    return max(1, math.ceil(wait))
+
+class TokenBucket:
+    """`rate` tokens per second up to `burst`, shared through Redis when a client is given.
+
+    Falls back to a bucket local to this process while Redis is unreachable.
+    """
+
+    def __init__(self, name, rate, burst, client=None):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.client = client
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _take_local(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    async def take(self):
+        """Takes a token; returns 0, or the seconds until one will be available (nothing is taken then)."""
+        if self.client:
+            try:
+                with metrics.stage("redis.eval"):
+                    wait = await self.client.eval(_TAKE_SCRIPT, 1, f"ratelimit:{self.name}", self.rate, self.burst, time.time())
+                return float(wait)
+            except RedisError as e:
+                logging.warning(f"⚠️ Redis error in rate limiter {self.name}, limiting locally: {e}")
+        return self._take_local()
+
+    async def wait(self, max_wait=None):
+        """Waits for a token; returns False without taking one if that would take longer than `max_wait`."""
+        while (delay := await self.take()) > 0:
+            if max_wait is not None and delay > max_wait:
+                return False
+            await asyncio.sleep(delay)
+            if max_wait is not None:
+                max_wait -= delay
+        return True
+
+_upstream_buckets = {}
+_client_buckets = OrderedDict()
+
+def upstream_bucket(upstream):
+    """The shared bucket for `upstream`, or None when it has no rate limit."""
+    rate = UPSTREAM_RATE_LIMITS.get(upstream, 0)
+    if rate <= 0:
+        return None
+    if upstream not in _upstream_buckets:
+        _upstream_buckets[upstream] = TokenBucket(f"upstream:{upstream}", rate, UPSTREAM_RATE_BURST, async_redis_client)
+    return _upstream_buckets[upstream]
+
+def client_id(request):
+    """Who a request counts against: the CLIENT_ID_HEADER value, else the caller's address."""
+    key = request.headers.get(CLIENT_ID_HEADER)
+    if key:
+        return f"key:{key}"
+    forwarded = request.headers.get("X-Forwarded-For")
+    if TRUST_FORWARDED_FOR and forwarded:
+        return f"ip:{forwarded.split(',')[-1].strip()}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+async def check_client(request):
+    """Raises RateLimited if the request's client is over CLIENT_RATE_LIMIT; a no-op when it is disabled."""
+    if CLIENT_RATE_LIMIT <= 0:
+        return
+    identity = client_id(request)
+    bucket = _client_buckets.get(identity)
+    if bucket is None:
+        bucket = _client_buckets[identity] = TokenBucket(f"client:{identity}", CLIENT_RATE_LIMIT, CLIENT_RATE_BURST, async_redis_client)
+        if len(_client_buckets) > MAX_LOCAL_CLIENT_BUCKETS:
+            _client_buckets.popitem(last=False)
+    _client_buckets.move_to_end(identity)
+    wait = await bucket.take()
+    if wait > 0:
+        metrics.record_rate_limited("client")
+        raise RateLimited(retry_after_seconds(wait))
+
+class AdmissionController:
+    """Bounds concurrent cold requests, queueing the rest by priority.
+
+    Up to `max_active` holders run at once and up to `max_queue` wait, highest
+    priority (then oldest) first. A full queue sheds its lowest-priority waiter to
+    make room for a higher-priority arrival, and rejects the arrival otherwise.
+    Waiters that are not admitted within `queue_timeout` are shed as well.
+    """
+
+    def __init__(self, max_active=ADMISSION_MAX_ACTIVE, max_queue=ADMISSION_MAX_QUEUE, queue_timeout=ADMISSION_QUEUE_TIMEOUT):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters = []  # heap of [rank, seq, future, priority name]
+        self._seq = itertools.count()
+        self._service_time = 1.0  # moving average of how long a holder keeps its slot
+
+    def retry_after(self):
+        """Rough time until the queue drains, for Retry-After."""
+        return retry_after_seconds((len(self._waiters) + 1) * self._service_time / max(1, self.max_active))
+
+    def _shed(self, name):
+        metrics.record_admission(name, "shed")
+        return Overloaded(self.retry_after())
+
+    async def acquire(self, name):
+        rank = PRIORITIES[name]
+        if self.active < self.max_active and not self._waiters:
+            self.active += 1
+            metrics.record_admission(name, "admitted")
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            lowest = max(self._waiters)
+            if lowest[0] <= rank:
+                raise self._shed(name)
+            self._remove(lowest)
+            lowest[2].set_exception(self._shed(lowest[3]))
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [rank, next(self._seq), future, name]
+        heapq.heappush(self._waiters, entry)
+        metrics.record_admission(name, "queued")
+        metrics.ADMISSION_QUEUE.set(len(self._waiters))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if future.done():
+                return future.result()  # Admitted (or shed) just as the wait timed out
+            self._remove(entry)
+            raise self._shed(name) from None
+        except asyncio.CancelledError:
+            if future.done() and future.exception() is None:
+                self.release()  # Admitted, but the caller went away
+            self._remove(entry)
+            raise
+        finally:
+            metrics.ADMISSION_QUEUE.set(len(self._waiters))
+
+    def _remove(self, entry):
+        if entry in self._waiters:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+
+    def release(self, held_for=None):
+        """Frees a slot, handing it straight to the next waiter."""
+        if held_for is not None:
+            self._service_time = 0.9 * self._service_time + 0.1 * held_for
+        while self._waiters:
+            future = heapq.heappop(self._waiters)[2]
+            if not future.done():
+                future.set_result(True)  # The slot passes over without changing `active`
+                return
+        self.active -= 1
+
+controller = AdmissionController()
+_priority = contextvars.ContextVar("admission_priority", default="interactive")
+_admitted = contextvars.ContextVar("admission_admitted", default=False)
+
+@contextmanager
+def priority(name):
+    """Cold work started inside the block queues for its own slot at priority `name`.
+
+    `name` is interactive, batch or background. Only use it where no slot is held
+    (entry points and detached tasks), since the block's work does not reuse one.
+    """
+    tokens = _priority.set(name), _admitted.set(False)
+    try:
+        yield
+    finally:
+        _admitted.reset(tokens[1])
+        _priority.reset(tokens[0])
+
+@asynccontextmanager
+async def admit():
+    """Holds an admission slot for the block; raises Overloaded when the request is shed.
+
+    Nested use inside an admitted block (and tasks it starts) passes straight through,
+    so a request never waits on a second slot while holding one.
+    """
+    if _admitted.get():
+        yield
+        return
+    await controller.acquire(_priority.get())
+    token = _admitted.set(True)
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        _admitted.reset(token)
+        controller.release(time.monotonic() - start)
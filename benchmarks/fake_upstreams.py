@@ -0,0 +1,208 @@
+"""Local stand-ins for OpenAI, Wikipedia and Tavily with configurable latency and error rates.
+
+Run standalone with `python -m benchmarks.fake_upstreams --port 9000` and point the API at it:
+
+    OPENAI_BASE_URL=http://127.0.0.1:9000/v1
+    WIKIPEDIA_API_URL=http://127.0.0.1:9000/w/api.php
+    TAVILY_API_URL=http://127.0.0.1:9000
+"""
+import argparse
+import asyncio
+import math
+import random
+import re
+import time
+from collections import Counter
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from query_classifier import classify_category
+
+UPSTREAMS = ("llm", "wikipedia", "tavily")
+
+# Companies the fakes know about; anything else is reported as not found
+COMPANIES = [
+    "OpenAI", "Tesla", "Microsoft", "Google", "Apple", "Amazon", "Nvidia", "Stripe",
+    "Goldman Sachs", "Netflix", "Spotify", "Airbnb", "Shopify", "Salesforce", "Adobe",
+]
+# Names that verify as ambiguous, with the options offered to the user
+AMBIGUOUS = {
+    "Mercury": ["Mercury Systems", "Mercury Marine", "Mercury Insurance"],
+    "Delta": ["Delta Air Lines", "Delta Electronics", "Delta Faucet Company"],
+    "Apollo": ["Apollo Global Management", "Apollo Tyres", "Apollo Hospitals"],
+}
+
+# Pages never change in the fakes, so stored copies always revalidate
+PAGE_REVISION = 1
+
+class Profile:
+    """Latency (lognormal around `median_ms`) and error-rate distribution for one upstream."""
+
+    def __init__(self, median_ms=50.0, sigma=0.5, error_rate=0.0):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+
+    def sample_delay(self, rng):
+        return self.median_ms * math.exp(rng.gauss(0, self.sigma)) / 1000 if self.median_ms > 0 else 0.0
+
+    def __repr__(self):
+        return f"Profile(median_ms={self.median_ms}, sigma={self.sigma}, error_rate={self.error_rate})"
+
+DEFAULT_PROFILES = {
+    "llm": Profile(median_ms=400, sigma=0.6),
+    "wikipedia": Profile(median_ms=120, sigma=0.5),
+    "tavily": Profile(median_ms=600, sigma=0.7),
+}
+
+def _find_company(text):
+    """Longest catalog (or ambiguous) name mentioned in `text`, else the first capitalized word."""
+    names = sorted([*COMPANIES, *AMBIGUOUS, *(o for options in AMBIGUOUS.values() for o in options)], key=len, reverse=True)
+    for name in names:
+        if re.search(rf"\b{re.escape(name)}\b", text, re.IGNORECASE):
+            return name
+    words = re.findall(r"\b[A-Z][\w&.-]+", text)
+    return words[-1] if words else "Unknown"
+
+def _chat_answer(prompt):
+    """Plays the part of each prompt the system sends to the LLM."""
+    if "For each numbered query below" in prompt:
+        queries = re.findall(r"^\s*(\d+)\.\s+(.+)$", prompt.split("Queries:", 1)[1], re.MULTILINE)
+        return "\n".join(
+            f"{n}. Company Name: {_find_company(q)} | Category: {classify_category(q) or 'Company Overview'}"
+            for n, q in queries
+        )
+    if "Extract the company name and classify" in prompt:
+        query = prompt.split("Query:", 1)[1].split("Respond strictly", 1)[0].strip()
+        return f"Company Name: {_find_company(query)}\nCategory: {classify_category(query) or 'Company Overview'}"
+    if "expert business analyst" in prompt:
+        name = re.search(r"Determine if '(.+?)' refers", prompt).group(1)
+        if name in AMBIGUOUS:
+            return f"Ambiguous: {', '.join(AMBIGUOUS[name])}"
+        return f"Verified: {name}" if name in COMPANIES else f"Unknown: {name}"
+    query_type = re.search(r"\*\*Query Type:\*\*\s*(.+)", prompt)
+    return f"Benchmark answer for {query_type.group(1).strip() if query_type else 'the query'}."
+
+def _search_titles(query):
+    company = _find_company(query)
+    if company in AMBIGUOUS:
+        return ["List of companies (disambiguation)"]  # Sends verification to the LLM check
+    if company in COMPANIES:
+        return [company, f"History of {company}", f"{company} (disambiguation)"]
+    for options in AMBIGUOUS.values():
+        if company in options:
+            return [company]
+    return []
+
+def create_app(profiles=None, seed=None):
+    """Builds the fake upstream app; `profiles` maps llm/wikipedia/tavily to a Profile."""
+    profiles = {**DEFAULT_PROFILES, **(profiles or {})}
+    rng = random.Random(seed)
+    calls = Counter()
+    errors = Counter()
+    app = FastAPI(title="Fake upstreams")
+
+    async def simulate(upstream):
+        """Waits out the sampled latency; returns an error response if this call should fail."""
+        calls[upstream] += 1
+        profile = profiles[upstream]
+        await asyncio.sleep(profile.sample_delay(rng))
+        if rng.random() < profile.error_rate:
+            errors[upstream] += 1
+            return JSONResponse({"error": f"injected {upstream} failure"}, status_code=503)
+        return None
+
+    @app.api_route("/", methods=["GET", "HEAD"])
+    async def root():
+        return Response()
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "fake-model", "object": "model", "owned_by": "benchmark"}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        failure = await simulate("llm")
+        if failure:
+            return failure
+        prompt = "\n".join(m.get("content", "") for m in body.get("messages", []) if isinstance(m.get("content"), str))
+        answer = _chat_answer(prompt)
+        return {
+            "id": f"chatcmpl-bench-{calls['llm']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake-model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(answer) // 4, "total_tokens": (len(prompt) + len(answer)) // 4},
+        }
+
+    @app.get("/w/api.php")
+    async def wikipedia(request: Request):
+        failure = await simulate("wikipedia")
+        if failure:
+            return failure
+        params = request.query_params
+        if params.get("list") == "search":
+            titles = _search_titles(params.get("srsearch", ""))[: int(params.get("srlimit", 10))]
+            return {"query": {"search": [{"ns": 0, "title": t} for t in titles]}}
+
+        title = params.get("titles", "")
+        if not _search_titles(title):
+            return {"query": {"pages": {"-1": {"title": title, "missing": ""}}}}
+        page = {"pageid": 1, "title": title, "lastrevid": PAGE_REVISION}
+        if "extracts" in params.get("prop", ""):
+            page["fullurl"] = f"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}"
+            page["extract"] = (f"{title} is a company used in benchmarks. " * 40).strip()
+        return {"query": {"pages": {"1": page}}}
+
+    @app.post("/search")
+    async def tavily(request: Request):
+        body = await request.json()
+        failure = await simulate("tavily")
+        if failure:
+            return failure
+        query = body.get("query", "")
+        company = _find_company(query)
+        return {"query": query, "results": [
+            {"url": f"https://example.com/{company.lower().replace(' ', '-')}/{i}", "content": f"{query}: {company} details, result {i}. " * 5}
+            for i in range(body.get("max_results", 3))
+        ]}
+
+    @app.get("/_stats")
+    async def stats():
+        return {"calls": dict(calls), "errors": dict(errors)}
+
+    @app.post("/_reset")
+    async def reset():
+        calls.clear()
+        errors.clear()
+        return {"ok": True}
+
+    return app
+
+def parse_profile(spec):
+    """Parses 'median_ms[:sigma[:error_rate]]', e.g. '400:0.6:0.01'."""
+    parts = [float(p) for p in spec.split(":")]
+    return Profile(*parts)
+
+def add_profile_arguments(parser):
+    for upstream in UPSTREAMS:
+        default = DEFAULT_PROFILES[upstream]
+        parser.add_argument(
+            f"--{upstream}", type=parse_profile, default=default, metavar="MS[:SIGMA[:ERRORS]]",
+            help=f"{upstream} latency median in ms, lognormal sigma and error rate (default {default.median_ms:g}:{default.sigma:g}:{default.error_rate:g})",
+        )
+
+def profiles_from_args(args):
+    return {upstream: getattr(args, upstream) for upstream in UPSTREAMS}
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--seed", type=int, default=None)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(profiles_from_args(args), args.seed), host=args.host, port=args.port, log_level="warning")
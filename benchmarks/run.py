@@ -0,0 +1,325 @@
+"""Offline benchmark for /query/, /clarify/ and the retrieval pipeline.
+
+By default everything runs in one process: fake OpenAI/Wikipedia/Tavily servers on a
+local port, fakeredis as the cache backend and the FastAPI app driven through ASGI.
+Use --target/--upstream to benchmark a separately started API instead.
+
+    python -m benchmarks.run --requests 500 --concurrency 32
+    python -m benchmarks.run --queries requests.jsonl --tavily 1500:0.8:0.05
+    python -m benchmarks.run --json results.json --baseline previous.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+import httpx
+from prometheus_client.parser import text_string_to_metric_families
+from benchmarks import fake_upstreams, workload
+
+SCENARIOS = ("query", "clarify", "pipeline")
+
+# -- Statistics -------------------------------------------------------------------
+
+def percentile(values, pct):
+    """Nearest-rank percentile of `values` (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), math.ceil(pct / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+def summarize(latencies, outcomes, wall_seconds):
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / wall_seconds, 2) if wall_seconds else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies, default=0) * 1000, 2),
+        "outcomes": dict(outcomes),
+    }
+
+def cache_counts(metrics_text):
+    """{namespace: {result: count}} from the company_info_cache_requests_total samples."""
+    counts = defaultdict(dict)
+    for family in text_string_to_metric_families(metrics_text):
+        if family.name != "company_info_cache_requests":
+            continue
+        for sample in family.samples:
+            if sample.name.endswith("_total"):
+                counts[sample.labels["namespace"]][sample.labels["result"]] = sample.value
+    return counts
+
+def cache_report(before, after):
+    """Per-namespace lookups and hit ratio (stale hits count as hits) between two scrapes."""
+    report = {}
+    for namespace in sorted(set(before) | set(after)):
+        delta = {
+            result: after.get(namespace, {}).get(result, 0) - before.get(namespace, {}).get(result, 0)
+            for result in ("hit", "stale", "miss")
+        }
+        total = sum(delta.values())
+        if total:
+            report[namespace] = {**{k: int(v) for k, v in delta.items()}, "hit_ratio": round((delta["hit"] + delta["stale"]) / total, 3)}
+    return report
+
+def compare(results, baseline, tolerance):
+    """Returns the regressions of `results` against `baseline` beyond `tolerance` (a fraction)."""
+    regressions = []
+    for scenario, stats in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if not previous:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if previous[metric] and stats[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{scenario} {metric}: {previous[metric]} -> {stats[metric]}")
+        if previous["rps"] and stats["rps"] < previous["rps"] * (1 - tolerance):
+            regressions.append(f"{scenario} rps: {previous['rps']} -> {stats['rps']}")
+    return regressions
+
+# -- Environment ------------------------------------------------------------------
+
+class UpstreamServer:
+    """Runs the fake upstream app with uvicorn on a background thread."""
+
+    def __init__(self, app, host="127.0.0.1", port=0):
+        import uvicorn
+
+        self.server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning", lifespan="off"))
+        self.thread = threading.Thread(target=self.server.run, name="fake-upstreams", daemon=True)
+
+    def start(self, timeout=10):
+        self.thread.start()
+        deadline = time.time() + timeout
+        while not self.server.started:
+            if time.time() > deadline or not self.thread.is_alive():
+                raise RuntimeError("Fake upstream server failed to start")
+            time.sleep(0.01)
+        host, port = self.server.servers[0].sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+
+def configure_environment(upstream_url, data_dir):
+    """Points the app's clients at the fakes; must run before the app modules are imported."""
+    os.environ.update({
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": f"{upstream_url}/v1",
+        "TAVILY_API_KEY": "benchmark",
+        "TAVILY_API_URL": upstream_url,
+        "WIKIPEDIA_API_URL": f"{upstream_url}/w/api.php",
+        "ENTITY_INDEX_PATH": os.path.join(data_dir, "company_index.json"),
+        "PAGE_STORE_PATH": os.path.join(data_dir, "page_store.sqlite3"),
+        "LANGSMITH_TRACING": "false",
+        "LANGCHAIN_TRACING_V2": "false",
+    })
+    os.environ.setdefault("REDIS_HOST", "127.0.0.1")
+
+def configure_redis(backend):
+    """Swaps the cache backend before anything imports it: 'fake', 'none' or a redis:// URL."""
+    import redis
+    import redis.asyncio as aioredis
+    import redis_config
+
+    if backend == "fake":
+        import fakeredis
+
+        server = fakeredis.FakeServer()
+        redis_config.redis_client = fakeredis.FakeRedis(server=server, decode_responses=False)
+        redis_config.async_redis_client = fakeredis.FakeAsyncRedis(server=server, decode_responses=False)
+    elif backend == "none":
+        redis_config.redis_client = redis_config.async_redis_client = None
+    else:
+        redis_config.redis_client = redis.Redis.from_url(backend, decode_responses=False)
+        redis_config.async_redis_client = aioredis.Redis.from_url(backend, decode_responses=False)
+
+# -- Load generation --------------------------------------------------------------
+
+async def run_load(queries, concurrency, send):
+    """Sends every query with at most `concurrency` in flight; returns (latencies, outcomes, wall seconds)."""
+    latencies, outcomes = [], Counter()
+    pending = iter(queries)
+
+    async def worker():
+        for query in pending:
+            start = time.perf_counter()
+            try:
+                outcome = await send(query)
+            except Exception as e:
+                outcome = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            outcomes[outcome] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies, outcomes, time.perf_counter() - start
+
+def query_sender(api):
+    async def send(query):
+        response = await api.get("/query/", params={"user_query": query})
+        return str(response.status_code)
+    return send
+
+def clarify_sender(api):
+    """Times only the /clarify/ call; the ambiguous /query/ that issues the token is setup."""
+    timings = []
+
+    async def send(query):
+        response = await api.get("/query/", params={"user_query": query})
+        body = response.json()
+        if "clarification_token" not in body:
+            return f"not_ambiguous_{response.status_code}"
+        start = time.perf_counter()
+        clarified = await api.get("/clarify/", params={"selection": body["options"][0], "token": body["clarification_token"]})
+        timings.append(time.perf_counter() - start)
+        return str(clarified.status_code)
+
+    return send, timings
+
+def pipeline_sender():
+    from data_retrieval import aretrieve_information
+
+    async def send(query):
+        result = await aretrieve_information(query)
+        if "error" in result:
+            return "error"
+        if "ambiguous" in result:
+            return "ambiguous"
+        return "ok" if result.get("confidence_score", 0) > 0 else "empty"
+    return send
+
+async def run_scenario(name, api, queries, concurrency):
+    if name == "query":
+        return summarize(*await run_load(queries, concurrency, query_sender(api)))
+    if name == "clarify":
+        send, timings = clarify_sender(api)
+        _, outcomes, wall = await run_load(queries, concurrency, send)
+        return summarize(timings, outcomes, wall)
+    return summarize(*await run_load(queries, concurrency, pipeline_sender()))
+
+async def benchmark(args, api, upstream, reset_caches=None):
+    """Runs each selected scenario and collects its latency, cache and upstream statistics.
+
+    In-process runs start every scenario from empty caches (plus --warmup requests), so
+    scenarios do not warm each other up.
+    """
+    queries = workload.load_queries(args.queries) if args.queries else workload.default_mix(args.requests, args.seed)
+    queries = (queries * (args.requests // len(queries) + 1))[: args.requests]
+    ambiguous = workload.ambiguous_mix(max(1, args.requests // 10), args.seed)
+
+    config = {k: vars(v) if isinstance(v, fake_upstreams.Profile) else v for k, v in vars(args).items() if k not in ("baseline", "json")}
+    results = {"config": config, "scenarios": {}}
+    for name in args.scenarios:
+        if reset_caches:
+            reset_caches()
+        if args.warmup:
+            await run_load(queries[: args.warmup], args.concurrency, query_sender(api))
+
+        metrics_before = cache_counts((await api.get("/metrics")).text)
+        await upstream.post("/_reset")
+
+        stats = await run_scenario(name, api, ambiguous if name == "clarify" else queries, args.concurrency)
+
+        stats["cache"] = cache_report(metrics_before, cache_counts((await api.get("/metrics")).text))
+        upstream_stats = (await upstream.get("/_stats")).json()
+        stats["upstream_calls"] = {
+            upstream_name: {
+                "calls": calls,
+                "errors": upstream_stats["errors"].get(upstream_name, 0),
+                "per_request": round(calls / max(stats["requests"], 1), 3),
+            }
+            for upstream_name, calls in upstream_stats["calls"].items()
+        }
+        results["scenarios"][name] = stats
+    return results
+
+def print_report(results):
+    print(f"\n{'scenario':<10}{'requests':>10}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}  outcomes")
+    for name, s in results["scenarios"].items():
+        print(f"{name:<10}{s['requests']:>10}{s['rps']:>10}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}{s['max_ms']:>10}  {s['outcomes']}")
+
+    for name, s in results["scenarios"].items():
+        print(f"\n[{name}] cache namespace  hit  stale   miss  hit ratio")
+        for namespace, c in s["cache"].items():
+            print(f"  {namespace:<20}{c['hit']:>6}{c['stale']:>7}{c['miss']:>7}{c['hit_ratio']:>11}")
+        print(f"[{name}] upstream     calls  errors  per request")
+        for upstream_name, u in s["upstream_calls"].items():
+            print(f"  {upstream_name:<14}{u['calls']:>6}{u['errors']:>8}{u['per_request']:>13}")
+
+def reset_local_caches():
+    """Empties both cache tiers and the Wikipedia page store of the in-process app."""
+    import cache
+    import redis_config
+    from page_store import page_store
+
+    cache.clear_local()
+    page_store.clear()
+    if redis_config.redis_client:
+        redis_config.redis_client.flushdb()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=300, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--queries", help="Query mix: text file (one query per line) or JSONL (query/user_query/title)")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--warmup", type=int, default=0, help="Requests sent before each scenario is measured, to start from a warm cache")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--redis", default="fake", help="'fake' (fakeredis), 'none' or a redis:// URL")
+    parser.add_argument("--target", help="Benchmark a running API at this URL instead of in-process")
+    parser.add_argument("--upstream", help="URL of an already running fake_upstreams server (required with --target)")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--baseline", help="Fail if results regress against this earlier --json file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression against --baseline (fraction)")
+    fake_upstreams.add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.target and not args.upstream:
+        parser.error("--target requires --upstream")
+    if args.target and "pipeline" in args.scenarios:
+        args.scenarios.remove("pipeline")  # The pipeline can only be driven in-process
+    return args
+
+async def main(argv=None):
+    args = parse_args(argv)
+    server = None
+    if args.target:
+        upstream_url = args.upstream
+        api = httpx.AsyncClient(base_url=args.target, timeout=None)
+    else:
+        server = UpstreamServer(fake_upstreams.create_app(fake_upstreams.profiles_from_args(args), args.seed))
+        upstream_url = server.start()
+        configure_environment(upstream_url, tempfile.mkdtemp())
+        configure_redis(args.redis)
+        import main as api_main
+
+        api = httpx.AsyncClient(transport=httpx.ASGITransport(app=api_main.app), base_url="http://benchmark", timeout=None)
+
+    try:
+        async with api, httpx.AsyncClient(base_url=upstream_url) as upstream:
+            results = await benchmark(args, api, upstream, reset_caches=None if args.target else reset_local_caches)
+    finally:
+        if server:
+            server.stop()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions beyond tolerance:\n  " + "\n  ".join(regressions))
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
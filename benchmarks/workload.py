@@ -0,0 +1,53 @@
+"""Query mixes for the benchmark load generator."""
+import json
+import random
+from benchmarks.fake_upstreams import AMBIGUOUS, COMPANIES
+
+# One phrasing per category, so the mix exercises every branch of the classifier
+TEMPLATES = [
+    "Tell me about {company}",
+    "What is {company}'s business model?",
+    "Where is {company} headquartered?",
+    "Who is the CEO of {company}?",
+    "What products does {company} offer?",
+    "What are {company}'s latest investments?",
+    "What companies has {company} acquired?",
+    "What is the latest news about {company}?",
+    "Who are {company}'s main customers?",
+    "What is {company}'s revenue?",
+]
+
+def default_mix(size, seed=0, zipf=1.1):
+    """`size` queries over the fake catalog, Zipf-weighted so popular companies repeat like real traffic."""
+    rng = random.Random(seed)
+    pairs = [(company, template) for company in COMPANIES for template in TEMPLATES]
+    rng.shuffle(pairs)
+    weights = [1 / (rank ** zipf) for rank in range(1, len(pairs) + 1)]
+    return [template.format(company=company) for company, template in rng.choices(pairs, weights, k=size)]
+
+def ambiguous_mix(size, seed=0):
+    """Queries naming an ambiguous company, for the /clarify/ scenario."""
+    rng = random.Random(seed)
+    return [rng.choice(TEMPLATES).format(company=rng.choice(list(AMBIGUOUS))) for _ in range(size)]
+
+def load_queries(path):
+    """Reads a query mix from a file.
+
+    Plain text files hold one query per line. JSONL files hold one object per line and
+    use its "query" or "user_query" field, falling back to "title" so backlog files in
+    the requests.jsonl format replay as-is.
+    """
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith((".jsonl", ".ndjson")):
+                record = json.loads(line)
+                query = record.get("query") or record.get("user_query") or record.get("title")
+                if query:
+                    queries.append(query)
+            else:
+                queries.append(line)
+    return queries
@@ -0,0 +1,539 @@
+import asyncio
+import builtins
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from redis.exceptions import RedisError
+import admission
+import cache_codec
+import metrics
+import singleflight
+
+# Fresh lifetime per query category; slow-moving facts live longer than news
+CATEGORY_TTLS = {
+    "Company Overview": 86400,
+    "Business Model": 86400,
+    "Location": 7 * 86400,
+    "Key People": 86400,
+    "Products": 43200,
+    "Investments": 3600,
+    "Acquisitions": 21600,
+    "Recent News": 600,
+    "Customers": 43200,
+    "Revenue": 43200,
+}
+DEFAULT_TTL = int(os.getenv("CACHE_DEFAULT_TTL", 3600))
+# How long past its fresh lifetime a value may still be served while it is refreshed
+STALE_TTL = int(os.getenv("CACHE_STALE_TTL", 3600))
+L1_MAX_ENTRIES = int(os.getenv("CACHE_L1_MAX_ENTRIES", 10000))
+# Namespaces whose entries are indexed by tag and can be invalidated (see ainvalidate)
+TAGGED_NAMESPACES = ("query_result", "company_info", "refined_response", "classification")
+# Replicas drop invalidated keys from their local tier when they hear about them here
+INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "cache:invalidate")
+INVALIDATION_BATCH = 500
+
+# Set inside background refreshes so nested lookups recompute instead of serving stale data
+_revalidating = contextvars.ContextVar("cache_revalidating", default=False)
+# Set by the pre-warmer so read-throughs recompute even entries that are still fresh
+_forced = contextvars.ContextVar("cache_forced_refresh", default=False)
+# The open request_scope's batch, if any
+_batch = contextvars.ContextVar("cache_batch", default=None)
+_refresh_tasks = set()
+
+def ttl_for(query_type):
+    """Fresh TTL in seconds for a query category."""
+    return CATEGORY_TTLS.get(query_type, DEFAULT_TTL)
+
+class LocalCache:
+    """Bounded in-process LRU whose entries carry a fresh and a stale deadline."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns (value, fresh) or None if the key is missing or past its stale deadline."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, fresh_until, stale_until, _ = entry
+            if now >= stale_until:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value, now < fresh_until
+
+    def set(self, key, value, fresh_until, tags=()):
+        with self._lock:
+            self._entries[key] = (value, fresh_until, fresh_until + STALE_TTL, frozenset(tags))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def fresh_until(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry else None
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def delete_tagged(self, tags):
+        """Drops entries written with all of `tags`; returns how many were dropped."""
+        tags = frozenset(tags)
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if tags <= entry[3]]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        """Drops every entry; returns how many there were."""
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+        return count
+
+_local = LocalCache(L1_MAX_ENTRIES)
+
+def clear_local():
+    """Drops every in-process entry (Redis is untouched)."""
+    _local.clear()
+
+def tags_for(company_name=None, query_type=None):
+    """Invalidation tags for an entry about `company_name` in `query_type` (either may be omitted)."""
+    tags = []
+    if company_name:
+        tags.append(f"company:{company_name.strip().lower()}")
+    if query_type:
+        tags.append(f"type:{query_type.strip().lower()}")
+    return tags
+
+def _entry_tags(key, tags):
+    namespace = metrics.namespace(key)
+    return [f"namespace:{namespace}", *tags] if namespace in TAGGED_NAMESPACES else list(tags)
+
+def _tag_key(tag):
+    return f"tag:{tag}"
+
+def _write(key, value, ttl, tags):
+    """Stores `value` in L1 and returns its Redis write: (key, expire, payload, tags)."""
+    fresh_until = time.time() + ttl
+    tags = _entry_tags(key, tags)
+    _local.set(key, value, fresh_until, tags)
+    return key, ttl + STALE_TTL, _encode(value, fresh_until), tags
+
+def _queue_write(pipe, write, now):
+    """Adds a value and its tag index updates to a pipeline.
+
+    Each tag is a sorted set of keys scored by when they expire; expired members are
+    pruned on every write, and the set lives as long as its longest-lived member.
+    """
+    key, expire, payload, tags = write
+    pipe.setex(key, expire, payload)
+    for tag in tags:
+        tag_key = _tag_key(tag)
+        pipe.zadd(tag_key, {key: now + expire})
+        pipe.zremrangebyscore(tag_key, "-inf", now)
+        pipe.expire(tag_key, expire, nx=True)
+        pipe.expire(tag_key, expire, gt=True)
+
+def _encode(value, fresh_until):
+    return cache_codec.encode(value, fresh_until)
+
+def _decode(raw):
+    """Returns (value, fresh_until), or None for entries this version cannot read.
+
+    Schema 1 JSON envelopes and plain strings from before the binary codec are still
+    read; plain strings are treated as fresh.
+    """
+    if cache_codec.is_encoded(raw):
+        try:
+            return cache_codec.decode(raw)
+        except cache_codec.UnsupportedPayload as e:
+            logging.warning(f"⚠️ Ignoring unreadable cache entry: {e}")
+            return None
+    if isinstance(raw, bytes):
+        raw = raw.decode("utf-8")
+    try:
+        payload = json.loads(raw)
+    except ValueError:
+        return raw, time.time() + DEFAULT_TTL  # Legacy plain-text entry
+    if isinstance(payload, dict) and payload.get("_cache") == 1:
+        return payload["value"], payload["fresh_until"]
+    return payload, time.time() + DEFAULT_TTL
+
+def _from_l2(key, raw):
+    decoded = _decode(raw)
+    if decoded is None:
+        return None, False
+    value, fresh_until = decoded
+    _local.set(key, value, fresh_until)
+    return value, time.time() < fresh_until
+
+def lookup(client, key):
+    """Blocking two-tier read. Returns (value, fresh) or (None, False); Redis errors propagate."""
+    hit = _local.get(key)
+    if hit is not None:
+        return hit
+    if not client:
+        return None, False
+    with metrics.stage("redis.get"):
+        raw = client.get(key)
+    return _from_l2(key, raw) if raw else (None, False)
+
+async def alookup(client, key):
+    """Async two-tier read. Returns (value, fresh) or (None, False); Redis errors propagate."""
+    hit = _local.get(key)
+    if hit is not None:
+        return hit
+    if not client:
+        return None, False
+    batch = _batch.get()
+    if batch is not None and key in batch.misses:
+        batch.misses.discard(key)  # Only the first read trusts the prefetch; pollers go to Redis
+        return None, False
+    with metrics.stage("redis.get"):
+        raw = await client.get(key)
+    return _from_l2(key, raw) if raw else (None, False)
+
+def get(client, key):
+    """Returns the fresh cached value for `key`, or None."""
+    value, fresh = lookup(client, key)
+    metrics.record_cache(key, "hit" if fresh else "miss")
+    return value if fresh else None
+
+async def aget(client, key):
+    """Async variant of get."""
+    value, fresh = await alookup(client, key)
+    metrics.record_cache(key, "hit" if fresh else "miss")
+    return value if fresh else None
+
+def set(client, key, value, ttl, tags=()):
+    """Writes through both tiers; Redis keeps the value for `ttl` plus the stale window.
+
+    The key is indexed under `tags` (see tags_for) and its namespace, in the same round trip.
+    """
+    write = _write(key, value, ttl, tags)
+    if client:
+        with metrics.stage("redis.set"):
+            pipe = client.pipeline(transaction=False)
+            _queue_write(pipe, write, time.time())
+            pipe.execute()
+
+async def aset(client, key, value, ttl, tags=()):
+    """Async variant of set. Inside request_scope the Redis write joins the scope's pipeline."""
+    write = _write(key, value, ttl, tags)
+    batch = _batch.get()
+    if client and batch is not None and batch.add_write(write):
+        return
+    if client:
+        await _execute(client, [write])
+
+async def amget(client, keys):
+    """Two-tier read of many keys: L1 first, then one MGET for the rest.
+
+    Returns {key: (value, fresh)} for every key in `keys`; Redis errors propagate.
+    """
+    results = {}
+    remote = []
+    for key in dict.fromkeys(keys):
+        hit = _local.get(key)
+        if hit is not None:
+            results[key] = hit
+        elif client:
+            remote.append(key)
+        else:
+            results[key] = None, False
+    if remote:
+        with metrics.stage("redis.mget"):
+            raws = await client.mget(remote)
+        for key, raw in zip(remote, raws):
+            results[key] = _from_l2(key, raw) if raw else (None, False)
+    return results
+
+async def aget_many(client, keys):
+    """Fresh cached values for `keys` (None where missing or stale), in order, in one round trip."""
+    found = await amget(client, keys)
+    values = []
+    for key in keys:
+        value, fresh = found[key]
+        metrics.record_cache(key, "hit" if fresh else "miss")
+        values.append(value if fresh else None)
+    return values
+
+async def aset_many(client, items):
+    """Writes (key, value, ttl, tags) items through both tiers with one Redis pipeline."""
+    writes = [_write(key, value, ttl, tags) for key, value, ttl, tags in items]
+    if client and writes:
+        await _execute(client, writes)
+
+async def _execute(client, writes, releases=()):
+    now = time.time()
+    with metrics.stage("redis.pipeline"):
+        async with client.pipeline(transaction=False) as pipe:
+            for write in writes:
+                _queue_write(pipe, write, now)
+            for lock_key, token in releases:
+                singleflight.queue_release(pipe, lock_key, token)
+            await pipe.execute()
+
+class _Batch:
+    """Redis traffic of one request: keys known to be missing, and writes and lease releases to send together."""
+
+    def __init__(self):
+        self.misses = builtins.set()
+        self.writes = []
+        self.releases = []
+        self.closed = False
+
+    def add_write(self, write):
+        if self.closed:
+            return False
+        self.writes.append(write)
+        return True
+
+    def add_release(self, lock_key, token):
+        if self.closed:
+            return False
+        self.releases.append((lock_key, token))
+        return True
+
+async def aprefetch(client, keys):
+    """Loads `keys` into L1 with one MGET; inside request_scope, keys Redis lacks skip their own GET."""
+    if not client or _forced.get():
+        return
+    try:
+        found = await amget(client, keys)
+    except RedisError as e:
+        logging.warning(f"⚠️ Redis error when prefetching {len(keys)} keys: {e}")
+        return
+    batch = _batch.get()
+    if batch is not None:
+        batch.misses.update(key for key, (value, _) in found.items() if value is None)
+
+@asynccontextmanager
+async def request_scope(client, prefetch=()):
+    """Batches one request's cache traffic.
+
+    `prefetch` keys are read with one MGET up front. Redis writes made inside the
+    block (including those of computations it starts) are held back, then sent with
+    their single-flight lease releases in one pipeline when the block exits; leases
+    are released after the values they guard are written. Work that outlives the
+    block writes directly.
+    """
+    batch = _Batch()
+    token = _batch.set(batch)
+    try:
+        with singleflight.deferring_releases(batch.add_release if client else None):
+            await aprefetch(client, prefetch)
+            yield
+    finally:
+        batch.closed = True
+        _batch.reset(token)
+        if client and (batch.writes or batch.releases):
+            try:
+                await _execute(client, batch.writes, batch.releases)
+            except RedisError as e:
+                logging.warning(f"⚠️ Redis error when writing {len(batch.writes)} cached entries: {e}")
+
+@contextmanager
+def forced_refresh():
+    """Makes read-throughs inside the block recompute and overwrite their entries, fresh or not."""
+    token = _forced.set(True)
+    try:
+        yield
+    finally:
+        _forced.reset(token)
+
+async def aexpires_in(client, key):
+    """Seconds until `key` stops being fresh (negative once stale), or None if it is not cached."""
+    if client:
+        with metrics.stage("redis.get"):
+            raw = await client.get(key)
+        decoded = _decode(raw) if raw else None
+        return decoded[1] - time.time() if decoded else None
+    fresh_until = _local.fresh_until(key)
+    return fresh_until - time.time() if fresh_until is not None else None
+
+async def aexpires_in_many(client, keys):
+    """aexpires_in for many keys with one MGET, in order."""
+    if not client:
+        return [await aexpires_in(None, key) for key in keys]
+    with metrics.stage("redis.mget"):
+        raws = await client.mget(keys)
+    now = time.time()
+    results = []
+    for raw in raws:
+        decoded = _decode(raw) if raw else None
+        results.append(decoded[1] - now if decoded else None)
+    return results
+
+async def aget_or_compute(client, key, compute, ttl, cacheable=lambda value: value is not None, tags=()):
+    """Stale-while-revalidate read-through.
+
+    Fresh hits return immediately. Stale hits return immediately and refresh in the
+    background. Misses run `compute()` once for all concurrent callers (see singleflight).
+    `ttl` and `tags` may be values or callables taking the computed value. Redis errors
+    degrade to the local tier instead of failing the request. Inside forced_refresh()
+    every lookup is treated as a miss.
+    """
+    if _forced.get():
+        value, fresh = None, False
+    else:
+        try:
+            value, fresh = await alookup(client, key)
+        except RedisError as e:
+            logging.warning(f"⚠️ Redis error when reading {key}: {e}")
+            value, fresh = _local.get(key) or (None, False)
+
+        metrics.record_cache(key, "miss" if value is None else "hit" if fresh else "stale")
+        if value is not None and fresh:
+            return value
+
+    async def compute_and_store():
+        result = await compute()
+        if cacheable(result):
+            try:
+                await aset(
+                    client, key, result, ttl(result) if callable(ttl) else ttl, tags(result) if callable(tags) else tags
+                )
+            except RedisError as e:
+                logging.warning(f"! Redis caching failed for {key}: {e}")
+        return result
+
+    if value is not None and not _revalidating.get():
+        _schedule_refresh(client, key, compute_and_store)
+        return value
+
+    async def read_back():
+        try:
+            value, fresh = await alookup(client, key)
+        except RedisError:
+            return None
+        return value if fresh else None
+
+    return await singleflight.coalesce(key, compute_and_store, client=client, lookup=read_back)
+
+async def _afresh_from_l2(client, key):
+    """The fresh value Redis holds for `key` (also loaded into L1), or None; a stale L1 copy is skipped."""
+    if not client:
+        return None
+    try:
+        with metrics.stage("redis.get"):
+            raw = await client.get(key)
+    except RedisError:
+        return None
+    value, fresh = _from_l2(key, raw) if raw else (None, False)
+    return value if fresh else None
+
+def _schedule_refresh(client, key, compute_and_store):
+    """Refreshes a stale entry in the background, once across processes.
+
+    Another process may already have written a fresh value to Redis, so that is
+    adopted if present. Otherwise the refresh takes the same lease as a miss, and
+    processes that lose it pick up the winner's value.
+    """
+    async def refresh():
+        _revalidating.set(True)
+        _batch.set(None)  # Runs past the request that scheduled it, so it writes directly
+        try:
+            with singleflight.deferring_releases(None), admission.priority("background"):
+                lookup = lambda: _afresh_from_l2(client, key)
+                if await lookup() is None:
+                    await singleflight.coalesce(key, compute_and_store, client=client, lookup=lookup)
+        except Exception as e:
+            logging.warning(f"⚠️ Background refresh failed for {key}: {e}")
+
+    logging.info(f" Serving stale value for {key}, refreshing in background")
+    task = asyncio.create_task(refresh())
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+
+# -- Invalidation ------------------------------------------------------------------
+
+async def _tagged_keys(client, tags):
+    """Keys indexed under every tag in `tags`, read with one pipeline.
+
+    Members whose keys have expired are pruned from each tag first, so they are not counted.
+    """
+    now = time.time()
+    async with client.pipeline(transaction=False) as pipe:
+        for tag in tags:
+            pipe.zremrangebyscore(_tag_key(tag), "-inf", now)
+            pipe.zrange(_tag_key(tag), 0, -1)
+        members = (await pipe.execute())[1::2]
+    keys = builtins.set(members[0])
+    for more in members[1:]:
+        keys &= builtins.set(more)
+    return sorted(k.decode("utf-8") if isinstance(k, bytes) else k for k in keys)
+
+async def ainvalidate(client, company_name=None, query_type=None, namespace=None):
+    """Drops the entries matching every given filter from Redis and all local tiers.
+
+    With no filter, every entry in TAGGED_NAMESPACES is dropped (ambiguity and other
+    state is kept). Keys come from the tag index, so the cost is proportional to
+    the entries matched, with no SCAN. Other processes drop the keys from their
+    local tier when the invalidation is published. Returns the number of keys dropped.
+    """
+    tags = tags_for(company_name, query_type) + ([f"namespace:{namespace}"] if namespace else [])
+    if not client:
+        return _local.delete_tagged(tags) if tags else _local.clear()
+
+    with metrics.stage("redis.invalidate"):
+        if tags:
+            keys = await _tagged_keys(client, tags)
+            emptied = [_tag_key(tags[0])] if len(tags) == 1 else []
+        else:
+            keys = []
+            for tagged in TAGGED_NAMESPACES:
+                keys.extend(await _tagged_keys(client, [f"namespace:{tagged}"]))
+            emptied = [_tag_key(f"namespace:{tagged}") for tagged in TAGGED_NAMESPACES]
+
+        _local.delete_many(keys)
+        async with client.pipeline(transaction=False) as pipe:
+            for i in range(0, len(keys), INVALIDATION_BATCH):
+                chunk = keys[i:i + INVALIDATION_BATCH]
+                pipe.delete(*chunk)
+                # Members left in other tags point at deleted keys and are pruned as they expire
+                for tag in tags:
+                    pipe.zrem(_tag_key(tag), *chunk)
+                pipe.publish(INVALIDATION_CHANNEL, json.dumps({"keys": chunk}))
+            if emptied:
+                pipe.delete(*emptied)
+            results = await pipe.execute()
+
+    # Count what DEL removed: a tagged key may already be gone (deleted elsewhere, or evicted)
+    per_chunk = len(tags) + 2
+    dropped = sum(results[i] for i in range(0, len(results) - bool(emptied), per_chunk))
+    logging.info(f" Invalidated {dropped} cache entries (company={company_name}, query_type={query_type}, namespace={namespace})")
+    return dropped
+
+async def listen_for_invalidations(client, retry_delay=1.0):
+    """Drops keys other processes invalidate from this process's local tier; runs until cancelled."""
+    while True:
+        pubsub = client.pubsub()
+        try:
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    _local.delete_many(json.loads(message["data"])["keys"])
+        except RedisError as e:
+            logging.warning(f"⚠️ Lost the cache invalidation channel, resubscribing: {e}")
+            await asyncio.sleep(retry_delay)
+        finally:
+            await pubsub.aclose()
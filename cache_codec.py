@@ -0,0 +1,79 @@
+import json
+import os
+import struct
+import threading
+
+try:
+    import orjson
+except ImportError:  # Falls back to the stdlib encoder; both write the same JSON
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # Payloads are then stored uncompressed
+    zstandard = None
+
+# Bump when the layout changes; readers treat newer versions as misses, so a rollout
+# never serves entries it cannot parse (and older entries stay readable)
+SCHEMA_VERSION = 2
+MAGIC = b"\x00ci"
+COMPRESSION_ENABLED = os.getenv("CACHE_COMPRESSION", "true").lower() == "true"
+COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", 512))
+COMPRESSION_LEVEL = int(os.getenv("CACHE_COMPRESSION_LEVEL", 3))
+
+FLAG_ZSTD = 1
+FLAG_CITATION_IS_SOURCE = 2  # `citation_url` was dropped because it equals `source`
+
+# magic, schema version, flags, fresh_until
+_HEADER = struct.Struct(">3sBBd")
+_local = threading.local()  # zstd (de)compressors are not thread-safe
+
+class UnsupportedPayload(ValueError):
+    """The entry was written in a format this process cannot read."""
+
+def _dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+def _loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+def _compressor():
+    if not hasattr(_local, "compressor"):
+        _local.compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL)
+        _local.decompressor = zstandard.ZstdDecompressor()
+    return _local.compressor, _local.decompressor
+
+def encode(value, fresh_until):
+    """Binary cache entry: fixed header, then the JSON body, zstd-compressed above COMPRESS_MIN_BYTES."""
+    flags = 0
+    if isinstance(value, dict) and "source" in value and value.get("citation_url") == value["source"]:
+        value = {k: v for k, v in value.items() if k != "citation_url"}
+        flags |= FLAG_CITATION_IS_SOURCE
+
+    body = _dumps(value)
+    if COMPRESSION_ENABLED and zstandard is not None and len(body) >= COMPRESS_MIN_BYTES:
+        body = _compressor()[0].compress(body)
+        flags |= FLAG_ZSTD
+    return _HEADER.pack(MAGIC, SCHEMA_VERSION, flags, fresh_until) + body
+
+def is_encoded(raw):
+    """Whether `raw` was written by encode() (rather than as a schema 1 JSON envelope)."""
+    return isinstance(raw, bytes) and raw.startswith(MAGIC)
+
+def decode(raw):
+    """Returns (value, fresh_until); raises UnsupportedPayload for entries from a newer schema."""
+    _, version, flags, fresh_until = _HEADER.unpack_from(raw)
+    if version > SCHEMA_VERSION:
+        raise UnsupportedPayload(f"cache schema {version} is newer than {SCHEMA_VERSION}")
+    body = raw[_HEADER.size:]
+    if flags & FLAG_ZSTD:
+        if zstandard is None:
+            raise UnsupportedPayload("entry is zstd-compressed but zstandard is not installed")
+        body = _compressor()[1].decompress(body)
+
+    value = _loads(body)
+    if flags & FLAG_CITATION_IS_SOURCE:
+        value["citation_url"] = value["source"]
+    return value, fresh_until
@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+import metrics
+from redis_config import redis_client, async_redis_client
+
+CLARIFICATION_TTL = int(os.getenv("CLARIFICATION_TTL", 600))
+# Set by workers.py; tokens name the issuing worker so the router can send /clarify/ back to it
+WORKER_ID = os.getenv("WORKER_ID")
+
+# In-memory fallback when Redis is unavailable: token -> (payload, expires_at)
+_store = {}
+_by_option = {}
+_lock = threading.Lock()
+
+def _token_key(token):
+    return f"clarify:{token}"
+
+def _option_key(option):
+    return f"clarify_option:{option.strip().lower()}"
+
+def _new_token():
+    token = secrets.token_urlsafe(12)
+    return f"{WORKER_ID}.{token}" if WORKER_ID else token
+
+def _payload(user_query, options, query_type=None):
+    return {"query": user_query, "options": list(options), "query_type": query_type}
+
+def _matches(payload, selection):
+    return selection.strip().lower() in (option.lower() for option in payload["options"])
+
+def _resolved(payload, selection):
+    """Adds the option exactly as it was offered, so later stages use the canonical entity name."""
+    selected = next(option for option in payload["options"] if option.lower() == selection.strip().lower())
+    return {**payload, "selection": selected}
+
+def _remember_locally(token, payload):
+    expires_at = time.time() + CLARIFICATION_TTL
+    with _lock:
+        _store[token] = (payload, expires_at)
+        for option in payload["options"]:
+            _by_option[option.strip().lower()] = token
+
+def _resolve_locally(selection, token):
+    with _lock:
+        token = token or _by_option.get(selection.strip().lower())
+        entry = _store.get(token) if token else None
+        if entry is None or entry[1] < time.time() or not _matches(entry[0], selection):
+            return None
+        del _store[token]
+        for option in entry[0]["options"]:
+            if _by_option.get(option.strip().lower()) == token:
+                del _by_option[option.strip().lower()]
+        return _resolved(entry[0], selection)
+
+def register(user_query, options, query_type=None):
+    """Stores an open ambiguity and returns the token /clarify/ uses to resolve it."""
+    token = _new_token()
+    payload = _payload(user_query, options, query_type)
+    if redis_client:
+        pipe = redis_client.pipeline()
+        pipe.setex(_token_key(token), CLARIFICATION_TTL, json.dumps(payload))
+        for option in payload["options"]:
+            pipe.setex(_option_key(option), CLARIFICATION_TTL, token)
+        with metrics.stage("redis.pipeline"):
+            pipe.execute()
+    else:
+        _remember_locally(token, payload)
+    return token
+
+async def aregister(user_query, options, query_type=None):
+    """Async variant of register."""
+    token = _new_token()
+    payload = _payload(user_query, options, query_type)
+    if async_redis_client:
+        pipe = async_redis_client.pipeline()
+        pipe.setex(_token_key(token), CLARIFICATION_TTL, json.dumps(payload))
+        for option in payload["options"]:
+            pipe.setex(_option_key(option), CLARIFICATION_TTL, token)
+        with metrics.stage("redis.pipeline"):
+            await pipe.execute()
+    else:
+        _remember_locally(token, payload)
+    return token
+
+async def _apayload(token):
+    if not async_redis_client:
+        with _lock:
+            entry = _store.get(token)
+        return entry[0] if entry and entry[1] >= time.time() else None
+    with metrics.stage("redis.get"):
+        raw = await async_redis_client.get(_token_key(token))
+    return json.loads(raw) if raw else None
+
+async def areissue(response, user_query):
+    """Gives an ambiguity prompt a token of its own.
+
+    For callers that shared another caller's computation (see cache.aget_or_compute):
+    tokens are single-use, so each caller needs its own for the same open ambiguity.
+    """
+    payload = await _apayload(response["clarification_token"]) if response.get("clarification_token") else None
+    if payload is None:  # Already resolved or expired; /clarify/ then re-runs classification
+        payload = _payload(user_query, response["options"])
+    token = await aregister(payload["query"], payload["options"], payload["query_type"])
+    return {**response, "clarification_token": token}
+
+async def aresolve(selection, token=None):
+    """Consumes the ambiguity `selection` answers, by token or by the selection alone.
+
+    Both lookups are O(1) key reads. Returns the stored payload plus the canonical
+    "selection", or None if the token is unknown/expired or the selection was not
+    one of its options.
+    """
+    resolved = await _aresolve(selection, token)
+    metrics.record_cache("ambiguity", "miss" if resolved is None else "hit")
+    return resolved
+
+async def _aresolve(selection, token):
+    if not async_redis_client:
+        return _resolve_locally(selection, token)
+
+    with metrics.stage("redis.get"):
+        token = token or await async_redis_client.get(_option_key(selection))
+        if not token:
+            return None
+        if isinstance(token, bytes):
+            token = token.decode("utf-8")
+        raw = await async_redis_client.get(_token_key(token))
+
+    if not raw:
+        return None
+    payload = json.loads(raw)
+    if not _matches(payload, selection):
+        logging.info(f"Selection '{selection}' is not an option for clarification {token}")
+        return None
+
+    with metrics.stage("redis.delete"):
+        # DEL is atomic, so when two requests resolve one token only one of them removes it
+        consumed = await async_redis_client.delete(_token_key(token))
+    if not consumed:
+        logging.info(f"Clarification {token} was already resolved")
+        return None
+    return _resolved(payload, selection)
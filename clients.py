@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import os
+import threading
+import weakref
+from urllib.parse import urlsplit
+import httpx
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+load_dotenv()
+
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+OPENAI_EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+TAVILY_API_URL = os.getenv("TAVILY_API_URL", "https://api.tavily.com")
+WIKIPEDIA_API_URL = os.getenv("WIKIPEDIA_API_URL", "https://en.wikipedia.org/w/api.php")
+TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 100))
+HTTP_KEEPALIVE_POOL_SIZE = int(os.getenv("HTTP_KEEPALIVE_POOL_SIZE", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 60))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 15))
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", 2))
+
+# Wikipedia asks API clients to identify themselves
+USER_AGENT = os.getenv("HTTP_USER_AGENT", "CompanyInfoRetrieval/1.0 (https://github.com/erenakbay/Intelligent-Company-Information-Retrieval-System)")
+
+try:
+    import h2  # noqa: F401 - HTTP/2 support is optional
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+def _client_options():
+    return {
+        "http2": HTTP2_AVAILABLE,
+        "timeout": HTTP_TIMEOUT,
+        "limits": httpx.Limits(
+            max_connections=HTTP_POOL_SIZE,
+            max_keepalive_connections=HTTP_KEEPALIVE_POOL_SIZE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        "headers": {"User-Agent": USER_AGENT},
+    }
+
+_http_client = None
+_async_http_clients = weakref.WeakKeyDictionary()  # event loop -> AsyncClient
+_registry_lock = threading.Lock()
+
+def get_http_client():
+    """Process-wide keep-alive HTTP client for blocking callers."""
+    global _http_client
+    with _registry_lock:
+        if _http_client is None:
+            _http_client = httpx.Client(**_client_options())
+        return _http_client
+
+def get_async_http_client():
+    """Keep-alive HTTP client for the running event loop (pools cannot be shared across loops)."""
+    loop = asyncio.get_running_loop()
+    with _registry_lock:
+        client = _async_http_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(**_client_options())
+            _async_http_clients[loop] = client
+        return client
+
+class _LoopBoundAsyncClient(httpx.AsyncClient):
+    """Sends each request through the running loop's pooled client (see get_async_http_client).
+
+    The OpenAI SDK keeps one AsyncClient for its lifetime, but the LLM is called from both
+    the sync bridge loop and the server's loop, and a pool cannot be shared across loops.
+    Connections therefore belong to the per-loop clients, and aclose() closes them.
+    """
+
+    async def send(self, request, **kwargs):
+        return await get_async_http_client().send(request, **kwargs)
+
+# Single LLM client shared by classification, verification and refinement. The SDK does not
+# retry: async calls retry through resilience.call, within the deadline and the LLM rate limit
+llm = ChatOpenAI(
+    model=OPENAI_MODEL,
+    openai_api_key=os.getenv("OPENAI_API_KEY"),
+    base_url=OPENAI_BASE_URL,
+    max_retries=0,
+    http_client=get_http_client(),
+    http_async_client=_LoopBoundAsyncClient(**_client_options()),
+)
+
+_embeddings = None
+
+def get_embeddings():
+    """Embedding client for passage re-ranking, created on first use since it is optional."""
+    global _embeddings
+    with _registry_lock:
+        if _embeddings is None:
+            _embeddings = OpenAIEmbeddings(
+                model=OPENAI_EMBEDDING_MODEL,
+                openai_api_key=os.getenv("OPENAI_API_KEY"),
+                base_url=OPENAI_BASE_URL,
+                max_retries=0,
+                http_client=get_http_client(),
+                http_async_client=_LoopBoundAsyncClient(**_client_options()),
+            )
+        return _embeddings
+
+async def aembed(texts):
+    """Embedding vectors for `texts`, in order."""
+    return await get_embeddings().aembed_documents(texts)
+
+# -- Sync bridge ---------------------------------------------------------------
+
+_bridge_loop = None
+
+def run_sync(coro):
+    """Runs a coroutine from blocking code on one long-lived loop, so async pools stay reusable."""
+    global _bridge_loop
+    with _registry_lock:
+        if _bridge_loop is None:
+            _bridge_loop = asyncio.new_event_loop()
+            threading.Thread(target=_bridge_loop.run_forever, name="sync-bridge", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _bridge_loop).result()
+
+# -- Wikipedia -----------------------------------------------------------------
+
+def _search_params(query, limit):
+    return {"action": "query", "list": "search", "srsearch": query, "srlimit": limit, "srprop": "", "format": "json"}
+
+def _page_params(title):
+    return {
+        "action": "query", "prop": "extracts|info", "explaintext": 1, "inprop": "url",
+        "redirects": 1, "titles": title, "format": "json",
+    }
+
+def _revision_params(title):
+    return {"action": "query", "prop": "info", "redirects": 1, "titles": title, "format": "json"}
+
+def _parse_search(payload):
+    return [result["title"] for result in payload.get("query", {}).get("search", [])]
+
+def _existing_page(payload):
+    for page in payload.get("query", {}).get("pages", {}).values():
+        if "missing" not in page and "invalid" not in page:
+            return page
+    return None
+
+def _parse_page(payload):
+    """Returns {"title", "url", "content", "revision_id"} for the first existing page, or None."""
+    page = _existing_page(payload)
+    if page is None:
+        return None
+    return {
+        "title": page["title"],
+        "url": page.get("fullurl", ""),
+        "content": page.get("extract", ""),
+        "revision_id": page.get("lastrevid"),
+    }
+
+def _parse_revision(payload):
+    page = _existing_page(payload)
+    return page.get("lastrevid") if page else None
+
+def wiki_search(query, limit=10):
+    """Wikipedia page titles matching `query`, over the shared connection pool."""
+    response = get_http_client().get(WIKIPEDIA_API_URL, params=_search_params(query, limit))
+    response.raise_for_status()
+    return _parse_search(response.json())
+
+async def awiki_search(query, limit=10):
+    """Async variant of wiki_search."""
+    response = await get_async_http_client().get(WIKIPEDIA_API_URL, params=_search_params(query, limit))
+    response.raise_for_status()
+    return _parse_search(response.json())
+
+def wiki_page(title):
+    """Plain-text content, URL and revision ID of a Wikipedia page (redirects followed), or None."""
+    response = get_http_client().get(WIKIPEDIA_API_URL, params=_page_params(title))
+    response.raise_for_status()
+    return _parse_page(response.json())
+
+async def awiki_page(title):
+    """Async variant of wiki_page."""
+    response = await get_async_http_client().get(WIKIPEDIA_API_URL, params=_page_params(title))
+    response.raise_for_status()
+    return _parse_page(response.json())
+
+def wiki_revision(title):
+    """Current revision ID of a Wikipedia page (a cheap metadata-only request), or None."""
+    response = get_http_client().get(WIKIPEDIA_API_URL, params=_revision_params(title))
+    response.raise_for_status()
+    return _parse_revision(response.json())
+
+async def awiki_revision(title):
+    """Async variant of wiki_revision."""
+    response = await get_async_http_client().get(WIKIPEDIA_API_URL, params=_revision_params(title))
+    response.raise_for_status()
+    return _parse_revision(response.json())
+
+# -- Tavily --------------------------------------------------------------------
+
+def _tavily_body(query, max_results):
+    return {"api_key": TAVILY_API_KEY, "query": query, "max_results": max_results}
+
+def tavily_search(query, max_results=3):
+    """Tavily search results as a list of {"url", "content", ...} dicts."""
+    response = get_http_client().post(f"{TAVILY_API_URL}/search", json=_tavily_body(query, max_results))
+    response.raise_for_status()
+    return response.json().get("results", [])
+
+async def atavily_search(query, max_results=3):
+    """Async variant of tavily_search."""
+    response = await get_async_http_client().post(f"{TAVILY_API_URL}/search", json=_tavily_body(query, max_results))
+    response.raise_for_status()
+    return response.json().get("results", [])
+
+# -- Lifecycle -----------------------------------------------------------------
+
+def _origin(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}/"
+
+async def awarmup():
+    """Opens DNS/TLS connections to every upstream so the first real requests reuse them."""
+    client = get_async_http_client()
+    targets = [_origin(WIKIPEDIA_API_URL), _origin(TAVILY_API_URL)]
+
+    async def touch(url):
+        try:
+            await client.head(url)
+        except httpx.HTTPError as e:
+            logging.warning(f"⚠️ Warmup request to {url} failed: {e}")
+
+    async def touch_llm():
+        try:
+            await llm.root_async_client.models.list()
+        except Exception as e:
+            logging.warning(f"⚠️ LLM warmup failed: {e}")
+
+    await asyncio.gather(
+        *[touch(url) for url in targets for _ in range(WARMUP_CONNECTIONS)],
+        *[touch_llm() for _ in range(WARMUP_CONNECTIONS)],
+    )
+    logging.info(f" Warmed up upstream connections (HTTP/2: {HTTP2_AVAILABLE})")
+
+async def aclose():
+    """Closes the pooled clients for the running loop, including the connections the LLM and embeddings used."""
+    client = _async_http_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
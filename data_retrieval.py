@@ -1,152 +1,212 @@
 import os
 import time
+import asyncio
 import datetime
 import logging
 from dotenv import load_dotenv
 from langsmith import traceable, Client
-from langchain_community.tools import TavilySearchResults
 from langgraph.graph import StateGraph
-from langchain_openai import OpenAI
-from langchain_community.utilities.wikipedia import WikipediaAPIWrapper
+from langchain_core.runnables import RunnableLambda
 from pydantic import BaseModel
-from user_query import process_user_query 
-from langchain_community.tools.wikipedia.tool import WikipediaQueryRun
-from utils import refine_response  
-import wikipedia
-from redis_config import redis_client  
+from user_query import process_user_query, aprocess_user_query, aprocess_user_queries
+from utils import arefine_response, refined_response_key
+import clients
+import metrics
+import resilience
+import source_policy
+import passage_index
+import progress
+from redis_config import redis_client, async_redis_client
+from entity_index import company_index
+from page_store import page_store, aget_page
 from redis.exceptions import RedisError
-import json
+import cache
+import admission
+import logging_config
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Retrieve API Keys 
-WIKIPEDIA_API_KEY = os.getenv("WIKIPEDIA_ACCESS_TOKEN")
-TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
 LANGSMITH_API_KEY = os.getenv("LANGSMITH_API_KEY")
 LANGSMITH_API_KEY = os.getenv("LANGSMITH_API_KEY")
 LANGSMITH_TRACING = os.getenv("LANGSMITH_TRACING", "false").lower() == "true"
 LANGSMITH_PROJECT = os.getenv("LANGSMITH_PROJECT")
 
-clarification_store = {}
+# Time budget for the whole graph, and the share of it the source nodes may use
+# (the rest is left for refinement); sources that miss it are dropped, not waited for
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", 12))
+SOURCE_DEADLINE = float(os.getenv("SOURCE_DEADLINE", 7))
+# Shortest passage that lets a first-sufficient category skip the slower source
+MIN_SUFFICIENT_CHARS = int(os.getenv("MIN_SUFFICIENT_CHARS", 50))
+# Extra source rounds with a rewritten query when every source found nothing, and the
+# least deadline budget (seconds) that must remain to start one
+MAX_QUERY_REWRITES = int(os.getenv("MAX_QUERY_REWRITES", 1))
+MIN_REWRITE_BUDGET = float(os.getenv("MIN_REWRITE_BUDGET", 4))
+
+# Rewrites tried in order when a category's query finds nothing; broader ones come last
+QUERY_REWRITES = {
+    "Company Overview": ["{company} company", "{company}"],
+    "Business Model": ["{company} business model revenue sources", "{company}"],
+    "Location": ["{company} headquarters", "{company}"],
+    "Key People": ["{company} CEO founders executives", "{company}"],
+    "Products": ["{company} products", "{company}"],
+    "Investments": ["{company} investment funding", "{company}"],
+    "Acquisitions": ["{company} acquisition", "{company}"],
+    "Recent News": ["{company} news", "{company}"],
+    "Customers": ["{company} customers clients", "{company}"],
+    "Revenue": ["{company} annual revenue", "{company}"],
+}
+DEFAULT_REWRITES = ["{company}"]
 
 # LangSmith Initialization
 langsmith_client = Client(api_key=LANGSMITH_API_KEY) if LANGSMITH_TRACING else None
 
-# Configure Logging
-logging.basicConfig(
-    filename="system_logs.log",
-    level=logging.DEBUG,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S"
-)
-
-# GPT Initialization
-llm = OpenAI(model="gpt-3.5-turbo", openai_api_key=os.getenv("OPENAI_API_KEY"))
-
-# Initialize Wikipedia & Tavily Tools
-wikipedia_api = WikipediaAPIWrapper(api_key=WIKIPEDIA_API_KEY)
-wikipedia_tool = WikipediaQueryRun(api_wrapper=wikipedia_api)
-tavily_tool = TavilySearchResults(k=3, tavily_api_key=TAVILY_API_KEY)
+# Configure Logging (queued JSON lines in a rotating file; see logging_config)
+logging_config.configure_logging()
 
 class RetrievalState(BaseModel):
     query: str
     query_type: str
-    wiki_result: str = None
-    wiki_source: str = None  
-    tavily_result: str = None
-    tavily_source: str = None  
-    final_result: str = None
+    company_name: str | None = None
+    wiki_result: str | None = None
+    wiki_source: str | None = None
+    tavily_result: str | None = None
+    tavily_source: str | None = None
+    final_result: dict | None = None
+    # Set by the rewrite stage; sources search with it instead of `query`
+    search_query: str | None = None
+    rewrites: int = 0
+    wiki_failed: bool = False
+    tavily_failed: bool = False
+
+def _node(stage, afunc):
+    """Registers an async node, timed as `stage`, so the compiled graph supports both `ainvoke` and blocking `invoke`."""
+    async def timed(state):
+        with metrics.stage(stage):
+            return await afunc(state)
+
+    return RunnableLambda(lambda state: clients.run_sync(timed(state)), afunc=timed, name=afunc.__name__)
+
+def _is_sufficient(source_result):
+    """A single source can answer on its own if it returned a non-trivial passage."""
+    text = source_result.get("wiki_result") or source_result.get("tavily_result") or ""
+    return len(text.strip()) >= MIN_SUFFICIENT_CHARS
+
+async def _select_passages(documents, state, key=None):
+    """Top passages of `documents` ((text, url) pairs) for the query's category, as (text, url)."""
+    embed = (lambda texts: resilience.call("llm", clients.aembed, texts)) if passage_index.EMBEDDINGS_ENABLED else None
+    with metrics.stage("rank"):
+        return await passage_index.aselect(documents, state.query, state.query_type, key=key, embed=embed)
+
+def _next_rewrite(state):
+    """The next rewritten search query for the state's category, or None when none is left."""
+    company = state.company_name or state.query
+    current = state.search_query or state.query
+    for template in QUERY_REWRITES.get(state.query_type, DEFAULT_REWRITES)[state.rewrites:]:
+        rewritten = template.format(company=company)
+        if rewritten.lower() != current.lower():
+            return rewritten
+    return None
+
+def _route_after_sources(state):
+    """Sends empty results through one more source round with a rewritten query, if worthwhile.
+
+    Not when a source answered, the retry budget is spent, both sources errored (a
+    new query will not fix an outage), too little of the deadline is left, or there
+    is no rewrite left to try.
+    """
+    if state.wiki_result or state.tavily_result:
+        return "process_results"
+    if state.rewrites >= MAX_QUERY_REWRITES or (state.wiki_failed and state.tavily_failed):
+        return "process_results"
+    budget = resilience.remaining()
+    if budget is not None and budget < MIN_REWRITE_BUDGET:
+        return "process_results"
+    return "rewrite_query" if _next_rewrite(state) else "process_results"
 
 def build_graph():
     """Defines the LangGraph workflow for retrieval & processing."""
     graph = StateGraph(RetrievalState)  
     
     def start_node(state):
-        logging.info(f"Starting graph with query: {state.query}")
+        logging.debug("Starting graph with query: %s", state.query)
         return state  
     
     graph.add_node("START", start_node)
 
-    def query_wikipedia(state):
-        """Fetches data from Wikipedia with URLs."""
-        retries = 2  
-        for attempt in range(retries):
-            try:
-                search_results = wikipedia.search(state.query)
-
-                if not search_results:
-                    return {
-                        "wiki_result": "No relevant Wikipedia content found.", "wiki_source": "No Wikipedia source available."}
-
-                # Take the first search result as the most relevant page
-                page_title = search_results[0]
-                wiki_page = wikipedia.page(page_title, auto_suggest=False)
-                wiki_url = wiki_page.url
-                extracted_text = wiki_page.content[:500] 
-
-                return {"wiki_result": extracted_text, "wiki_source": wiki_url}
-
-            except Exception as e:
-                logging.error(f"Wikipedia retrieval failed (Attempt {attempt+1}): {e}")
-                time.sleep(1)  
-
-        return {
-            "wiki_result": "! Wikipedia query failed.",
-            "wiki_source": "No Wikipedia source available."
-        }
-
-    def extract_relevant_text(text, query):
-        """Extracts the most relevant paragraph from a Wikipedia summary."""
-        paragraphs = text.split("\n")  
-        relevant_paragraphs = [p for p in paragraphs if query.lower() in p.lower()]
-        return relevant_paragraphs[0] if relevant_paragraphs else text[:500]  
-
-    def query_tavily(state):
-        '''Fetches data from Tavily with URLs.'''
-        retries = 2  
-        for attempt in range(retries):
-            try:
-                tavily_tool = TavilySearchResults(k=3, tavily_api_key=TAVILY_API_KEY)
-                tavily_response = tavily_tool.run(state.query)
-
-                if isinstance(tavily_response, list) and len(tavily_response) > 0:
-                    extracted_text = tavily_response[0].get("content", "No relevant text found.")
-                    filtered_text = extract_relevant_text(extracted_text, state.query)
-                    source_url = tavily_response[0].get("url", "No Tavily source available.")
-                else:
-                    filtered_text = "No relevant data found."
-                    source_url = "No Tavily source available."
-
-                if filtered_text.strip():
-                    return {"tavily_result": filtered_text, "tavily_source": source_url}
-                
-            except Exception as e:
-                logging.error(f"Tavily retrieval failed (Attempt {attempt+1}): {e}")
-                time.sleep(1)  
-
-        return {"tavily_result": "! Tavily query failed.", "tavily_source": "No Tavily source available."}
+    async def query_wikipedia(state):
+        """Fetches data from Wikipedia with URLs; an unavailable source yields no result instead of an error."""
+        no_result = {"wiki_result": None, "wiki_source": "No Wikipedia source available."}
+        search_query = state.search_query or state.query
+        try:
+            with resilience.deadline(SOURCE_DEADLINE):
+                # Companies in the index already know their page, so skip the search
+                page_title = company_index.wiki_title(state.company_name)
+                if page_title is None:
+                    search_results = await resilience.call("wikipedia", clients.awiki_search, search_query)
+                    if not search_results:
+                        return no_result
+                    # Take the first search result as the most relevant page
+                    page_title = search_results[0]
+
+                # Full pages are kept locally, so other categories for this company reuse them
+                wiki_page = await aget_page(
+                    page_store,
+                    page_title,
+                    lambda title: resilience.call("wikipedia", clients.awiki_page, title),
+                    lambda title: resilience.call("wikipedia", clients.awiki_revision, title),
+                )
+        except Exception as e:
+            logging.error(f"Wikipedia retrieval failed: {e!r}")
+            return {**no_result, "wiki_failed": True}
+
+        if wiki_page is None or not wiki_page["content"].strip():
+            return no_result
+        # Rank the whole page; its index is reused until the page's revision changes
+        passages = await _select_passages(
+            [(wiki_page["content"], wiki_page["url"])],
+            state,
+            key=f"wiki:{wiki_page['title']}:{wiki_page.get('revision_id')}",
+        )
+        return {"wiki_result": "\n".join(text for text, _ in passages), "wiki_source": wiki_page["url"]}
+
+    async def query_tavily(state):
+        '''Fetches data from Tavily with URLs; an unavailable source yields no result instead of an error.'''
+        no_result = {"tavily_result": None, "tavily_source": "No Tavily source available."}
+        try:
+            with resilience.deadline(SOURCE_DEADLINE):
+                tavily_response = await resilience.call("tavily", clients.atavily_search, state.search_query or state.query)
+        except Exception as e:
+            logging.error(f"Tavily retrieval failed: {e!r}")
+            return {**no_result, "tavily_failed": True}
+
+        if not tavily_response:
+            return no_result
+        # Rank passages across every result rather than trusting the first one
+        passages = await _select_passages(
+            [(result.get("content", ""), result.get("url", "No Tavily source available.")) for result in tavily_response],
+            state,
+        )
+        if not passages:
+            return no_result
+        return {"tavily_result": "\n".join(text for text, _ in passages), "tavily_source": passages[0][1]}
 
     # Processing Node 
-    def process_results(state, retry_count=0, max_retries=2):
-        """Processes Wikipedia & Tavily results, refines the query if needed, and assigns confidence scores."""
+    async def process_results(state):
+        """Merges whichever sources answered in time, assigns a confidence score and refines the answer."""
         wiki_result = getattr(state, "wiki_result", None)
         wiki_source = getattr(state, "wiki_source", None)
         tavily_result = getattr(state, "tavily_result", None)
         tavily_source = getattr(state, "tavily_source", None)
 
-        logging.info(f"Wikipedia Result -> {wiki_result}")  
-        logging.info(f"Tavily Result -> {tavily_result}")  
+        # Payloads are logged lazily at DEBUG so the default level skips formatting them
+        logging.debug("Wikipedia Result -> %s", wiki_result)
+        logging.debug("Tavily Result -> %s", tavily_result)
 
         if not wiki_result and not tavily_result:
-            if retry_count < max_retries:
-                logging.info(f"⚠️ No results found. Refining query and retrying... (Attempt {retry_count + 1})")
-                refined_query = f"{state.query} detailed explanation"
-                state.query = refined_query
-                return process_results(build_graph().invoke(state), retry_count + 1)  # Retry with refined query
-            
-            logging.warning("Max retries reached. No results found.")
-            return {"final_result": "! No relevant data found after multiple attempts.", "confidence_score": 0.0, "source": "N/A"}
+            logging.warning("No source returned data in time.")
+            return {"final_result": {"response": "! No relevant data found.", "confidence_score": 0.0, "source": "N/A"}}
 
         if wiki_result and not tavily_result:
             best_result = wiki_result
@@ -165,7 +225,7 @@ def build_graph():
         else:
             confidence_score = 0.5  # Weak data
 
-        refined_text = refine_response(best_result, state.query_type, state.query)
+        refined_text = await arefine_response(best_result, state.query_type, state.query, state.company_name)
 
         refined = {
             "response": refined_text,
@@ -173,17 +233,46 @@ def build_graph():
             "source": source.strip() if source else "No sources available."
         }
 
-        logging.info(f" Refined Response -> {refined}")  
+        logging.debug(" Refined Response -> %s", refined)
         return {"final_result": refined}
 
-    graph.add_node("wikipedia", query_wikipedia)
-    graph.add_node("tavily", query_tavily)
-    graph.add_node("process_results", process_results)
-
-    graph.add_edge("START", "wikipedia")  
-    graph.add_edge("START", "tavily")  
-    graph.add_edge("wikipedia", "process_results")
-    graph.add_edge("tavily", "process_results")
+    async def query_sources(state):
+        """Fetches Wikipedia and Tavily concurrently under the category's source policy."""
+        def timed(stage, fetch):
+            async def run():
+                with metrics.stage(stage):
+                    result = await fetch(state)
+                text = result.get("wiki_result") or result.get("tavily_result")
+                if text:
+                    url = result.get("wiki_source") or result.get("tavily_source")
+                    progress.emit("source", {"source": stage, "text": text, "url": url})
+                return result
+            return run
+
+        policy = source_policy.policy_for(state.query_type)
+        results = await source_policy.execute(
+            policy,
+            {"wikipedia": timed("wikipedia", query_wikipedia), "tavily": timed("tavily", query_tavily)},
+            _is_sufficient,
+        )
+        merged = {}
+        for result in results.values():
+            merged.update(result)
+        return merged
+
+    async def rewrite_query(state):
+        """Moves on to the category's next query rewrite for another source round."""
+        rewritten = _next_rewrite(state)
+        logging.info(f"! No source found '{state.search_query or state.query}', retrying as '{rewritten}'")
+        return {"search_query": rewritten, "rewrites": state.rewrites + 1, "wiki_failed": False, "tavily_failed": False}
+
+    graph.add_node("sources", _node("sources", query_sources))
+    graph.add_node("rewrite_query", _node("rewrite_query", rewrite_query))
+    graph.add_node("process_results", _node("process_results", process_results))
+
+    graph.add_edge("START", "sources")
+    graph.add_conditional_edges("sources", _route_after_sources, ["rewrite_query", "process_results"])
+    graph.add_edge("rewrite_query", "sources")
 
     graph.set_entry_point("START")
 
@@ -193,32 +282,66 @@ def build_graph():
 graph = build_graph()
 graph = graph.compile()
 
+def _company_info_key(query_data):
+    return f"company_info:{query_data['company_name'].strip().lower()}:{query_data['query_type'].strip().lower()}"
+
+def _build_response(query_data, final_state):
+    """Maps the graph's final state onto the API response, or None if the state is malformed."""
+    if isinstance(final_state, dict) and "final_result" in final_state:
+        response_content = final_state["final_result"]
+        logging.debug(" Final Retrieved Response: %s", response_content)
+
+        return {
+            "company_name": query_data["company_name"],
+            "query_type": query_data["query_type"],
+            "response": response_content.get("response", "Error: No final result found."),
+            "confidence_score": response_content.get("confidence_score", 0.0),
+            "source": response_content.get("source", "No sources available."),
+            "citation_url": response_content.get("source", "No citation URL available."),
+        }
+
+    logging.error(" Invalid final state format received.")
+    return None
+
+def is_cacheable(response):
+    """Only real answers are cached; errors, ambiguity prompts and empty results are retried next time."""
+    return isinstance(response, dict) and response.get("confidence_score", 0.0) > 0
+
+def _invalid_format_response(query_data):
+    return {
+        "company_name": query_data["company_name"],
+        "query_type": query_data["query_type"],
+        "response": "Error: Invalid response format.",
+        "confidence_score": 0.0,
+        "source": "No sources available.",
+        "citation_url": "N/A",
+    }
+
+def _internal_error_response():
+    return {
+        "company_name": "Unknown",
+        "query_type": "Unknown",
+        "response": "An internal error occurred. Please try again later.",
+        "confidence_score": 0.0,
+        "source": "No sources available.",
+        "citation_url": "N/A",
+    }
+
 @traceable
 def retrieve_information(user_query):
     """Retrieves structured company data using LangChain + LangGraph error handling and LangSmith tracing."""
     logging.info(f"Received user query: {user_query}")
     query_data = process_user_query(user_query) 
 
-    if "ambiguous_options" in query_data:
-        logging.warning(f"⚠️ Query is ambiguous: {query_data['ambiguous_options']}")
-
-        if redis_client:
-            redis_client.setex(f"ambiguity:{user_query}", 600, json.dumps(query_data["ambiguous_options"]))
-
-        clarification_store[user_query] = query_data["ambiguous_options"]
-
-        return {
-            "message": "Your query is ambiguous.",
-            "options": query_data["ambiguous_options"],
-            "next_step": "Please select one of the options using the /clarify/ endpoint."
-        }
+    if "structured_query" not in query_data:
+        return query_data  # Ambiguity prompt (with its clarification token) or error
 
-    cache_key = f"company_info:{query_data['company_name'].lower()}:{query_data['query_type'].lower()}"
-    cached_response = redis_client.get(cache_key) if redis_client else None
+    cache_key = _company_info_key(query_data)
+    cached_response = cache.get(redis_client, cache_key)
 
     if cached_response:
         logging.info(f"Cache hit for query: {user_query}")
-        return json.loads(cached_response)  
+        return cached_response
 
     logging.info(f"! Cache miss for query: {user_query}, processing...")
 
@@ -226,56 +349,143 @@ def retrieve_information(user_query):
     structured_query = query_data["structured_query"]
     logging.info(f"Processed Query -> {structured_query} [{query_data['query_type']}]")
 
-    initial_state = RetrievalState(query=structured_query, query_type=query_data["query_type"])
+    initial_state = RetrievalState(
+        query=structured_query, query_type=query_data["query_type"], company_name=query_data["company_name"]
+    )
 
     try:
         start_time = time.time()
         logging.info(" Starting LangGraph execution with LangSmith tracing...")
 
         # LangGraph to Fetch Data
-        final_state = graph.invoke(initial_state)
+        with metrics.stage("graph"):
+            final_state = graph.invoke(initial_state)
         elapsed_time = round(time.time() - start_time, 2)
         logging.info(f" Graph Execution Completed in {elapsed_time}s")
 
-        if isinstance(final_state, dict) and "final_result" in final_state:
-            response_content = final_state["final_result"]
-            logging.info(f" Final Retrieved Response: {response_content}")
+        response = _build_response(query_data, final_state)
+        if response is None:
+            return _invalid_format_response(query_data)
 
-            response = {
-                "company_name": query_data["company_name"],
-                "query_type": query_data["query_type"],
-                "response": response_content.get("response", "Error: No final result found."),
-                "confidence_score": response_content.get("confidence_score", 0.0),
-                "source": response_content.get("source", "No sources available."),
-                "citation_url": response_content.get("source", "No citation URL available."),
-            }
+        if is_cacheable(response):
+            try:
+                cache.set(
+                    redis_client, cache_key, response, cache.ttl_for(query_data["query_type"]),
+                    cache.tags_for(query_data["company_name"], query_data["query_type"]),
+                )
+                logging.info(f" Stored query result in cache: {cache_key}")
+            except RedisError as e:
+                logging.error(f"Redis caching failed: {e}")
 
-            if redis_client:
-                try:
-                    redis_client.setex(cache_key, 3600, json.dumps(response)) 
-                    logging.info(f" Stored query result in cache: {cache_key}")
-                except RedisError as e:
-                    logging.error(f"Redis caching failed: {e}")
+        return response  
 
-            return response  
+    except Exception as e:
+        logging.exception(f" Unexpected Error in retrieve_information: {e}")
+        return _internal_error_response()
 
-        logging.error(" Invalid final state format received.")
-        return {
-            "company_name": query_data["company_name"],
-            "query_type": query_data["query_type"],
-            "response": "Error: Invalid response format.",
-            "confidence_score": 0.0,
-            "source": "No sources available.",
-            "citation_url": "N/A",
-        }
+@traceable
+async def aretrieve_information(user_query):
+    """Async variant of retrieve_information; runs the graph with `ainvoke` so sources are fetched concurrently."""
+    logging.info(f"Received user query: {user_query}")
+    # Only the upstream calls (uncached classification, verification, the graph) queue for
+    # admission, so a query whose stages are all cached never waits or gets shed
+    query_data = await aprocess_user_query(user_query)
+
+    if "structured_query" not in query_data:
+        return query_data
+
+    return await aretrieve_company_info(query_data)
+
+async def _arun_graph(query_data):
+    """Runs the retrieval graph for classified query data."""
+    structured_query = query_data["structured_query"]
+    logging.info(f"Processed Query -> {structured_query} [{query_data['query_type']}]")
+
+    initial_state = RetrievalState(
+        query=structured_query, query_type=query_data["query_type"], company_name=query_data["company_name"]
+    )
+
+    try:
+        start_time = time.time()
+        with metrics.stage("graph"), resilience.deadline(REQUEST_DEADLINE):
+            final_state = await graph.ainvoke(initial_state)
+        elapsed_time = round(time.time() - start_time, 2)
+        logging.info(f" Graph Execution Completed in {elapsed_time}s")
+
+        response = _build_response(query_data, final_state)
+        return response if response is not None else _invalid_format_response(query_data)
 
     except Exception as e:
-        logging.exception(f" Unexpected Error in retrieve_information: {e}")
-        return {
-            "company_name": "Unknown",
-            "query_type": "Unknown",
-            "response": "An internal error occurred. Please try again later.",
-            "confidence_score": 0.0,
-            "source": "No sources available.",
-            "citation_url": "N/A",
-        }
\ No newline at end of file
+        logging.exception(f" Unexpected Error in aretrieve_information: {e}")
+        return _internal_error_response()
+
+async def _arun_admitted(query_data):
+    async with admission.admit():
+        return await _arun_graph(query_data)
+
+def _overloaded_response(query_data, error):
+    return {
+        "company_name": query_data["company_name"],
+        "query_type": query_data["query_type"],
+        "error": "Server overloaded. Please try again later.",
+        "retry_after": error.retry_after,
+    }
+
+async def aretrieve_company_info(query_data):
+    """Returns company info for classified query data through the two-tier cache.
+
+    Stale entries are served while they refresh in the background, and concurrent
+    misses share one graph run. The answer and the refined text a miss would need are
+    looked up in one round trip.
+    """
+    key = _company_info_key(query_data)
+    await cache.aprefetch(
+        async_redis_client, [key, refined_response_key(query_data["query_type"], query_data["structured_query"])]
+    )
+    return await cache.aget_or_compute(
+        async_redis_client,
+        key,
+        lambda: _arun_admitted(query_data),
+        ttl=cache.ttl_for(query_data["query_type"]),
+        cacheable=is_cacheable,
+        tags=cache.tags_for(query_data["company_name"], query_data["query_type"]),
+    )
+
+async def aretrieve_batch(user_queries, concurrency):
+    """Retrieves many queries, yielding (index, response) as each finishes.
+
+    Queries that resolve to the same company and category share one graph run, and
+    at most `concurrency` graph runs are in flight at once. Cached answers for every
+    group are read with one MGET, and each run's cache writes go out in one pipeline.
+    """
+    with admission.priority("batch"):
+        query_datas = await aprocess_user_queries(user_queries)
+
+    groups = {}  # company_info key -> (query_data, indexes)
+    for i, query_data in enumerate(query_datas):
+        if "structured_query" not in query_data:
+            yield i, query_data  # Ambiguity prompt or error
+            continue
+        groups.setdefault(_company_info_key(query_data), (query_data, []))[1].append(i)
+
+    logging.info(f" Batch of {len(user_queries)} queries deduplicated to {len(groups)} retrievals")
+    await cache.aprefetch(async_redis_client, list(groups))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(key, query_data):
+        async with semaphore, cache.request_scope(async_redis_client):
+            with admission.priority("batch"):
+                try:
+                    return key, await aretrieve_company_info(query_data)
+                except admission.Overloaded as e:
+                    return key, _overloaded_response(query_data, e)
+
+    tasks = [asyncio.ensure_future(run(key, query_data)) for key, (query_data, _) in groups.items()]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            key, response = await next_done
+            for i in groups[key][1]:
+                yield i, response
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,280 @@
+import bisect
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+try:
+    import fcntl
+except ImportError:  # Windows: saves are not serialized across processes
+    fcntl = None
+
+ENTITY_INDEX_PATH = os.getenv("ENTITY_INDEX_PATH", "company_index.json")
+# Names Wikipedia could not find are re-checked after this long, in case the company is new
+UNKNOWN_TTL = int(os.getenv("ENTITY_UNKNOWN_TTL", 86400))
+# Ambiguous names are re-checked after this long, in case Wikipedia's disambiguation changed
+AMBIGUOUS_TTL = int(os.getenv("ENTITY_AMBIGUOUS_TTL", 86400))
+FUZZY_MIN_SCORE = float(os.getenv("ENTITY_FUZZY_MIN_SCORE", 0.9))
+MAX_NAME_WORDS = 5
+
+_WORD_RE = re.compile(r"[\w&.'-]+")
+
+def normalize_name(name):
+    return " ".join(name.lower().split()).strip(" .,?!")
+
+def _trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class CompanyIndex:
+    """Local company entity index: canonical names, aliases, tickers and Wikipedia page titles.
+
+    Supports exact, prefix and fuzzy (trigram + edit-distance) lookup, and answers
+    verification for companies seen before without a network call.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.RLock()
+        self._entities = {}              # canonical -> {"aliases", "tickers", "wiki_title"}
+        self._keys = defaultdict(set)    # normalized name/alias/ticker -> canonicals
+        self._ambiguous = {}             # normalized name -> {"options" shown to the user, "at" time}
+        self._unknown = {}               # normalized name -> time it was not found
+        self._ticker_keys = set()        # tickers are only matched by direct lookup, never inside free text
+        self._sorted_keys = []
+        self._trigram_index = defaultdict(set)
+
+    # -- building -----------------------------------------------------------
+
+    def _index_key(self, key, canonical):
+        if not key:
+            return
+        if key not in self._keys:
+            bisect.insort(self._sorted_keys, key)
+            for gram in _trigrams(key):
+                self._trigram_index[gram].add(key)
+        self._keys[key].add(canonical)
+        self._unknown.pop(key, None)
+
+    def add(self, canonical, aliases=(), tickers=(), wiki_title=None):
+        """Adds or extends a verified company; returns True if anything changed."""
+        with self._lock:
+            is_new = canonical not in self._entities
+            entity = self._entities.setdefault(canonical, {"aliases": [], "tickers": [], "wiki_title": None})
+            before = json.dumps(entity, sort_keys=True)
+            for alias in aliases:
+                if alias != canonical and alias not in entity["aliases"]:
+                    entity["aliases"].append(alias)
+            for ticker in tickers:
+                if ticker.upper() not in entity["tickers"]:
+                    entity["tickers"].append(ticker.upper())
+                self._ticker_keys.add(normalize_name(ticker))
+            if wiki_title:
+                entity["wiki_title"] = wiki_title
+
+            for name in [canonical, *entity["aliases"], *entity["tickers"]]:
+                self._index_key(normalize_name(name), canonical)
+                self._ambiguous.pop(normalize_name(name), None)
+            return is_new or before != json.dumps(entity, sort_keys=True)
+
+    def add_ambiguous(self, name, options, at=None):
+        """Records that `name` needs clarification.
+
+        The options are only shown to the user; they are not verified companies
+        (a disambiguation page also lists planets, films and people).
+        """
+        with self._lock:
+            self._ambiguous[normalize_name(name)] = {"options": list(options), "at": at or time.time()}
+
+    def add_unknown(self, name):
+        with self._lock:
+            key = normalize_name(name)
+            if key not in self._keys:
+                self._unknown[key] = time.time()
+
+    # -- lookup -------------------------------------------------------------
+
+    def lookup(self, name):
+        """Exact lookup by canonical name, alias or ticker; returns a sorted list of canonicals."""
+        with self._lock:
+            return sorted(self._keys.get(normalize_name(name), ()))
+
+    def prefix(self, prefix, limit=10):
+        """Returns canonicals whose name, alias or ticker starts with `prefix`."""
+        key = normalize_name(prefix)
+        results = []
+        with self._lock:
+            start = bisect.bisect_left(self._sorted_keys, key)
+            for indexed in self._sorted_keys[start:]:
+                if not indexed.startswith(key) or len(results) >= limit:
+                    break
+                for canonical in sorted(self._keys[indexed]):
+                    if canonical not in results:
+                        results.append(canonical)
+        return results[:limit]
+
+    def fuzzy(self, name, limit=5, min_score=FUZZY_MIN_SCORE):
+        """Typo-tolerant lookup: trigram candidates ranked by edit-distance ratio."""
+        key = normalize_name(name)
+        grams = _trigrams(key)
+        overlap = defaultdict(int)
+        with self._lock:
+            for gram in grams:
+                for candidate in self._trigram_index.get(gram, ()):
+                    overlap[candidate] += 1
+
+        # Only score candidates that share a reasonable share of trigrams
+        candidates = [c for c, shared in overlap.items() if shared / len(grams) >= 0.5]
+        scored = sorted(
+            ((SequenceMatcher(None, key, c).ratio(), c) for c in candidates),
+            reverse=True,
+        )
+        results = []
+        for score, candidate in scored:
+            if score < min_score:
+                break
+            for canonical in self.lookup(candidate):
+                if canonical not in results:
+                    results.append(canonical)
+        return results[:limit]
+
+    def wiki_title(self, name):
+        """Known Wikipedia page title for a company, or None."""
+        matches = self.lookup(name) if name else []
+        if len(matches) != 1:
+            return None
+        with self._lock:
+            return self._entities[matches[0]].get("wiki_title")
+
+    def find_in(self, query):
+        """Returns the canonical name of the longest known company mentioned in `query`, or None."""
+        words = [w.strip(".'") for w in _WORD_RE.findall(query.lower())]
+        words = [w[:-2] if w.endswith("'s") else w for w in words]
+        best, best_size = None, 0
+        with self._lock:
+            for start in range(len(words)):
+                for size in range(min(MAX_NAME_WORDS, len(words) - start), best_size, -1):
+                    key = " ".join(words[start:start + size])
+                    canonicals = self._keys.get(key)
+                    if canonicals and len(canonicals) == 1 and key not in self._ticker_keys:
+                        best, best_size = next(iter(canonicals)), size
+                        break
+        return best
+
+    def __contains__(self, name):
+        return len(self.lookup(name)) == 1
+
+    def __len__(self):
+        return len(self._entities)
+
+    def resolve(self, name):
+        """Verification answer from local knowledge, or None if the network must decide."""
+        key = normalize_name(name)
+        ambiguous = self._ambiguous.get(key)
+        if ambiguous is not None and time.time() - ambiguous["at"] < AMBIGUOUS_TTL:
+            return {
+                "ambiguous": True,
+                "message": f"Multiple companies found for '{name}'. Please clarify.",
+                "options": ambiguous["options"],
+            }
+
+        matches = self.lookup(name) or self.fuzzy(name, limit=2)
+        if len(matches) == 1:
+            return {"verified": matches[0]}
+        if len(matches) > 1:
+            return {
+                "ambiguous": True,
+                "message": f"Multiple companies found for '{name}'. Please clarify.",
+                "options": matches,
+            }
+
+        not_found_at = self._unknown.get(key)
+        if not_found_at is not None and time.time() - not_found_at < UNKNOWN_TTL:
+            return {"error": f"Company not found: '{name}' does not exist."}
+        return None
+
+    def learn(self, name, verification_result, wiki_title=None):
+        """Folds a network verification result into the index; returns True if it changed."""
+        if "verified" in verification_result:
+            canonical = verification_result["verified"]
+            return self.add(canonical, aliases=[name], wiki_title=wiki_title)
+        if "ambiguous" in verification_result:
+            self.add_ambiguous(name, verification_result["options"])
+            return True
+        if str(verification_result.get("error", "")).startswith("Company not found"):
+            self.add_unknown(name)
+            return True
+        return False
+
+    # -- persistence --------------------------------------------------------
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "entities": self._entities,
+                "ambiguous": self._ambiguous,
+                "unknown": self._unknown,
+            }
+
+    def merge(self, data):
+        """Folds a saved index (see to_dict) into this one; what this index already knows wins."""
+        for canonical, entity in data.get("entities", {}).items():
+            self.add(canonical, entity.get("aliases", ()), entity.get("tickers", ()), entity.get("wiki_title"))
+        with self._lock:
+            for name, record in data.get("ambiguous", {}).items():
+                if not isinstance(record, dict):
+                    continue  # Undated entry: re-check it rather than trust it forever
+                if name not in self._keys and record["at"] > self._ambiguous.get(name, {}).get("at", 0):
+                    self.add_ambiguous(name, record["options"], at=record["at"])
+            for name, not_found_at in data.get("unknown", {}).items():
+                if name not in self._keys and not_found_at > self._unknown.get(name, 0):
+                    self._unknown[name] = not_found_at
+
+    def save(self, path=None):
+        """Atomically writes the index to disk, merged with what other processes saved there.
+
+        Workers (see workers.py) share one file; the merge runs under a file lock so
+        no worker's companies are lost to another's save.
+        """
+        path = path or self.path
+        if not path:
+            return
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(f"{path}.lock", "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)  # Released when the file closes
+                saved = _read(path)
+                if saved:
+                    self.merge(saved)
+                with self._lock, open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(self.to_dict(), f)
+                os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"⚠️ Could not persist company index: {e}")
+
+    @classmethod
+    def load(cls, path):
+        index = cls(path)
+        data = _read(path)
+        if data:
+            index.merge(data)
+            logging.info(f" Loaded {len(index)} companies from {path}")
+        return index
+
+def _read(path):
+    """A saved index, or None if there is none (or it cannot be read)."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"⚠️ Could not load company index from {path}: {e}")
+        return None
+
+company_index = CompanyIndex.load(ENTITY_INDEX_PATH)
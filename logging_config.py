@@ -0,0 +1,129 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FILE = os.getenv("LOG_FILE", "system_logs.log")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json or text
+LOG_TO_STDERR = os.getenv("LOG_TO_STDERR", "false").lower() == "true"
+# Rotation keeps the log file bounded: LOG_MAX_BYTES per file, LOG_BACKUP_COUNT old files
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))
+# Messages (raw source text, payloads) are cut to this many characters
+LOG_MAX_MESSAGE_CHARS = int(os.getenv("LOG_MAX_MESSAGE_CHARS", 1000))
+# Share of DEBUG records kept when LOG_LEVEL=DEBUG; INFO and above are never sampled
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", 1.0))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# Set by workers.py; each worker rotates its own file, since rotation is not safe across processes
+WORKER_ID = os.getenv("WORKER_ID")
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+def truncate(text, limit=LOG_MAX_MESSAGE_CHARS):
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} chars truncated]"
+
+class ContextFilter(logging.Filter):
+    """Samples DEBUG records and tags the rest with the current request ID."""
+
+    def __init__(self, debug_sample_rate=LOG_DEBUG_SAMPLE_RATE):
+        super().__init__()
+        self.debug_sample_rate = debug_sample_rate
+
+    def filter(self, record):
+        if record.levelno < logging.INFO and self.debug_sample_rate < 1 and random.random() >= self.debug_sample_rate:
+            return False
+        record.request_id = request_id.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, request ID, message and any exception."""
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", None),
+            "worker": WORKER_ID,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread; when the queue is full, records are dropped instead of blocking."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only render and cut the message here; JSON encoding and tracebacks are formatted on the writer thread
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = truncate(record.getMessage())
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_listener = None
+
+def configure_logging(level=LOG_LEVEL, filename=LOG_FILE, log_format=LOG_FORMAT):
+    """Routes the root logger through a queue to a rotating file (and optionally stderr). Idempotent.
+
+    Handlers already on the root logger (such as the stderr handler logging.basicConfig
+    installs when something logs before this runs) are removed, so every record goes
+    through the queue.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = JsonFormatter() if log_format == "json" else logging.Formatter(
+        "%(asctime)s - %(levelname)s - [%(request_id)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
+    )
+    handlers = []
+    if filename and WORKER_ID is not None:
+        root, ext = os.path.splitext(filename)
+        filename = f"{root}.worker-{WORKER_ID}{ext}"
+    if filename:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            filename, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8", delay=True
+        ))
+    if LOG_TO_STDERR:
+        handlers.append(logging.StreamHandler(sys.stderr))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    queue_handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+def shutdown_logging():
+    """Flushes queued records and stops the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,17 +1,99 @@
 from fastapi import FastAPI, Query, HTTPException
-from pydantic import BaseModel
-from data_retrieval import retrieve_information, redis_client
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+from redis.exceptions import RedisError
+from data_retrieval import aretrieve_information, aretrieve_company_info, aretrieve_batch, async_redis_client, is_cacheable
+from user_query import build_query_data, classification_key
+import os
 import json
+import admission
+import asyncio
+import uuid
+import logging
+import cache
+import clarification
+import clients
+import logging_config
+import metrics
+import prewarm
+import prompts
+import progress
+import time
+from contextlib import asynccontextmanager
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 64))
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", 1000))
+
+@asynccontextmanager
+async def lifespan(app):
+    """Opens upstream connections and loads the tokenizer before the first request, runs the cache pre-warmer, and closes both on shutdown."""
+    await asyncio.gather(clients.awarmup(), prompts.awarmup())
+    # Under workers.py only the first worker pre-warms; the entries it writes are shared through Redis
+    if prewarm.PREWARM_ENABLED and os.getenv("WORKER_ID", "0") == "0":
+        prewarm.prewarmer.start()
+    # Every process drops what other processes invalidate from its in-process cache
+    listener = asyncio.create_task(cache.listen_for_invalidations(async_redis_client)) if async_redis_client else None
+    yield
+    if listener:
+        listener.cancel()
+    await prewarm.prewarmer.stop()
+    await clients.aclose()
 
 app = FastAPI(
     title="Intelligent Company Information Retrieval System",
     description="API for retrieving structured and real-time company data.",
     version="1.0",
     docs_url="/docs",  
-    redoc_url="/redoc" 
+    redoc_url="/redoc",
+    lifespan=lifespan,
 )
 
-clarification_store = {}
+# Scrapes and docs are never rate limited
+UNLIMITED_PATHS = {"/metrics", "/docs", "/redoc", "/openapi.json"}
+
+@app.middleware("http")
+async def limit_client_rate(request: Request, call_next):
+    """Answers 429 with Retry-After once a client exceeds CLIENT_RATE_LIMIT (see admission)."""
+    if request.url.path not in UNLIMITED_PATHS:
+        try:
+            await admission.check_client(request)
+        except admission.RateLimited as e:
+            return JSONResponse({"detail": str(e)}, status_code=429, headers={"Retry-After": str(e.retry_after)})
+    return await call_next(request)
+
+@app.exception_handler(admission.Overloaded)
+async def shed_overload(request: Request, exc: admission.Overloaded):
+    """Cold requests the admission queue could not take are shed with 503 and Retry-After."""
+    return JSONResponse({"detail": "Server overloaded. Please try again later."}, status_code=503, headers={"Retry-After": str(exc.retry_after)})
+
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    """Observes per-route latency; routes are labelled by template to keep cardinality bounded."""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.HTTP_LATENCY.labels(
+            request.method, route.path if route else "unmatched", str(status)
+        ).observe(time.perf_counter() - start)
+
+@app.middleware("http")
+async def assign_request_id(request: Request, call_next):
+    """Tags the request's log lines with its ID: the caller's X-Request-ID, or a new one echoed back."""
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    token = logging_config.request_id.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        logging_config.request_id.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
 
 class QueryResponse(BaseModel):
     company_name: str
@@ -24,71 +106,229 @@ class QueryResponse(BaseModel):
 class AmbiguousResponse(BaseModel):
     message: str
     options: list[str]
+    clarification_token: str
     next_step: str
 
+class BatchQueryRequest(BaseModel):
+    queries: list[str] = Field(..., min_length=1, max_length=BATCH_MAX_QUERIES)
+    concurrency: int | None = Field(None, ge=1, le=BATCH_MAX_CONCURRENCY, description="Maximum retrievals in flight at once")
+
+def _query_result_key(user_query):
+    return f"query_result:{user_query.lower()}"
+
+def _result_tags(result):
+    return cache.tags_for(result.get("company_name"), result.get("query_type"))
+
+async def _aanswer(user_query):
+    """Reads `user_query`'s answer through the cache; identical concurrent misses share one retrieval.
+
+    An ambiguity prompt from a retrieval another caller started carries that caller's
+    single-use clarification token, so this caller gets a fresh one.
+    """
+    computed = False
+
+    async def compute():
+        nonlocal computed
+        computed = True
+        return await aretrieve_information(user_query)
+
+    response = await cache.aget_or_compute(
+        async_redis_client,
+        _query_result_key(user_query),
+        compute,
+        ttl=lambda result: cache.ttl_for(result.get("query_type")),
+        cacheable=is_cacheable,
+        tags=_result_tags,
+    )
+    if "ambiguous" in response and not computed:
+        response = await clarification.areissue(response, user_query)
+    return response
+
 @app.get("/query/")
-def process_query(user_query: str = Query(..., description="The user's query (e.g., 'Where is OpenAI headquartered?')")):
+async def process_query(user_query: str = Query(..., description="The user's query (e.g., 'Where is OpenAI headquartered?')")):
     """API endpoint to handle user queries."""
-    cache_key = f"query_result:{user_query.lower()}"
-    
-    cached_response = redis_client.get(cache_key) if redis_client else None
-    if cached_response:
-        print(f" Cache hit for query: {user_query}")
-        return json.loads(cached_response)  # Return cached result immediately
-    
-    print(f"⚠️ Cache miss for query: {user_query}, processing...")
+    cache_key = _query_result_key(user_query)
 
-    response = retrieve_information(user_query)
+    # Fresh or stale-but-refreshing hits return immediately; identical misses share one retrieval.
+    # The answer and the classification a miss needs are read together, and a miss's writes
+    # go out in one pipeline when the scope closes.
+    async with cache.request_scope(async_redis_client, prefetch=[cache_key, classification_key(user_query)]):
+        response = await _aanswer(user_query)
 
-    if "ambiguous" in response:
-        ambiguity_key = f"ambiguity:{user_query.lower()}"
+    prewarm.prewarmer.record(response)
+    return _query_response(response)
 
-        if redis_client:
-            redis_client.setex(ambiguity_key, 3600, json.dumps(response["options"]))  
-        else:
-            clarification_store[user_query] = response["options"]  
-        
+def _query_response(response):
+    """Maps a pipeline response to the body (or HTTP error) /query/ and /clarify/ return."""
+    if "ambiguous" in response:
+        # The open ambiguity was registered under this token (one per caller) when it was detected
         return AmbiguousResponse(
             message=response["message"],
             options=response["options"],
-            next_step="Use the /clarify/ endpoint to select the correct company."
+            clarification_token=response["clarification_token"],
+            next_step="Use the /clarify/ endpoint with this clarification_token to select the correct company."
         )
 
-    # Store the Final Response in Redis
-    if redis_client:
-        redis_client.setex(cache_key, 3600, json.dumps(response))  
+    if "error" in response:
+        status_code = 404 if response["error"].startswith("Company not found") else 502
+        raise HTTPException(status_code=status_code, detail=response["error"])
 
     return QueryResponse(**response)
 
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _final_event(response):
+    """Name of the closing SSE event for a pipeline response."""
+    if "ambiguous" in response:
+        return "ambiguous"
+    return "error" if "error" in response else "result"
+
+@app.get("/query/stream")
+async def stream_query(user_query: str = Query(..., description="The user's query (e.g., 'Where is OpenAI headquartered?')")):
+    """Server-Sent Events variant of /query/.
+
+    Emits `classification`, `verification`, one `source` per retrieved snippet and the
+    refined answer as `token` events, then a closing `result` (or `ambiguous` / `error`)
+    with the same body /query/ returns. A cached answer is sent as a single `result`.
+    """
+    cache_key = _query_result_key(user_query)
+
+    async def stream():
+        try:
+            cached_response = await cache.aget(async_redis_client, cache_key)
+        except RedisError:
+            cached_response = None
+        if cached_response:
+            prewarm.prewarmer.record(cached_response)
+            yield _sse(_final_event(cached_response), cached_response)
+            return
+
+        queue = asyncio.Queue()
+
+        async def run():
+            with progress.listening(lambda event, data: queue.put_nowait((event, data))):
+                async with cache.request_scope(async_redis_client, prefetch=[classification_key(user_query)]):
+                    return await _aanswer(user_query)
+
+        task = asyncio.create_task(run())
+        try:
+            while not task.done() or not queue.empty():
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield _sse(*getter.result())
+                else:
+                    getter.cancel()
+            response = task.result()
+        except admission.Overloaded as e:
+            yield _sse("error", {"error": "Server overloaded. Please try again later.", "retry_after": e.retry_after})
+            return
+        except Exception as e:
+            logging.exception(f" Streaming query failed: {e}")
+            yield _sse("error", {"error": "An internal error occurred. Please try again later."})
+            return
+        finally:
+            task.cancel()  # Client went away mid-stream; shared computations are shielded
+
+        prewarm.prewarmer.record(response)
+        yield _sse(_final_event(response), response)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/query/batch")
+async def process_query_batch(request: BatchQueryRequest):
+    """Runs many queries with deduplication and bounded parallelism, streaming NDJSON lines as results finish."""
+    concurrency = request.concurrency or BATCH_CONCURRENCY
+
+    async def stream():
+        # One MGET for every query's cached answer, one pipeline for the new answers at the end
+        try:
+            cached_responses = await cache.aget_many(async_redis_client, [_query_result_key(q) for q in request.queries])
+        except RedisError as e:
+            logging.warning(f"⚠️ Redis error when reading batch results: {e}")
+            cached_responses = [None] * len(request.queries)
+
+        misses = []
+        for i, (user_query, cached_response) in enumerate(zip(request.queries, cached_responses)):
+            if cached_response:
+                prewarm.prewarmer.record(cached_response)
+                yield json.dumps({"index": i, "user_query": user_query, "result": cached_response}) + "\n"
+            else:
+                misses.append(i)
+
+        miss_queries = [request.queries[i] for i in misses]
+        writes = []
+        try:
+            async for position, response in aretrieve_batch(miss_queries, concurrency):
+                user_query = miss_queries[position]
+                prewarm.prewarmer.record(response)
+                if is_cacheable(response):
+                    writes.append((
+                        _query_result_key(user_query), response, cache.ttl_for(response.get("query_type")),
+                        _result_tags(response),
+                    ))
+                yield json.dumps({"index": misses[position], "user_query": user_query, "result": response}) + "\n"
+        finally:
+            try:
+                await cache.aset_many(async_redis_client, writes)
+            except RedisError as e:
+                logging.warning(f"! Redis caching failed for {len(writes)} batch items: {e}")
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @app.get("/clarify/")
-def clarify_query(selection: str = Query(..., description="Selected company from the options")):
-    """Handles follow-up queries for ambiguous results using Redis or an in-memory store."""
-
-    if redis_client:
-        keys = redis_client.keys("ambiguity:*")  
-        for key in keys:
-            options = json.loads(redis_client.get(key))
-            if selection in options:
-                original_query = key.replace("ambiguity:", "")
-                refined_query = f"{original_query} (referring to {selection})"
-
-                redis_client.delete(key)  
-                
-                return retrieve_information(refined_query)
-
-    # Fallback
-    for query, options in clarification_store.items():
-        if selection in options:
-            refined_query = f"{query} (referring to {selection})"
-            del clarification_store[query]  # Remove ambiguity after resolution
-            return retrieve_information(refined_query)
-
-    raise HTTPException(status_code=400, detail="Invalid selection. Please choose from the provided options.")
+async def clarify_query(
+    selection: str = Query(..., description="Selected company from the options"),
+    token: str | None = Query(None, description="clarification_token from the ambiguous response"),
+):
+    """Handles follow-up queries for ambiguous results with an O(1) token (or selection) lookup."""
+    pending = await clarification.aresolve(selection, token)
+    if pending is None:
+        raise HTTPException(status_code=400, detail="Invalid selection. Please choose from the provided options.")
+
+    refined_query = f"{pending['query']} (referring to {pending['selection']})"
+    if not pending.get("query_type"):
+        async with cache.request_scope(async_redis_client):
+            return _query_response(await aretrieve_information(refined_query))
+
+    # The category from the first pass and the chosen entity are already known, so go
+    # straight to retrieval and store the answer where the next asker will find it
+    query_data = build_query_data(refined_query, pending["selection"], pending["query_type"])
+    async with cache.request_scope(async_redis_client, prefetch=[_query_result_key(refined_query)]):
+        response = await cache.aget_or_compute(
+            async_redis_client,
+            _query_result_key(refined_query),
+            lambda: aretrieve_company_info(query_data),
+            ttl=cache.ttl_for(pending["query_type"]),
+            cacheable=is_cacheable,
+            tags=cache.tags_for(pending["selection"], pending["query_type"]),
+        )
+    prewarm.prewarmer.record(response)
+    return _query_response(response)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Prometheus scrape endpoint."""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 @app.post("/clear-cache/")
-def clear_cache():
-    """Clears all cached data from Redis."""
-    if redis_client:
-        redis_client.flushdb()  # Clears all keys
-        return {"message": " Redis cache cleared successfully"}
-    return {"error": " Redis is not connected"}
+async def clear_cache(
+    company_name: str | None = Query(None, description="Only entries about this company"),
+    query_type: str | None = Query(None, description="Only entries in this category (e.g. financials)"),
+    namespace: str | None = Query(None, description=f"Only entries in this namespace: {', '.join(cache.TAGGED_NAMESPACES)}"),
+):
+    """Invalidates cached answers matching every given filter (all of them when none is given).
+
+    Other state in Redis (clarifications, rate limits, the pre-warmer's records) is left alone.
+    """
+    if namespace and namespace not in cache.TAGGED_NAMESPACES:
+        raise HTTPException(status_code=400, detail=f"Unknown namespace. Choose one of: {', '.join(cache.TAGGED_NAMESPACES)}")
+    try:
+        invalidated = await cache.ainvalidate(async_redis_client, company_name, query_type, namespace)
+    except RedisError as e:
+        logging.error(f"Redis error when invalidating the cache: {e}")
+        raise HTTPException(status_code=503, detail="Redis is unavailable. Please try again later.")
+    if not async_redis_client:
+        return {"message": " Local cache invalidated (Redis is not connected)", "invalidated": invalidated}
+    return {"message": " Redis cache invalidated successfully", "invalidated": invalidated}
@@ -0,0 +1,148 @@
+import asyncio
+import functools
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+
+try:
+    from opentelemetry import trace
+    # No-op until an OpenTelemetry SDK/exporter is configured (e.g. via opentelemetry-instrument)
+    _tracer = trace.get_tracer("company_info_retrieval")
+except ImportError:
+    _tracer = None
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Spans Redis round trips (ms) up to slow LLM calls (tens of seconds)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+STAGE_LATENCY = Histogram(
+    "company_info_stage_duration_seconds",
+    "Time spent in each pipeline stage (classification, verification, sources, refinement, Redis).",
+    ["stage", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+IN_FLIGHT = Gauge("company_info_stage_in_flight", "Stage executions currently running.", ["stage"])
+CACHE_REQUESTS = Counter(
+    "company_info_cache_requests_total",
+    "Cache lookups per namespace; result is hit, stale or miss.",
+    ["namespace", "result"],
+)
+UPSTREAM_RETRIES = Counter("company_info_upstream_retries_total", "Retried upstream calls.", ["upstream"])
+HEDGED_REQUESTS = Counter("company_info_hedged_requests_total", "Duplicate requests sent to a slow source.", ["source"])
+CANCELLED_SOURCES = Counter("company_info_cancelled_sources_total", "Source fetches cancelled because another source answered first.")
+LLM_TOKENS = Histogram(
+    "company_info_llm_tokens",
+    "Tokens per LLM call; kind is prompt or completion.",
+    ["call", "kind"],
+    buckets=(16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192),
+)
+PREWARM_REFRESHES = Counter(
+    "company_info_prewarm_refreshes_total", "Watchlist entries refreshed ahead of expiry; result is ok or error.", ["result"]
+)
+ADMISSIONS = Counter(
+    "company_info_admissions_total",
+    "Cold requests at the admission queue per priority; result is admitted, queued or shed.",
+    ["priority", "result"],
+)
+ADMISSION_QUEUE = Gauge("company_info_admission_queue_depth", "Cold requests waiting for an admission slot.")
+RATE_LIMITED = Counter(
+    "company_info_rate_limited_total",
+    "Calls held back by a token bucket; scope is client, or the upstream whose quota was short.",
+    ["scope"],
+)
+HTTP_LATENCY = Histogram(
+    "company_info_http_request_duration_seconds",
+    "API request latency per route.",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+@contextmanager
+def stage(name):
+    """Times the enclosed block as pipeline stage `name` and tracks it as in flight.
+
+    Works around sync and async code alike; also opens an OpenTelemetry span when
+    opentelemetry is installed.
+    """
+    span = _tracer.start_as_current_span(name) if _tracer else nullcontext()
+    gauge = IN_FLIGHT.labels(name)
+    gauge.inc()
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        with span:
+            yield
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        STAGE_LATENCY.labels(name, outcome).observe(time.perf_counter() - start)
+        gauge.dec()
+
+def timed(name):
+    """Decorator form of stage() for sync and async functions."""
+    def decorate(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def namespace(key):
+    """Cache namespace of a key, e.g. 'company_info' for 'company_info:openai:revenue'."""
+    return key.split(":", 1)[0]
+
+def record_cache(key, result):
+    """Counts a cache lookup for `key` as 'hit', 'stale' or 'miss'."""
+    CACHE_REQUESTS.labels(namespace(key), result).inc()
+
+def record_retry(upstream):
+    UPSTREAM_RETRIES.labels(upstream).inc()
+
+def record_hedge(source):
+    HEDGED_REQUESTS.labels(source).inc()
+
+def record_cancelled_sources(count):
+    CANCELLED_SOURCES.inc(count)
+
+def record_tokens(call, response):
+    """Records prompt/completion token usage reported on an LLM response message, if any."""
+    usage = getattr(response, "usage_metadata", None)
+    if not isinstance(usage, dict):
+        return
+    LLM_TOKENS.labels(call, "prompt").observe(usage.get("input_tokens", 0))
+    LLM_TOKENS.labels(call, "completion").observe(usage.get("output_tokens", 0))
+
+def record_prewarm(result):
+    PREWARM_REFRESHES.labels(result).inc()
+
+def record_admission(priority, result):
+    ADMISSIONS.labels(priority, result).inc()
+
+def record_rate_limited(scope):
+    RATE_LIMITED.labels(scope).inc()
+
+def render():
+    """Current metrics in the Prometheus text exposition format.
+
+    Under workers.py every worker writes to PROMETHEUS_MULTIPROC_DIR, and the
+    scrape aggregates all of them whichever worker serves it.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
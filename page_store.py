@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+import metrics
+import singleflight
+
+PAGE_STORE_PATH = os.getenv("PAGE_STORE_PATH", "page_store.sqlite3")
+# Stored pages are served without any network call for this long...
+REVISION_CHECK_INTERVAL = int(os.getenv("PAGE_REVISION_CHECK_INTERVAL", 86400))
+# ...then revalidated with a metadata-only revision check, and re-downloaded
+# unconditionally once they are older than PAGE_TTL
+PAGE_TTL = int(os.getenv("PAGE_TTL", 30 * 86400))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    key TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    url TEXT NOT NULL,
+    revision_id INTEGER,
+    fetched_at REAL NOT NULL,
+    checked_at REAL NOT NULL,
+    content BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS page_aliases (
+    alias TEXT PRIMARY KEY,
+    key TEXT NOT NULL
+);
+"""
+
+def _key(title):
+    return " ".join(title.split()).lower()
+
+class PageStore:
+    """Disk-backed store of full Wikipedia pages, compressed and keyed by page title.
+
+    Each page keeps its revision ID and fetch/check timestamps so refreshes can be
+    conditional. Requested titles that redirect are recorded as aliases of the
+    canonical title.
+    """
+
+    def __init__(self, path=PAGE_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+
+    @property
+    def _conn(self):
+        # Opened on first use so importing the module does not create the database file
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            if self.path != ":memory:":
+                self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+        return self._db
+
+    def get(self, title):
+        """Returns {"title", "url", "content", "revision_id", "fetched_at", "checked_at"} or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT title, url, revision_id, fetched_at, checked_at, content FROM pages "
+                "WHERE key = ? OR key = (SELECT key FROM page_aliases WHERE alias = ?)",
+                (_key(title), _key(title)),
+            ).fetchone()
+        if row is None:
+            return None
+        stored_title, url, revision_id, fetched_at, checked_at, content = row
+        return {
+            "title": stored_title,
+            "url": url,
+            "content": zlib.decompress(content).decode("utf-8"),
+            "revision_id": revision_id,
+            "fetched_at": fetched_at,
+            "checked_at": checked_at,
+        }
+
+    def put(self, requested_title, page, now=None):
+        """Stores a freshly downloaded page (as returned by clients.awiki_page)."""
+        now = now or time.time()
+        canonical = _key(page["title"])
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (key, title, url, revision_id, fetched_at, checked_at, content) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (canonical, page["title"], page["url"], page.get("revision_id"), now, now, zlib.compress(page["content"].encode("utf-8"))),
+            )
+            if _key(requested_title) != canonical:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO page_aliases (alias, key) VALUES (?, ?)", (_key(requested_title), canonical)
+                )
+
+    def touch(self, title, now=None):
+        """Marks a stored page as checked against the current revision."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE pages SET checked_at = ? WHERE key = ?", (now or time.time(), _key(title)))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM pages")
+            self._conn.execute("DELETE FROM page_aliases")
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+def _public(entry):
+    return {k: entry[k] for k in ("title", "url", "content", "revision_id")}
+
+async def aget_page(store, title, fetch_page, fetch_revision):
+    """Returns a full page from `store`, touching the network only when it may have changed.
+
+    Within REVISION_CHECK_INTERVAL the stored copy is served as is. After that,
+    `fetch_revision(title)` is consulted and the page is re-downloaded with
+    `fetch_page(title)` only if the revision changed. Past PAGE_TTL it is re-downloaded
+    regardless. If the network fails, a stored copy is still served. Concurrent
+    requests for one title share a single download.
+    """
+    entry = await asyncio.to_thread(store.get, title)
+    now = time.time()
+    if entry is not None and now - entry["checked_at"] < REVISION_CHECK_INTERVAL and now - entry["fetched_at"] < PAGE_TTL:
+        metrics.record_cache("page_store", "hit")
+        return _public(entry)
+
+    async def refresh():
+        if entry is not None and now - entry["fetched_at"] < PAGE_TTL and entry["revision_id"] is not None:
+            revision_id = await fetch_revision(entry["title"])
+            if revision_id == entry["revision_id"]:
+                await asyncio.to_thread(store.touch, entry["title"])
+                metrics.record_cache("page_store", "stale")
+                return _public(entry)
+
+        metrics.record_cache("page_store", "miss")
+        page = await fetch_page(title)
+        if page is not None and page["content"]:
+            await asyncio.to_thread(store.put, title, page)
+        return page
+
+    try:
+        return await singleflight.do(f"wiki_page:{_key(title)}", refresh)
+    except Exception as e:
+        if entry is None:
+            raise
+        logging.warning(f"⚠️ Could not refresh Wikipedia page '{title}', serving stored copy: {e!r}")
+        return _public(entry)
+
+page_store = PageStore(PAGE_STORE_PATH)
@@ -0,0 +1,163 @@
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict, defaultdict
+
+try:
+    import numpy as np
+except ImportError:  # Embedding re-ranking is optional
+    np = None
+
+PASSAGE_CHARS = int(os.getenv("PASSAGE_CHARS", 400))
+PASSAGE_TOP_K = int(os.getenv("PASSAGE_TOP_K", 3))
+INDEX_CACHE_SIZE = int(os.getenv("PASSAGE_INDEX_CACHE_SIZE", 256))
+EMBEDDINGS_ENABLED = os.getenv("PASSAGE_EMBEDDINGS", "false").lower() == "true"
+# Share of the final score that comes from embedding similarity when it is enabled
+EMBEDDING_WEIGHT = float(os.getenv("PASSAGE_EMBEDDING_WEIGHT", 0.5))
+EMBEDDING_CANDIDATES = int(os.getenv("PASSAGE_EMBEDDING_CANDIDATES", 12))
+
+_TOKEN_RE = re.compile(r"[a-z0-9$€£%]+(?:[.,'][a-z0-9]+)*")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by did does do for from has have how in is it its of on or that the their this "
+    "to was were what when where which who whom why will with about company company's".split()
+)
+
+# Words that tend to appear in passages answering each category, added to the query
+CATEGORY_TERMS = {
+    "Company Overview": "founded company industry headquartered known",
+    "Business Model": "business model revenue generates sells subscription advertising customers",
+    "Location": "headquarters headquartered based located city office",
+    "Key People": "ceo chief executive founder founded chairman president officer",
+    "Products": "products services platform offers launched software hardware",
+    "Investments": "invested investment funding round stake raised billion million",
+    "Acquisitions": "acquired acquisition acquire bought purchase merger deal billion million",
+    "Recent News": "announced reported latest 2024 2025 2026",
+    "Customers": "customers clients users businesses enterprises consumers",
+    "Revenue": "revenue revenues sales income fiscal billion million reported annual",
+}
+
+def tokenize(text):
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+def split_passages(text, max_chars=PASSAGE_CHARS):
+    """Splits text into passages of at most ~`max_chars`, packing whole sentences within paragraphs."""
+    passages = []
+    for paragraph in text.split("\n"):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        current = ""
+        for sentence in _SENTENCE_RE.split(paragraph):
+            if current and len(current) + len(sentence) + 1 > max_chars:
+                passages.append(current)
+                current = ""
+            current = f"{current} {sentence}".strip()
+        if current:
+            passages.append(current)
+    return passages
+
+class BM25Index:
+    """In-memory inverted index over passages, scored with Okapi BM25."""
+
+    def __init__(self, passages, k1=1.5, b=0.75):
+        self.passages = list(passages)
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(list)  # term -> [(passage position, term frequency)]
+        self._lengths = []
+        for position, passage in enumerate(self.passages):
+            counts = Counter(tokenize(passage))
+            self._lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                self._postings[term].append((position, frequency))
+        self._average_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+
+    def _idf(self, term):
+        matches = len(self._postings.get(term, ()))
+        return math.log(1 + (len(self.passages) - matches + 0.5) / (matches + 0.5))
+
+    def scores(self, query):
+        """BM25 score of every passage for `query` (only postings of query terms are visited)."""
+        scores = [0.0] * len(self.passages)
+        for term in set(tokenize(query)):
+            idf = self._idf(term)
+            for position, frequency in self._postings.get(term, ()):
+                norm = 1 - self.b + self.b * self._lengths[position] / (self._average_length or 1)
+                scores[position] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * norm)
+        return scores
+
+    def top(self, query, k):
+        """Positions of the `k` best passages, best first; passages without any query term are skipped."""
+        scores = self.scores(query)
+        ranked = sorted(range(len(scores)), key=lambda i: (-scores[i], i))
+        return [i for i in ranked[:k] if scores[i] > 0]
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def index_for(documents, key=None):
+    """Builds (or reuses, when `key` is given) the index over `documents`, a list of (text, source) pairs."""
+    if key is not None:
+        with _cache_lock:
+            cached = _cache.get(key)
+            if cached is not None:
+                _cache.move_to_end(key)
+                return cached
+
+    passages, sources = [], []
+    for text, source in documents:
+        for passage in split_passages(text or ""):
+            passages.append(passage)
+            sources.append(source)
+    index = BM25Index(passages)
+    index.sources = sources
+
+    if key is not None:
+        with _cache_lock:
+            _cache[key] = index
+            while len(_cache) > INDEX_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return index
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+def category_query(query, query_type):
+    return f"{query} {CATEGORY_TERMS.get(query_type, '')}".strip()
+
+def _cosine_rerank(bm25_scores, candidates, query_vector, passage_vectors):
+    """Blends normalized BM25 scores with cosine similarity, vectorized over the candidates."""
+    vectors = np.asarray(passage_vectors, dtype=np.float32)
+    query_vector = np.asarray(query_vector, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1) * (np.linalg.norm(query_vector) or 1.0)
+    cosine = vectors @ query_vector / np.where(norms == 0, 1.0, norms)
+    lexical = np.asarray([bm25_scores[i] for i in candidates], dtype=np.float32)
+    lexical = lexical / (lexical.max() or 1.0)
+    blended = (1 - EMBEDDING_WEIGHT) * lexical + EMBEDDING_WEIGHT * cosine
+    return [candidates[i] for i in np.argsort(-blended, kind="stable")]
+
+async def aselect(documents, query, query_type, k=PASSAGE_TOP_K, key=None, embed=None):
+    """Returns the top-`k` (passage, source) pairs of `documents` for a category query.
+
+    Ranking is BM25 over the query plus category terms. When `embed` (an async
+    function from a list of texts to vectors) is given and NumPy is installed, the
+    best BM25 candidates are re-ranked by embedding similarity as well. If no
+    passage matches the query at all, the leading passages are returned.
+    """
+    index = index_for(documents, key)
+    search = category_query(query, query_type)
+    candidates = index.top(search, k if embed is None or np is None else max(k, EMBEDDING_CANDIDATES))
+    if not candidates:
+        # Nothing shares a term with the query; the opening passages are the best guess
+        candidates = list(range(min(k, len(index.passages))))
+    elif embed is not None and np is not None and len(candidates) > k:
+        try:
+            vectors = await embed([search] + [index.passages[i] for i in candidates])
+            candidates = _cosine_rerank(index.scores(search), candidates, vectors[0], vectors[1:])
+        except Exception as e:
+            logging.warning(f"⚠️ Embedding re-ranking failed, using BM25 order: {e!r}")
+    return [(index.passages[i], index.sources[i]) for i in candidates[:k]]
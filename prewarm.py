@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from redis.exceptions import RedisError
+import admission
+import cache
+import metrics
+from data_retrieval import aretrieve_company_info, async_redis_client, is_cacheable, _company_info_key
+from user_query import build_query_data
+
+PREWARM_ENABLED = os.getenv("PREWARM_ENABLED", "false").lower() == "true"
+# Companies to keep warm: a comma-separated list and/or a file with one name per line...
+PREWARM_WATCHLIST = os.getenv("PREWARM_WATCHLIST", "")
+PREWARM_WATCHLIST_PATH = os.getenv("PREWARM_WATCHLIST_PATH")
+# ...plus the N most requested companies seen in traffic
+PREWARM_TOP_N = int(os.getenv("PREWARM_TOP_N", 0))
+PREWARM_CATEGORIES = [c.strip() for c in os.getenv("PREWARM_CATEGORIES", ",".join(cache.CATEGORY_TTLS)).split(",") if c.strip()]
+PREWARM_INTERVAL = float(os.getenv("PREWARM_INTERVAL", 300))
+# Entries that would stop being fresh within this many seconds are refreshed now;
+# keep it above PREWARM_INTERVAL so nothing expires between two passes
+PREWARM_REFRESH_AHEAD = float(os.getenv("PREWARM_REFRESH_AHEAD", 600))
+# Upstream quota guard: refreshes started per second, and refreshes in flight at once
+PREWARM_RATE = float(os.getenv("PREWARM_RATE", 1))
+PREWARM_CONCURRENCY = int(os.getenv("PREWARM_CONCURRENCY", 2))
+
+TRAFFIC_KEY = "prewarm:traffic"
+
+def load_watchlist(names=PREWARM_WATCHLIST, path=PREWARM_WATCHLIST_PATH):
+    """Company names from the comma-separated `names` and the file at `path`, deduplicated in order."""
+    watchlist = [n.strip() for n in names.split(",")]
+    if path:
+        try:
+            with open(path, encoding="utf-8") as f:
+                watchlist.extend(line.strip() for line in f if not line.lstrip().startswith("#"))
+        except OSError as e:
+            logging.warning(f"⚠️ Could not read prewarm watchlist {path}: {e}")
+    return list(dict.fromkeys(n for n in watchlist if n))
+
+class RateLimiter:
+    """Spaces calls at least 1/`rate` seconds apart across all waiters."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+async def refresh_company_info(company_name, query_type):
+    """Re-runs retrieval for one (company, category), overwriting its cache entry; returns the response."""
+    query_data = build_query_data(f"{query_type}: {company_name}", company_name, query_type)
+    async with cache.request_scope(async_redis_client):
+        with cache.forced_refresh(), admission.priority("background"):
+            return await aretrieve_company_info(query_data)
+
+class Prewarmer:
+    """Keeps company_info entries for a watchlist (and the most requested companies) warm.
+
+    Every `interval` seconds each (company, category) pair whose entry is missing or
+    would stop being fresh within `refresh_ahead` seconds is re-run through the
+    retrieval pipeline, at most `rate` per second and `concurrency` at once.
+    """
+
+    def __init__(
+        self, client, watchlist=(), top_n=PREWARM_TOP_N, categories=PREWARM_CATEGORIES, interval=PREWARM_INTERVAL,
+        refresh_ahead=PREWARM_REFRESH_AHEAD, rate=PREWARM_RATE, concurrency=PREWARM_CONCURRENCY, refresh=refresh_company_info,
+    ):
+        self.client = client
+        self.watchlist = list(watchlist)
+        self.top_n = top_n
+        self.categories = list(categories)
+        self.interval = interval
+        self.refresh_ahead = refresh_ahead
+        self.rate = rate
+        self.concurrency = concurrency
+        self.refresh = refresh
+        self._traffic = Counter()  # requests per company since the last pass
+        self._task = None
+
+    def record(self, response):
+        """Counts an answered request toward the top-N traffic list."""
+        if self.top_n and is_cacheable(response):
+            self._traffic[response["company_name"].strip()] += 1
+
+    async def top_companies(self):
+        """The `top_n` most requested companies; counts are shared through Redis when it is available."""
+        if not self.top_n:
+            return []
+        if self.client:
+            try:
+                pending, self._traffic = self._traffic, Counter()
+                if pending:
+                    async with self.client.pipeline(transaction=False) as pipe:
+                        for company_name, count in pending.items():
+                            pipe.zincrby(TRAFFIC_KEY, count, company_name)
+                        await pipe.execute()
+                names = await self.client.zrevrange(TRAFFIC_KEY, 0, self.top_n - 1)
+                return [n.decode("utf-8") if isinstance(n, bytes) else n for n in names]
+            except RedisError as e:
+                logging.warning(f"⚠️ Redis error when reading prewarm traffic: {e}")
+                self._traffic.update(pending)
+        return [name for name, _ in self._traffic.most_common(self.top_n)]
+
+    async def due(self):
+        """(company, category) pairs whose entries are missing or about to stop being fresh."""
+        companies = list(dict.fromkeys([*self.watchlist, *await self.top_companies()]))
+        candidates = [(company_name, query_type) for company_name in companies for query_type in self.categories]
+        if not candidates:
+            return []
+        keys = [_company_info_key({"company_name": c, "query_type": q}) for c, q in candidates]
+        try:
+            expiries = await cache.aexpires_in_many(self.client, keys)
+        except RedisError as e:
+            logging.warning(f"⚠️ Redis error when checking {len(keys)} prewarm entries: {e}")
+            return []
+        return [
+            pair for pair, expires_in in zip(candidates, expiries)
+            if expires_in is None or expires_in < self.refresh_ahead
+        ]
+
+    async def run_once(self):
+        """One pass over the watchlist; returns the number of entries refreshed."""
+        pairs = await self.due()
+        limiter = RateLimiter(self.rate)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def refresh(company_name, query_type):
+            await limiter.wait()
+            async with semaphore:
+                try:
+                    response = await self.refresh(company_name, query_type)
+                except Exception as e:
+                    response = None
+                    logging.warning(f"⚠️ Prewarm failed for {company_name} [{query_type}]: {e!r}")
+                # Error answers are not cached, so they count as failed refreshes
+                refreshed = is_cacheable(response)
+                metrics.record_prewarm("ok" if refreshed else "error")
+                return refreshed
+
+        results = await asyncio.gather(*(refresh(*pair) for pair in pairs))
+        if pairs:
+            logging.info(f" Prewarmed {sum(results)}/{len(pairs)} company entries")
+        return sum(results)
+
+    async def run_forever(self):
+        while True:
+            try:
+                with metrics.stage("prewarm"):
+                    await self.run_once()
+            except Exception as e:
+                logging.error(f"Prewarm pass failed: {e!r}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+prewarmer = Prewarmer(async_redis_client, load_watchlist())
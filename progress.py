@@ -0,0 +1,23 @@
+import contextvars
+from contextlib import contextmanager
+
+# Callback receiving (event, data) for the request being streamed, or None
+_listener = contextvars.ContextVar("progress_listener", default=None)
+
+@contextmanager
+def listening(callback):
+    """Routes progress events emitted inside the block (and tasks it starts) to `callback(event, data)`."""
+    token = _listener.set(callback)
+    try:
+        yield
+    finally:
+        _listener.reset(token)
+
+def is_listening():
+    return _listener.get() is not None
+
+def emit(event, data):
+    """Reports a pipeline stage result to the streaming client, if there is one; otherwise a no-op."""
+    callback = _listener.get()
+    if callback is not None:
+        callback(event, data)
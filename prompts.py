@@ -0,0 +1,158 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import re
+from clients import OPENAI_MODEL
+
+# Evidence beyond this many tokens is dropped before the refinement call
+REFINE_EVIDENCE_TOKENS = int(os.getenv("REFINE_EVIDENCE_TOKENS", 600))
+REFINE_MAX_COMPLETION_TOKENS = int(os.getenv("REFINE_MAX_COMPLETION_TOKENS", 200))
+# Ask for JSON in the categories that have a formatter, and format it locally
+REFINE_STRUCTURED_OUTPUT = os.getenv("REFINE_STRUCTURED_OUTPUT", "false").lower() == "true"
+
+CATEGORY_INSTRUCTIONS = {
+    "Company Overview": "Return a **concise summary** of the company's main industry, products, and key facts in **2-3 sentences max**.",
+    "Business Model": "Return only the **key revenue sources** (e.g., \"subscription services, advertising, cloud computing\").",
+    "Location": "Return only the **city and state** (or country if no state is available).",
+    "Key People": "Return only the **names and roles** of key executives (e.g., \"CEO: John Doe, CFO: Jane Smith\").",
+    "Products": "Return only the **main products or services** offered by the company (e.g., \"Smartphones, cloud computing, and digital advertising\").",
+    "Investments": "Return only the **most recent investment amount, investors, and date**.",
+    "Acquisitions": "Return only the **most recent acquisitions** with company names and date.",
+    "Recent News": "Return **only the latest news headline and date**.",
+    "Customers": "Return only the **types of customers** (e.g., businesses, individuals, industries, or key clients).",
+    "Revenue": "Return only the **latest reported revenue amount**.",
+}
+DEFAULT_INSTRUCTION = "Return only the **direct answer** in 1-2 sentences."
+
+# JSON shapes for structured output, and how each is turned into utils.query_formatting input
+STRUCTURED_SCHEMAS = {
+    "Acquisitions": (
+        '{"acquisitions": [{"company": "<acquired company>", "date": "<date>"}]}',
+        lambda data: [(item["company"], item["date"]) for item in data["acquisitions"]],
+    ),
+    "Customers": (
+        '{"customer_types": ["<customer type>"]}',
+        lambda data: {"customer_types": list(data["customer_types"])},
+    ),
+    "Investments": (
+        '{"investments": [{"investor": "<firm>", "amount_millions": <number>, "date": "<date>"}]}',
+        lambda data: [(item["investor"], item["amount_millions"], item["date"]) for item in data["investments"]],
+    ),
+    "Revenue": (
+        '{"amount": "<amount with unit, e.g. 14.2B or 850M>"}',
+        lambda data: {"amount": str(data["amount"])},
+    ),
+}
+
+_TEMPLATE = """Extract only the **direct answer** to the question from the text. {instruction}
+**Query Type:** {query_type}
+**Question:** {user_query}
+**Text:** {evidence}
+**Answer:** {answer_format}"""
+
+def _build_templates(structured):
+    templates = {}
+    for query_type in [*CATEGORY_INSTRUCTIONS, None]:
+        instruction = CATEGORY_INSTRUCTIONS.get(query_type, DEFAULT_INSTRUCTION)
+        if structured and query_type in STRUCTURED_SCHEMAS:
+            schema = STRUCTURED_SCHEMAS[query_type][0].replace("{", "{{").replace("}", "}}")
+            answer_format = f"(Respond with JSON only, shaped as {schema})"
+        else:
+            answer_format = "(Only return the exact required information)"
+        # Category parts are filled in now; only the per-call fields remain as placeholders
+        templates[query_type] = _TEMPLATE.replace("{instruction}", instruction).replace("{answer_format}", answer_format)
+    return templates
+
+# Built once: each call only substitutes the question and evidence
+TEMPLATES = _build_templates(REFINE_STRUCTURED_OUTPUT)
+
+def is_structured(query_type):
+    return REFINE_STRUCTURED_OUTPUT and query_type in STRUCTURED_SCHEMAS
+
+@functools.lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(OPENAI_MODEL)
+    except Exception as e:  # Not installed, unknown model, or the encoding cannot be downloaded
+        logging.warning(f"⚠️ tiktoken unavailable, estimating token counts from length: {e!r}")
+        return None
+
+async def awarmup():
+    """Loads the tokenizer off the event loop; the first load can download and parse its BPE file."""
+    await asyncio.to_thread(_encoding)
+
+def count_tokens(text):
+    """Tokens in `text` for the configured model (about 4 characters per token without tiktoken)."""
+    encoding = _encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+def _truncate(text, budget):
+    """Longest whole-word prefix of `text` within `budget` tokens."""
+    words = text.split(" ")
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(" ".join(words[:middle])) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return " ".join(words[:low])
+
+def fit_evidence(raw_text, budget=REFINE_EVIDENCE_TOKENS):
+    """Trims source text to `budget` tokens, keeping whole passages where possible.
+
+    `raw_text` holds one block per source (separated by blank lines) of passages
+    ranked best first (one per line). Passages are taken round-robin across
+    sources, so each source keeps its best passages; the first passage that does
+    not fit is cut at a word boundary.
+    """
+    if count_tokens(raw_text) <= budget:
+        return raw_text
+
+    blocks = [[p for p in block.split("\n") if p.strip()] for block in raw_text.split("\n\n")]
+    kept = [[] for _ in blocks]
+    remaining = budget
+    for rank in range(max(len(block) for block in blocks)):
+        for i, block in enumerate(blocks):
+            if rank >= len(block) or remaining <= 0:
+                continue
+            passage = block[rank]
+            cost = count_tokens(passage) + 1
+            if cost > remaining:
+                passage = _truncate(passage, remaining - 1)
+                if passage:
+                    kept[i].append(passage)
+                remaining = 0
+            else:
+                kept[i].append(passage)
+                remaining -= cost
+    return "\n\n".join("\n".join(passages) for passages in kept if passages)
+
+def build_refine_prompt(raw_text, query_type, user_query, budget=REFINE_EVIDENCE_TOKENS):
+    template = TEMPLATES.get(query_type, TEMPLATES[None])
+    return template.format(query_type=query_type, user_query=user_query, evidence=fit_evidence(raw_text, budget))
+
+def llm_options(query_type):
+    """Extra model parameters for the refinement call."""
+    options = {"max_tokens": REFINE_MAX_COMPLETION_TOKENS}
+    if is_structured(query_type):
+        options["response_format"] = {"type": "json_object"}
+    return options
+
+_JSON_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+def parse_structured(query_type, content):
+    """Formatter input parsed from a JSON answer, or None if it does not match the schema."""
+    match = _JSON_RE.search(content)
+    if match is None:
+        return None
+    try:
+        return STRUCTURED_SCHEMAS[query_type][1](json.loads(match.group(0)))
+    except (ValueError, KeyError, TypeError) as e:
+        logging.warning(f"⚠️ Structured {query_type} answer did not match its schema: {e!r}")
+        return None
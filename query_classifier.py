@@ -0,0 +1,44 @@
+import re
+
+# Keyword rules for the categories in user_query.query_template. A query is
+# classified locally only when exactly one rule matches.
+CATEGORY_PATTERNS = {
+    "Business Model": re.compile(r"\b(business model|revenue model|make[s]? (its )?money|monetiz\w*|earn[s]? money)\b"),
+    "Location": re.compile(r"\b(headquarter\w*|hq|where is .+ (based|located)|located|based in|head office)\b"),
+    "Key People": re.compile(r"\b(ceo|cfo|cto|coo|co-?founders?|founders?|who founded|executives?|leadership|chairman|chairwoman|president|who runs|who leads)\b"),
+    "Products": re.compile(r"\b(products?|services?|offerings?|what does .+ (sell|offer|make))\b"),
+    "Investments": re.compile(r"\b(investments?|invested|invests|funding rounds?|stakes? in)\b"),
+    "Acquisitions": re.compile(r"\b(acquisitions?|acquired|acquires?|bought|buyouts?)\b"),
+    "Recent News": re.compile(r"\b(news|headlines?|latest updates?|announced)\b"),
+    "Customers": re.compile(r"\b(customers?|clients?|customer base|who (buys|uses))\b"),
+    "Revenue": re.compile(r"\b(revenues?|annual sales|turnover|how much .+ (make|earn|generate))\b"),
+}
+OVERVIEW_PATTERN = re.compile(r"^(what is|who is|tell me about|overview of|information about|about)\b")
+
+def normalize_query(query):
+    """Lowercases, collapses whitespace and drops trailing punctuation so equivalent queries share a key."""
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+def classify_category(query):
+    """Returns the single category whose keywords match, or None if zero or several match."""
+    normalized = normalize_query(query)
+    matches = [category for category, pattern in CATEGORY_PATTERNS.items() if pattern.search(normalized)]
+    if len(matches) == 1:
+        return matches[0]
+    if not matches and OVERVIEW_PATTERN.search(normalized):
+        return "Company Overview"
+    return None
+
+def preclassify(query, company_index):
+    """Classifies without the LLM when both the company and the category are unambiguous.
+
+    `company_index` is an entity_index.CompanyIndex; only companies it already knows qualify.
+    Returns (company_name, query_type) or None when the LLM should decide.
+    """
+    company_name = company_index.find_in(query)
+    if company_name is None:
+        return None
+    query_type = classify_category(query)
+    if query_type is None:
+        return None
+    return company_name, query_type
@@ -1,13 +1,26 @@
 import redis
+import redis.asyncio as aioredis
+import logging
 import os
 
-REDIS_HOST = os.getenv("REDIS_HOST", "redis")  
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 
+# Runs at import, before logging_config.configure_logging(); a module logger does not
+# make the root logger install a default stderr handler
+logger = logging.getLogger(__name__)
+
+# Responses are raw bytes: cache entries are binary (see cache_codec)
 try:
-    redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
-    redis_client.ping()  
-    print("! Connected to Redis!")
+    redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=False)
+    redis_client.ping()
+    logger.info("! Connected to Redis!")
 except redis.ConnectionError:
-    print("! Redis connection failed. Ensure Redis is running.")
-    redis_client = None  
+    logger.warning("! Redis connection failed. Ensure Redis is running.")
+    redis_client = None
+
+# Async client for the FastAPI request path (connects lazily on first command)
+async_redis_client = (
+    aioredis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=False)
+    if redis_client else None
+)
@@ -0,0 +1,199 @@
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+import admission
+import metrics
+
+# Per-attempt timeout for each upstream, in seconds
+UPSTREAM_TIMEOUTS = {
+    "wikipedia": float(os.getenv("WIKIPEDIA_TIMEOUT", 4)),
+    "tavily": float(os.getenv("TAVILY_TIMEOUT", 6)),
+    "llm": float(os.getenv("LLM_TIMEOUT", 15)),
+}
+DEFAULT_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", 10))
+MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", 2))
+BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", 0.2))
+BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", 2))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 30))
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """Raised when the request's deadline budget leaves no time for another attempt."""
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: opens after `failure_threshold` failures, then lets one
+    probe through every `reset_timeout` seconds until a call succeeds again."""
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self):
+        """True if a call may go through now; in half-open state only one probe at a time is allowed."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logging.info(f" Circuit for {self.name} closed again")
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def release(self):
+        """Ends a half-open probe that neither succeeded nor failed (e.g. it was cancelled)."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._probing:
+                    logging.warning(f"⚠️ Circuit for {self.name} opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def breaker(upstream):
+    """The process-wide circuit breaker for `upstream`."""
+    with _breakers_lock:
+        if upstream not in _breakers:
+            _breakers[upstream] = CircuitBreaker(upstream)
+        return _breakers[upstream]
+
+def reset_breakers():
+    with _breakers_lock:
+        _breakers.clear()
+
+# -- Deadlines -------------------------------------------------------------------
+
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+@contextmanager
+def deadline(seconds):
+    """Bounds everything inside the block (including tasks it starts) to `seconds`.
+
+    Nested deadlines can only shorten the budget, never extend it.
+    """
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(at, current))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def remaining():
+    """Seconds left in the current deadline, or None when there is no deadline."""
+    at = _deadline.get()
+    return None if at is None else max(0.0, at - time.monotonic())
+
+# -- Calls -----------------------------------------------------------------------
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff for the given 0-based attempt."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def _is_retryable(error):
+    """Client errors (4xx other than 429) will fail the same way again and say nothing about upstream health.
+
+    Covers httpx.HTTPStatusError and the OpenAI SDK's status errors, which both carry the response.
+    """
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return True
+
+async def _backoff(upstream, attempt, attempts, error, bucket=None):
+    """Sleeps before the next attempt; False if there is no attempt, time or upstream quota left for one.
+
+    Retries only spend quota that is free right now, so they never queue behind first attempts.
+    """
+    delay = backoff_delay(attempt)
+    budget = remaining()
+    if attempt + 1 >= attempts or (budget is not None and delay >= budget):
+        return False
+    if bucket is not None and await bucket.take() > 0:
+        metrics.record_rate_limited(upstream)
+        logging.warning(f"⚠️ {upstream} call failed and its rate limit leaves no room for a retry: {error!r}")
+        return False
+    logging.warning(f"⚠️ {upstream} call failed (attempt {attempt + 1}), retrying in {delay:.2f}s: {error!r}")
+    metrics.record_retry(upstream)
+    await asyncio.sleep(delay)
+    return True
+
+async def call(upstream, func, *args, attempts=MAX_ATTEMPTS, **kwargs):
+    """Awaits `func(*args, **kwargs)` with a per-attempt timeout, jittered retries and the upstream's breaker.
+
+    Every attempt and backoff fits inside the current deadline. Raises CircuitOpenError
+    while the upstream is unhealthy, DeadlineExceeded when the budget runs out, or
+    the last error once all attempts have failed. With a rate limit set for the
+    upstream (admission.UPSTREAM_RATE_LIMITS), the first attempt waits for quota.
+    """
+    circuit = breaker(upstream)
+    timeout = UPSTREAM_TIMEOUTS.get(upstream, DEFAULT_TIMEOUT)
+    bucket = admission.upstream_bucket(upstream)
+
+    for attempt in range(attempts):
+        budget = remaining()
+        if budget is not None and budget <= 0:
+            raise DeadlineExceeded(f"No time left to call {upstream}")
+        if attempt == 0 and bucket is not None and not await bucket.wait(budget):
+            metrics.record_rate_limited(upstream)
+            raise DeadlineExceeded(f"No time left to wait for {upstream} quota")
+        if not circuit.allow():
+            raise CircuitOpenError(f"{upstream} circuit is open")
+
+        cut_short = budget is not None and budget < timeout
+        try:
+            result = await asyncio.wait_for(func(*args, **kwargs), budget if cut_short else timeout)
+        except asyncio.CancelledError:
+            circuit.release()
+            raise
+        except asyncio.TimeoutError as e:
+            if cut_short:
+                # The request ran out of time, which says nothing about the upstream
+                circuit.release()
+                raise DeadlineExceeded(f"Deadline reached while calling {upstream}") from e
+            circuit.record_failure()
+            if not await _backoff(upstream, attempt, attempts, e, bucket):
+                raise
+        except Exception as e:
+            if not _is_retryable(e):
+                circuit.record_success()  # The upstream answered, so it is healthy
+                raise
+            circuit.record_failure()
+            if not await _backoff(upstream, attempt, attempts, e, bucket):
+                raise
+        else:
+            circuit.record_success()
+            return result
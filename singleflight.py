@@ -0,0 +1,99 @@
+import asyncio
+import contextvars
+import logging
+import os
+import uuid
+from contextlib import contextmanager
+from redis.exceptions import RedisError
+
+# How long a replica may hold a computation lease before others take over
+LEASE_TTL_MS = int(os.getenv("SINGLEFLIGHT_LEASE_MS", 30000))
+POLL_INTERVAL = float(os.getenv("SINGLEFLIGHT_POLL_INTERVAL", 0.05))
+
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# In-process registry of running computations, keyed by cache key
+_inflight = {}
+# Set by cache.request_scope: takes (lock_key, token) and returns True if it will send the
+# release with the request's batched writes, so the lease outlives the value's write
+_defer_release = contextvars.ContextVar("singleflight_defer_release", default=None)
+
+@contextmanager
+def deferring_releases(defer):
+    """Inside the block, leases taken by coalesce() are released through `defer` (None releases them directly)."""
+    token = _defer_release.set(defer)
+    try:
+        yield
+    finally:
+        _defer_release.reset(token)
+
+def queue_release(pipe, lock_key, token):
+    """Adds the release of a lease to a Redis pipeline."""
+    pipe.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+
+async def do(key, compute):
+    """Runs `compute()` once per key; concurrent callers in this process await the same task."""
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(compute())
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    else:
+        logging.info(f" Coalesced request onto in-flight computation: {key}")
+
+    # Shield so one caller disconnecting does not cancel the work others are waiting on
+    return await asyncio.shield(task)
+
+async def _release(client, lock_key, token):
+    try:
+        await client.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+    except RedisError as e:
+        logging.warning(f"⚠️ Failed to release lease {lock_key}, it will expire: {e}")
+
+async def _with_lease(key, compute, client, lookup):
+    """Takes a Redis lease for `key` so only one replica computes; others poll `lookup()`."""
+    lock_key = f"lock:{key}"
+    token = uuid.uuid4().hex
+
+    while True:
+        try:
+            acquired = await client.set(lock_key, token, nx=True, px=LEASE_TTL_MS)
+        except RedisError as e:
+            logging.warning(f"⚠️ Lease unavailable for {key}, computing locally: {e}")
+            return await compute()
+
+        if acquired:
+            try:
+                return await compute()
+            finally:
+                defer = _defer_release.get()
+                if defer is None or not defer(lock_key, token):
+                    await _release(client, lock_key, token)
+
+        # Another replica holds the lease: wait for its result or for the lease to go away
+        while await client.exists(lock_key):
+            await asyncio.sleep(POLL_INTERVAL)
+            if lookup is not None:
+                cached = await lookup()
+                if cached is not None:
+                    return cached
+
+        if lookup is not None:
+            cached = await lookup()
+            if cached is not None:
+                return cached
+
+async def coalesce(key, compute, client=None, lookup=None):
+    """Single-flight `compute()` per key, in-process and (when Redis is available) across replicas.
+
+    `lookup` is an async callable returning the value the leader stored, or None;
+    replicas that lose the lease use it to pick up the leader's result.
+    """
+    if client is None:
+        return await do(key, compute)
+    return await do(key, lambda: _with_lease(key, compute, client, lookup))
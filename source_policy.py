@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+import metrics
+
+FIRST_SUFFICIENT = "first_sufficient"
+ALL_REQUIRED = "all_required"
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+# A duplicate request is sent once a call has been outstanding longer than this percentile of recent latencies
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 95))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", 20))
+LATENCY_WINDOW = int(os.getenv("HEDGE_LATENCY_WINDOW", 200))
+
+class SourcePolicy:
+    """How the graph runs its sources for one category.
+
+    mode: FIRST_SUFFICIENT returns as soon as one source (in any order) produces a
+    sufficient result and cancels the rest; ALL_REQUIRED waits for every source.
+    hedge: send a duplicate request to a source that is slower than its usual tail.
+    """
+
+    def __init__(self, mode, sources=("wikipedia", "tavily"), hedge=HEDGE_ENABLED):
+        if mode not in (FIRST_SUFFICIENT, ALL_REQUIRED):
+            raise ValueError(f"Unknown source policy mode: {mode}")
+        self.mode = mode
+        self.sources = tuple(sources)
+        self.hedge = hedge
+
+    def __repr__(self):
+        return f"SourcePolicy({self.mode!r}, sources={self.sources!r}, hedge={self.hedge})"
+
+# Keyed like user_query.build_query_data's query_map. Stable facts are well covered by
+# either source; fast-moving ones need both for a cross-checked answer.
+CATEGORY_POLICIES = {
+    "Company Overview": SourcePolicy(FIRST_SUFFICIENT),
+    "Business Model": SourcePolicy(FIRST_SUFFICIENT),
+    "Location": SourcePolicy(FIRST_SUFFICIENT),
+    "Key People": SourcePolicy(FIRST_SUFFICIENT),
+    "Products": SourcePolicy(ALL_REQUIRED),
+    "Investments": SourcePolicy(ALL_REQUIRED),
+    "Acquisitions": SourcePolicy(ALL_REQUIRED),
+    "Recent News": SourcePolicy(ALL_REQUIRED),
+    "Customers": SourcePolicy(ALL_REQUIRED),
+    "Revenue": SourcePolicy(ALL_REQUIRED),
+}
+DEFAULT_POLICY = SourcePolicy(ALL_REQUIRED)
+
+def policy_for(query_type):
+    return CATEGORY_POLICIES.get(query_type, DEFAULT_POLICY)
+
+class LatencyTracker:
+    """Rolling window of one source's latencies, used to decide when to hedge."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct, min_samples=HEDGE_MIN_SAMPLES):
+        """Nearest-rank percentile, or None until enough samples were seen."""
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+def tracker(source):
+    with _trackers_lock:
+        if source not in _trackers:
+            _trackers[source] = LatencyTracker()
+        return _trackers[source]
+
+def reset_trackers():
+    with _trackers_lock:
+        _trackers.clear()
+
+async def _timed(source, fetch):
+    start = time.perf_counter()
+    result = await fetch()
+    tracker(source).record(time.perf_counter() - start)
+    return result
+
+async def _cancel(tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+async def hedged(source, fetch, hedge=True):
+    """Awaits `fetch()`, sending one duplicate if it outlives the source's tail latency; the first answer wins."""
+    threshold = tracker(source).percentile(HEDGE_PERCENTILE) if hedge else None
+    first = asyncio.ensure_future(_timed(source, fetch))
+    if threshold is None:
+        return await first
+
+    try:
+        done, _ = await asyncio.wait({first}, timeout=threshold)
+    except asyncio.CancelledError:
+        await _cancel([first])
+        raise
+    if done:
+        return first.result()
+
+    logging.info(f" Hedging {source} request after {threshold:.3f}s")
+    metrics.record_hedge(source)
+    pending = {first, asyncio.ensure_future(_timed(source, fetch))}
+    try:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        return next(iter(done)).result()
+    finally:
+        await _cancel(pending)
+
+async def execute(policy, fetchers, is_sufficient):
+    """Runs the policy's sources concurrently and returns {source: result} for those that finished.
+
+    `fetchers` maps a source name to a zero-argument coroutine function, and
+    `is_sufficient(result)` decides whether one result can answer on its own.
+    """
+    tasks = {
+        asyncio.ensure_future(hedged(source, fetchers[source], policy.hedge)): source
+        for source in policy.sources
+    }
+    results = {}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                source = tasks[task]
+                if task.exception() is not None:
+                    logging.error(f"Source {source} failed: {task.exception()!r}")
+                    continue
+                results[source] = task.result()
+                if policy.mode == FIRST_SUFFICIENT and is_sufficient(results[source]):
+                    if pending:
+                        logging.info(f" {source} answered first; cancelling {sorted(tasks[t] for t in pending)}")
+                        metrics.record_cancelled_sources(len(pending))
+                    return results
+        return results
+    finally:
+        await _cancel(pending)
@@ -0,0 +1,48 @@
+import os
+
+# Tests never touch the on-disk page store
+os.environ.setdefault("PAGE_STORE_PATH", ":memory:")
+
+import pytest
+import page_store
+import passage_index
+import cache
+import resilience
+import source_policy
+
+
+@pytest.fixture(autouse=True)
+def clear_local_cache():
+    """Keeps the in-process cache tier from leaking entries between tests."""
+    cache.clear_local()
+    yield
+    cache.clear_local()
+
+
+@pytest.fixture(autouse=True)
+def reset_circuit_breakers():
+    """Circuit breakers are process-wide, so failures in one test must not open them for the next."""
+    resilience.reset_breakers()
+    yield
+    resilience.reset_breakers()
+
+
+@pytest.fixture(autouse=True)
+def reset_latency_trackers():
+    """Hedging thresholds come from observed latencies, which must not carry over between tests."""
+    source_policy.reset_trackers()
+    yield
+    source_policy.reset_trackers()
+
+
+@pytest.fixture(autouse=True)
+def clear_page_store():
+    page_store.page_store.clear()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def clear_passage_indexes():
+    """Indexes are cached by page and revision, which tests reuse with different content."""
+    passage_index.clear_cache()
+    yield
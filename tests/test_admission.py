@@ -0,0 +1,186 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+import fakeredis
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from redis.exceptions import ConnectionError as RedisConnectionError
+import admission
+import main
+import resilience
+import user_query
+from entity_index import CompanyIndex
+
+
+def test_token_bucket_is_shared_through_redis_and_falls_back_locally():
+    async def run():
+        client = fakeredis.FakeAsyncRedis()
+        first = admission.TokenBucket("client:a", rate=0.5, burst=2, client=client)
+        second = admission.TokenBucket("client:a", rate=0.5, burst=2, client=client)
+        shared = [await first.take(), await second.take(), await first.take()]
+
+        broken = MagicMock()
+        broken.eval = AsyncMock(side_effect=RedisConnectionError("down"))
+        local = admission.TokenBucket("client:b", rate=0.5, burst=1, client=broken)
+        return shared, [await local.take(), await local.take()]
+
+    shared, local = asyncio.run(run())
+    assert shared[:2] == [0, 0]
+    assert 1.5 < shared[2] <= 2  # Both replicas drew from one bucket
+    assert local[0] == 0 and local[1] > 0
+
+
+def test_queue_admits_by_priority_and_sheds_the_lowest():
+    async def run():
+        controller = admission.AdmissionController(max_active=1, max_queue=2, queue_timeout=1)
+        order = []
+
+        async def request(name):
+            try:
+                await controller.acquire(name)
+            except admission.Overloaded:
+                order.append(f"shed {name}")
+                return
+            order.append(name)
+            await asyncio.sleep(0.01)
+            controller.release(0.01)
+
+        await controller.acquire("interactive")  # Holds the only slot
+        waiters = [asyncio.create_task(request(name)) for name in ("background", "batch")]
+        await asyncio.sleep(0)
+        waiters.append(asyncio.create_task(request("interactive")))  # Full queue: background is shed
+        await asyncio.sleep(0)
+        controller.release(0.01)
+        await asyncio.gather(*waiters)
+        return order, controller.active
+
+    order, active = asyncio.run(run())
+    assert order == ["shed background", "interactive", "batch"]
+    assert active == 0
+
+
+def test_waiters_are_shed_after_the_queue_timeout():
+    async def run():
+        controller = admission.AdmissionController(max_active=1, max_queue=5, queue_timeout=0.05)
+        await controller.acquire("interactive")
+        with pytest.raises(admission.Overloaded) as shed:
+            await controller.acquire("interactive")
+        return shed.value.retry_after, controller._waiters
+
+    retry_after, waiters = asyncio.run(run())
+    assert retry_after >= 1
+    assert waiters == []
+
+
+@patch("admission.UPSTREAM_RATE_LIMITS", {"wikipedia": 0.01})
+@patch("admission.UPSTREAM_RATE_BURST", 1)
+@patch("admission.async_redis_client", None)
+@patch("resilience.BACKOFF_BASE", 0.01)
+def test_retries_only_spend_spare_upstream_quota():
+    """Once the upstream's quota is used up, a failed call is not retried."""
+    func = AsyncMock(side_effect=[httpx.ConnectError("boom"), "ok"])
+    with patch.dict(admission._upstream_buckets, clear=True):
+        with pytest.raises(httpx.ConnectError):
+            asyncio.run(resilience.call("wikipedia", func, "q", attempts=2))
+    assert func.await_count == 1
+
+
+@patch("main.async_redis_client", None)
+@patch("admission.async_redis_client", None)
+@patch("admission.CLIENT_RATE_LIMIT", 0.01)
+@patch("admission.CLIENT_RATE_BURST", 1)
+def test_api_answers_429_and_503_with_retry_after():
+    client = TestClient(main.app)
+    with patch.dict(admission._client_buckets, clear=True), \
+            patch("main.aretrieve_information", AsyncMock(side_effect=admission.Overloaded(3))):
+        shed = client.get("/query/", params={"user_query": "Where is OpenAI headquartered?"}, headers={"X-API-Key": "a"})
+        limited = client.get("/query/", params={"user_query": "Where is OpenAI headquartered?"}, headers={"X-API-Key": "a"})
+        scrape = client.get("/metrics", headers={"X-API-Key": "a"})
+
+    assert shed.status_code == 503
+    assert shed.headers["Retry-After"] == "3"
+    assert limited.status_code == 429
+    assert int(limited.headers["Retry-After"]) >= 1
+    assert scrape.status_code == 200  # Scrapes are never limited
+
+
+@patch("admission.UPSTREAM_RATE_LIMITS", {"llm": 0.01})
+@patch("admission.UPSTREAM_RATE_BURST", 1)
+@patch("admission.async_redis_client", None)
+@patch("user_query.async_redis_client", None)
+def test_llm_rate_limit_covers_classification_and_verification():
+    """Verification takes the LLM's only token, so classification waits for quota instead of calling the LLM."""
+    llm = MagicMock(ainvoke=AsyncMock(return_value=MagicMock(content="Verified: TestCo")))
+    chain = MagicMock(ainvoke=AsyncMock())
+
+    async def run():
+        await user_query.acheck_company_with_llm("TestCo")
+        with resilience.deadline(0.1):
+            await user_query.aclassify_query("Tell me about TestCo")
+
+    with patch.dict(admission._upstream_buckets, clear=True), \
+            patch("user_query.llm", llm), patch("user_query.query_chain", chain), \
+            patch("user_query.company_index", CompanyIndex()):
+        with pytest.raises(resilience.DeadlineExceeded):
+            asyncio.run(run())
+
+    assert llm.ainvoke.await_count == 1
+    chain.ainvoke.assert_not_awaited()
+
+
+def _known(*names):
+    index = CompanyIndex()
+    for name in names:
+        index.add(name)
+    return index
+
+
+@patch("data_retrieval.async_redis_client", None)
+@patch("user_query.async_redis_client", None)
+def test_cached_stages_pass_a_saturated_controller():
+    """A query_result miss whose classification and company info are cached never queues; an uncached LLM call does."""
+    import time
+    import cache
+    import data_retrieval
+
+    query_data = user_query.build_query_data("Tell me things about TestCo", "TestCo", "Revenue")
+    answer = {"company_name": "TestCo", "query_type": "Revenue", "response": "$1B", "confidence_score": 0.9}
+    chain = MagicMock(ainvoke=AsyncMock())
+
+    async def run():
+        cache._local.set(user_query.classification_key("Tell me things about TestCo"),
+                         {"company_name": "TestCo", "query_type": "Revenue"}, time.time() + 60)
+        cache._local.set(data_retrieval._company_info_key(query_data), answer, time.time() + 60)
+        controller = admission.AdmissionController(max_active=1, max_queue=1, queue_timeout=0.05)
+        await controller.acquire("interactive")  # Saturated: the only slot is taken
+        with patch("admission.controller", controller):
+            cached = await data_retrieval.aretrieve_information("Tell me things about TestCo")
+            with pytest.raises(admission.Overloaded):
+                await data_retrieval.aretrieve_information("Something else entirely")
+        return cached
+
+    with patch("user_query.company_index", _known("TestCo")), patch("user_query.query_chain", chain):
+        assert asyncio.run(run()) == answer
+    chain.ainvoke.assert_not_awaited()  # The uncached classification was shed before calling the LLM
+
+
+@patch("user_query.async_redis_client", None)
+def test_batch_classification_is_admitted_and_shed_per_item():
+    """Uncached batch classification queues at batch priority; shed items get an error, the rest still classify."""
+    batch_chain = MagicMock(ainvoke=AsyncMock())
+    chain = MagicMock(ainvoke=AsyncMock())
+
+    async def run():
+        controller = admission.AdmissionController(max_active=1, max_queue=1, queue_timeout=0.05)
+        await controller.acquire("interactive")
+        with patch("admission.controller", controller), admission.priority("batch"):
+            return await user_query.aclassify_queries(["Where is OpenAI based?", "Tell me about Zorblax"])
+
+    with patch("user_query.company_index", _known("OpenAI")), \
+            patch("user_query.batch_query_chain", batch_chain), patch("user_query.query_chain", chain):
+        results = asyncio.run(run())
+
+    assert results[0] == ("OpenAI", "Location")  # Classified locally, no admission needed
+    assert results[1]["retry_after"] >= 1
+    batch_chain.ainvoke.assert_not_awaited()
+    chain.ainvoke.assert_not_awaited()
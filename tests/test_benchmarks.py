@@ -0,0 +1,33 @@
+import json
+from benchmarks import fake_upstreams, run, workload
+
+
+def test_percentiles_and_regression_check():
+    latencies = [i / 1000 for i in range(1, 101)]
+    assert run.percentile(latencies, 50) == 0.05
+    assert run.percentile(latencies, 99) == 0.099
+
+    baseline = {"scenarios": {"query": {"p50_ms": 10, "p95_ms": 50, "p99_ms": 100, "rps": 100}}}
+    current = {"scenarios": {"query": {"p50_ms": 11, "p95_ms": 80, "p99_ms": 100, "rps": 70}}}
+    assert run.compare(current, baseline, tolerance=0.2) == ["query p95_ms: 50 -> 80", "query rps: 100 -> 70"]
+
+
+def test_cache_report_counts_stale_as_hits():
+    before = {"company_info": {"hit": 1, "miss": 1}}
+    after = {"company_info": {"hit": 4, "stale": 1, "miss": 2}, "query_result": {"miss": 0}}
+    assert run.cache_report(before, after) == {"company_info": {"hit": 3, "stale": 1, "miss": 1, "hit_ratio": 0.8}}
+
+
+def test_fake_llm_answers_each_prompt_kind():
+    """The fake LLM must produce output the real parsers accept."""
+    assert fake_upstreams._chat_answer("Extract the company name and classify ...\nQuery: Where is Tesla headquartered?\nRespond strictly") == \
+        "Company Name: Tesla\nCategory: Location"
+    assert fake_upstreams._chat_answer("You are an expert business analyst. Determine if 'Delta' refers to") == \
+        "Ambiguous: Delta Air Lines, Delta Electronics, Delta Faucet Company"
+
+
+def test_load_queries_reads_backlog_jsonl(tmp_path):
+    path = tmp_path / "mix.jsonl"
+    path.write_text("\n".join(json.dumps(r) for r in [{"query": "Tesla revenue"}, {"request_id": "x", "title": "Stripe HQ"}]))
+    assert workload.load_queries(str(path)) == ["Tesla revenue", "Stripe HQ"]
+    assert len(workload.default_mix(50)) == 50
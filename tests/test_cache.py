@@ -0,0 +1,218 @@
+import asyncio
+import json
+import time
+from unittest.mock import AsyncMock, MagicMock
+import fakeredis
+import cache
+
+
+def test_local_tier_serves_repeat_reads():
+    """After one Redis hit, repeat reads should not touch Redis again."""
+    client = MagicMock()
+    client.get.return_value = json.dumps({"response": "HQ in San Francisco"})
+
+    assert cache.get(client, "company_info:openai:location") == {"response": "HQ in San Francisco"}
+    assert cache.get(client, "company_info:openai:location") == {"response": "HQ in San Francisco"}
+    assert client.get.call_count == 1
+
+
+def test_category_ttls_differ():
+    """Stable categories should outlive fast-moving ones."""
+    assert cache.ttl_for("Location") > cache.ttl_for("Recent News")
+    assert cache.ttl_for("Unknown category") == cache.DEFAULT_TTL
+
+
+def test_local_tier_evicts_least_recently_used():
+    local = cache.LocalCache(max_entries=2)
+    fresh_until = time.time() + 60
+    local.set("a", 1, fresh_until)
+    local.set("b", 2, fresh_until)
+    local.get("a")
+    local.set("c", 3, fresh_until)
+
+    assert local.get("b") is None
+    assert local.get("a") == (1, True)
+
+
+def test_stale_value_is_served_while_refreshing():
+    """A stale entry is returned immediately and recomputed in the background."""
+    client = AsyncMock()
+    client.get.return_value = None
+    compute = AsyncMock(return_value="new")
+
+    async def run():
+        cache._local.set("refined_response:k", "old", time.time() - 1)
+        first = await cache.aget_or_compute(client, "refined_response:k", compute, ttl=60)
+        await asyncio.gather(*cache._refresh_tasks)
+        second = await cache.aget_or_compute(client, "refined_response:k", compute, ttl=60)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == "old"
+    assert second == "new"
+    compute.assert_awaited_once()
+
+
+def test_uncacheable_results_are_not_stored():
+    client = AsyncMock()
+    client.get.return_value = None
+
+    result = asyncio.run(cache.aget_or_compute(client, "query_result:q", AsyncMock(return_value=None), ttl=60))
+    assert result is None
+    client.setex.assert_not_called()
+
+
+def _counting_client():
+    client = fakeredis.FakeAsyncRedis()
+    for name in ("get", "mget", "setex", "pipeline"):
+        setattr(client, name, MagicMock(wraps=getattr(client, name)))
+    return client
+
+
+def test_request_scope_batches_nested_reads_and_writes():
+    """A cold request with two nested cached stages costs one MGET and one pipeline, not one round trip per key."""
+    async def run():
+        client = _counting_client()
+
+        async def inner():
+            return "refined"
+
+        async def outer():
+            return {"answer": await cache.aget_or_compute(client, "refined_response:x", inner, ttl=60)}
+
+        async with cache.request_scope(client, prefetch=["query_result:x", "refined_response:x"]):
+            result = await cache.aget_or_compute(client, "query_result:x", outer, ttl=60)
+
+        cache.clear_local()
+        stored = await cache.aget_many(client, ["query_result:x", "refined_response:x"])
+        return client, result, stored, await client.keys("lock:*")
+
+    client, result, stored, locks = asyncio.run(run())
+
+    assert result == {"answer": "refined"}
+    assert stored == [{"answer": "refined"}, "refined"]
+    assert locks == []  # Leases were released in the same pipeline as the writes
+    assert client.get.call_count == 0
+    assert client.setex.call_count == 0
+    assert client.mget.call_count == 2  # The prefetch, then the read-back above
+    assert client.pipeline.call_count == 1
+
+
+def test_many_keys_are_read_and_written_in_one_round_trip():
+    async def run():
+        client = _counting_client()
+        await cache.aset_many(client, [("classification:a", "A", 60, ()), ("classification:b", "B", 60, ())])
+        cache.clear_local()
+        return client, await cache.aget_many(client, ["classification:a", "classification:missing", "classification:b"])
+
+    client, values = asyncio.run(run())
+
+    assert values == ["A", None, "B"]
+    assert client.pipeline.call_count == 1
+    assert client.mget.call_count == 1
+    assert client.get.call_count == 0
+
+
+async def _tagged_entries(client):
+    await cache.aset_many(client, [
+        ("query_result:openai hq", "SF", 60, cache.tags_for("OpenAI", "Location")),
+        ("company_info:openai:financials", "$", 60, cache.tags_for("OpenAI", "Financials")),
+        ("query_result:tesla hq", "Austin", 60, cache.tags_for("Tesla", "Location")),
+    ])
+
+
+def test_invalidate_by_company_leaves_other_companies():
+    async def run():
+        client = fakeredis.FakeAsyncRedis()
+        await _tagged_entries(client)
+        count = await cache.ainvalidate(client, company_name="openai")
+        remaining = sorted(k.decode() for k in await client.keys("*") if not k.startswith(b"tag:"))
+        return count, remaining, await cache.aget(client, "query_result:openai hq")
+
+    count, remaining, value = asyncio.run(run())
+
+    assert count == 2
+    assert remaining == ["query_result:tesla hq"]
+    assert value is None  # Gone from the local tier too
+
+
+def test_invalidate_filters_combine():
+    async def run():
+        client = fakeredis.FakeAsyncRedis()
+        await _tagged_entries(client)
+        by_type = await cache.ainvalidate(client, company_name="OpenAI", query_type="Location")
+        by_namespace = await cache.ainvalidate(client, namespace="company_info")
+        return by_type, by_namespace, sorted(k.decode() for k in await client.keys("*") if not k.startswith(b"tag:"))
+
+    by_type, by_namespace, remaining = asyncio.run(run())
+
+    assert (by_type, by_namespace) == (1, 1)
+    assert remaining == ["query_result:tesla hq"]
+
+
+def test_invalidate_counts_only_keys_that_still_exist():
+    """Tag members whose keys expired or were deleted are pruned and not counted."""
+    async def run():
+        client = fakeredis.FakeAsyncRedis()
+        await _tagged_entries(client)
+        await client.zadd("tag:company:openai", {"query_result:openai ceo": time.time() - 1})  # Expired
+        await client.delete("company_info:openai:financials")  # Deleted outside ainvalidate
+        count = await cache.ainvalidate(client, company_name="openai")
+        return count, await client.exists("tag:company:openai")
+
+    count, tag_exists = asyncio.run(run())
+
+    assert count == 1
+    assert not tag_exists
+
+def test_invalidation_reaches_other_processes_local_tier():
+    """A process drops keys another process invalidated once it hears about them on the channel."""
+    async def run():
+        client = fakeredis.FakeAsyncRedis()
+        cache._local.set("query_result:openai hq", "SF", time.time() + 60)
+        listener = asyncio.create_task(cache.listen_for_invalidations(client))
+        await asyncio.sleep(0.05)
+        await client.publish(cache.INVALIDATION_CHANNEL, json.dumps({"keys": ["query_result:openai hq"]}))
+        for _ in range(50):
+            if cache._local.get("query_result:openai hq") is None:
+                break
+            await asyncio.sleep(0.01)
+        listener.cancel()
+        return cache._local.get("query_result:openai hq")
+
+    assert asyncio.run(run()) is None
+
+
+def test_stale_refresh_adopts_a_value_another_process_wrote():
+    """A stale local copy is not recomputed when Redis already holds a fresh value."""
+    compute = AsyncMock(return_value="mine")
+
+    async def run():
+        client = fakeredis.FakeAsyncRedis()
+        await client.set("query_result:q", cache._encode("theirs", time.time() + 60))
+        cache._local.set("query_result:q", "old", time.time() - 1)
+        first = await cache.aget_or_compute(client, "query_result:q", compute, ttl=60)
+        await asyncio.gather(*cache._refresh_tasks)
+        return first, await cache.aget_or_compute(client, "query_result:q", compute, ttl=60)
+
+    assert asyncio.run(run()) == ("old", "theirs")
+    compute.assert_not_awaited()
+
+
+def test_stale_refresh_waits_for_the_process_holding_the_lease():
+    """Only the lease holder refreshes; other processes pick up its value."""
+    compute = AsyncMock(return_value="mine")
+
+    async def run():
+        client = fakeredis.FakeAsyncRedis()
+        cache._local.set("query_result:q", "old", time.time() - 1)
+        await client.set("lock:query_result:q", "other-process")
+        first = await cache.aget_or_compute(client, "query_result:q", compute, ttl=60)
+        await asyncio.sleep(0.1)
+        await client.set("query_result:q", cache._encode("theirs", time.time() + 60))
+        await client.delete("lock:query_result:q")
+        await asyncio.gather(*cache._refresh_tasks)
+        return first, cache._local.get("query_result:q")
+
+    assert asyncio.run(run()) == ("old", ("theirs", True))
+    compute.assert_not_awaited()
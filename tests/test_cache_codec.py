@@ -0,0 +1,41 @@
+import asyncio
+import json
+import time
+import fakeredis
+import cache
+import cache_codec
+
+ANSWER = {
+    "company_name": "TestCo", "query_type": "Company Overview", "response": "TestCo makes widgets. " * 60,
+    "confidence_score": 0.8, "source": "Wikipedia: https://en.wikipedia.org/wiki/TestCo",
+    "citation_url": "Wikipedia: https://en.wikipedia.org/wiki/TestCo",
+}
+
+
+def test_round_trip_drops_duplicate_citation_and_compresses_large_payloads():
+    """Entries decode to the original value while storing `source` once and compressing big bodies."""
+    fresh_until = time.time() + 60
+    encoded = cache_codec.encode(ANSWER, fresh_until)
+
+    assert cache_codec.decode(encoded) == (ANSWER, fresh_until)
+    assert len(encoded) < len(json.dumps({"_cache": 1, "fresh_until": fresh_until, "value": ANSWER})) / 4
+    assert encoded.count(b"en.wikipedia.org") <= 1
+
+    small = cache_codec.encode("Springfield", fresh_until)
+    assert not small[4] & cache_codec.FLAG_ZSTD
+    assert cache_codec.decode(small) == ("Springfield", fresh_until)
+
+
+def test_cache_reads_legacy_entries_and_skips_newer_schemas():
+    """Schema 1 JSON envelopes stay readable; entries from a newer schema are treated as misses."""
+    async def scenario():
+        client = fakeredis.FakeAsyncRedis()
+        await client.set("company_info:old", json.dumps({"_cache": 1, "fresh_until": time.time() + 60, "value": "v1"}))
+        newer = bytearray(cache_codec.encode("v3", time.time() + 60))
+        newer[3] = cache_codec.SCHEMA_VERSION + 1
+        await client.set("company_info:new", bytes(newer))
+        await cache.aset(client, "company_info:current", ANSWER, 60)
+        cache.clear_local()
+        return [await cache.aget(client, key) for key in ("company_info:old", "company_info:new", "company_info:current")]
+
+    assert asyncio.run(scenario()) == ["v1", None, ANSWER]
@@ -0,0 +1,45 @@
+import asyncio
+from unittest.mock import patch
+import fakeredis
+import clarification
+
+
+@patch("clarification.redis_client", None)
+@patch("clarification.async_redis_client", None)
+def test_resolve_by_token_and_by_selection():
+    """Both the token and the selection alone find the open ambiguity, which is consumed once resolved."""
+    token = clarification.register("Mercury revenue", ["Mercury Systems", "Mercury Insurance"], "Revenue")
+    other = clarification.register("Apple products", ["Apple Inc.", "Apple Records"], "Products")
+
+    pending = asyncio.run(clarification.aresolve("Mercury Systems", token))
+    assert pending == {
+        "query": "Mercury revenue",
+        "options": ["Mercury Systems", "Mercury Insurance"],
+        "query_type": "Revenue",
+        "selection": "Mercury Systems",
+    }
+    assert asyncio.run(clarification.aresolve("Mercury Systems", token)) is None
+
+    assert asyncio.run(clarification.aresolve("apple records"))["selection"] == "Apple Records"
+    assert asyncio.run(clarification.aresolve("Apple Inc.", other)) is None
+
+
+@patch("clarification.redis_client", None)
+@patch("clarification.async_redis_client", None)
+def test_wrong_selection_keeps_ambiguity_open():
+    token = clarification.register("Mercury revenue", ["Mercury Systems", "Mercury Insurance"])
+
+    assert asyncio.run(clarification.aresolve("Mercury (planet)", token)) is None
+    assert asyncio.run(clarification.aresolve("Mercury Insurance", token)) is not None
+
+
+def test_token_is_consumed_once_under_concurrent_resolves():
+    """Two resolvers racing on one token: exactly one gets the ambiguity."""
+    async def run():
+        client = fakeredis.FakeAsyncRedis()
+        with patch("clarification.async_redis_client", client):
+            token = await clarification.aregister("Mercury revenue", ["Mercury Systems", "Mercury Insurance"])
+            return await asyncio.gather(*[clarification.aresolve("Mercury Systems", token) for _ in range(2)])
+
+    results = asyncio.run(run())
+    assert sum(result is not None for result in results) == 1
@@ -0,0 +1,61 @@
+import asyncio
+import httpx
+import clients
+
+
+def test_parse_search_and_page():
+    """MediaWiki responses should be reduced to titles and a {title, url, content} page."""
+    search = {"query": {"search": [{"title": "OpenAI"}, {"title": "OpenAI Five"}]}}
+    assert clients._parse_search(search) == ["OpenAI", "OpenAI Five"]
+
+    page = {"query": {"pages": {
+        "-1": {"title": "Missing", "missing": ""},
+        "123": {"title": "OpenAI", "fullurl": "https://en.wikipedia.org/wiki/OpenAI", "extract": "OpenAI is...", "lastrevid": 42},
+    }}}
+    assert clients._parse_page(page) == {
+        "title": "OpenAI", "url": "https://en.wikipedia.org/wiki/OpenAI", "content": "OpenAI is...", "revision_id": 42}
+    assert clients._parse_revision(page) == 42
+    assert clients._parse_page({"query": {"pages": {"-1": {"title": "X", "missing": ""}}}}) is None
+
+
+def test_async_client_is_reused_per_loop():
+    """Every request on a loop should share one pooled client instead of opening new connections."""
+    async def fetch_twice():
+        first, second = clients.get_async_http_client(), clients.get_async_http_client()
+        await clients.aclose()
+        return first, second
+
+    first, second = asyncio.run(fetch_twice())
+    assert first is second
+    assert first.is_closed
+
+
+def test_run_sync_reuses_one_loop():
+    """Blocking callers should share the bridge loop, so its pooled client stays warm."""
+    async def current_loop():
+        return asyncio.get_running_loop()
+
+    assert clients.run_sync(current_loop()) is clients.run_sync(current_loop())
+
+
+def test_llm_uses_the_running_loops_pool():
+    """LLM calls from different loops go through each loop's own pooled client, which aclose() closes."""
+    async def call_llm():
+        seen = []
+
+        def handle(request):
+            seen.append(request.url.path)
+            return httpx.Response(200, json={"object": "list", "data": []})
+
+        pool = httpx.AsyncClient(transport=httpx.MockTransport(handle))
+        clients._async_http_clients[asyncio.get_running_loop()] = pool
+        await clients.llm.root_async_client.models.list()
+        await clients.aclose()
+        return seen, pool
+
+    first_seen, first_pool = asyncio.run(call_llm())
+    second_seen, second_pool = asyncio.run(call_llm())
+
+    assert first_seen == second_seen == ["/v1/models"]
+    assert first_pool is not second_pool
+    assert first_pool.is_closed and second_pool.is_closed
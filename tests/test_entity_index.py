@@ -0,0 +1,79 @@
+from unittest.mock import patch
+from entity_index import AMBIGUOUS_TTL, CompanyIndex
+
+
+def _index():
+    index = CompanyIndex()
+    index.add("Alphabet Inc.", aliases=["Google", "Alphabet"], tickers=["GOOGL"], wiki_title="Alphabet Inc.")
+    index.add("Goldman Sachs", tickers=["GS"], wiki_title="Goldman Sachs")
+    return index
+
+
+def test_exact_lookup_by_alias_and_ticker():
+    index = _index()
+    assert index.lookup("google") == ["Alphabet Inc."]
+    assert index.lookup("GOOGL") == ["Alphabet Inc."]
+    assert index.wiki_title("Google") == "Alphabet Inc."
+
+
+def test_prefix_and_fuzzy_lookup():
+    index = _index()
+    assert index.prefix("gold") == ["Goldman Sachs"]
+    assert index.fuzzy("Goldmann Sachs") == ["Goldman Sachs"]
+    assert index.fuzzy("Microsoft") == []
+
+
+def test_resolve_decides_locally():
+    """Known, ambiguous and recently-unknown names are answered without a network call."""
+    index = _index()
+    index.learn("Mercury", {"ambiguous": True, "options": ["Mercury Systems", "Mercury Insurance"]})
+    index.learn("Nonexistent Widgets", {"error": "Company not found: 'Nonexistent Widgets' does not exist."})
+
+    assert index.resolve("Google") == {"verified": "Alphabet Inc."}
+    assert index.resolve("Mercury")["options"] == ["Mercury Systems", "Mercury Insurance"]
+    assert "error" in index.resolve("Nonexistent Widgets")
+    assert index.resolve("Anthropic") is None
+
+
+def test_ambiguity_options_are_not_verified_and_expire():
+    """Disambiguation options are not companies, and an ambiguity verdict is re-checked after ENTITY_AMBIGUOUS_TTL."""
+    index = _index()
+    with patch("entity_index.time.time", return_value=1000.0):
+        index.learn("Mercury", {"ambiguous": True, "options": ["Mercury Systems", "Mercury (planet)"]})
+
+    assert index.resolve("Mercury (planet)") is None
+    assert "Mercury (planet)" not in index
+    with patch("entity_index.time.time", return_value=1000.0 + AMBIGUOUS_TTL - 1):
+        assert index.resolve("Mercury")["ambiguous"] is True
+    with patch("entity_index.time.time", return_value=1000.0 + AMBIGUOUS_TTL):
+        assert index.resolve("Mercury") is None
+
+def test_find_in_ignores_tickers_in_free_text():
+    index = _index()
+    assert index.find_in("Who is the CEO of Goldman Sachs?") == "Goldman Sachs"
+    assert index.find_in("What gs means") is None
+
+
+def test_index_round_trips_through_disk(tmp_path):
+    path = tmp_path / "company_index.json"
+    index = _index()
+    index.learn("Mercury", {"ambiguous": True, "options": ["Mercury Systems", "Mercury Insurance"]})
+    index.save(str(path))
+
+    loaded = CompanyIndex.load(str(path))
+    assert loaded.resolve("GOOGL") == {"verified": "Alphabet Inc."}
+    assert loaded.resolve("Mercury")["ambiguous"] is True
+
+
+def test_saves_from_several_processes_are_merged(tmp_path):
+    """Workers share one index file; a save keeps what other workers saved before it."""
+    path = str(tmp_path / "company_index.json")
+    first, second = CompanyIndex(path), CompanyIndex(path)
+    first.learn("OpenAI", {"verified": "OpenAI"})
+    second.learn("Tesla", {"verified": "Tesla, Inc."})
+    first.save()
+    second.save()
+
+    loaded = CompanyIndex.load(path)
+    assert loaded.resolve("OpenAI") == {"verified": "OpenAI"}
+    assert loaded.resolve("Tesla") == {"verified": "Tesla, Inc."}
@@ -0,0 +1,66 @@
+import json
+import logging
+import queue
+import logging_config
+from fastapi.testclient import TestClient
+import main
+
+
+def _record(level, msg, *args):
+    return logging.LogRecord("test", level, __file__, 1, msg, args, None)
+
+
+def test_records_are_truncated_and_rendered_as_json():
+    """Long payloads are cut before queueing, and the writer emits one JSON object per record."""
+    handler = logging_config.NonBlockingQueueHandler(queue.Queue())
+    token = logging_config.request_id.set("req-1")
+    try:
+        record = _record(logging.INFO, "Source text: %s", "x" * 5000)
+        assert logging_config.ContextFilter().filter(record)
+    finally:
+        logging_config.request_id.reset(token)
+
+    prepared = handler.prepare(record)
+    assert len(prepared.msg) < 1100 and prepared.msg.endswith("chars truncated]")
+    line = json.loads(logging_config.JsonFormatter().format(prepared))
+    assert (line["level"], line["request_id"]) == ("INFO", "req-1")
+    assert line["message"].startswith("Source text: xxx")
+
+
+def test_debug_records_are_sampled_but_info_is_kept():
+    """Verbose DEBUG records are sampled at the configured rate; INFO and above always pass."""
+    never = logging_config.ContextFilter(debug_sample_rate=0.0)
+    assert not never.filter(_record(logging.DEBUG, "verbose"))
+    assert never.filter(_record(logging.INFO, "important"))
+    assert logging_config.ContextFilter(debug_sample_rate=1.0).filter(_record(logging.DEBUG, "verbose"))
+
+
+def test_full_queue_drops_instead_of_blocking():
+    """A stalled writer must never block the request path."""
+    handler = logging_config.NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    handler.emit(_record(logging.INFO, "first"))
+    handler.emit(_record(logging.INFO, "second"))
+    assert handler.dropped == 1
+
+
+def test_request_id_is_echoed_or_generated():
+    client = TestClient(main.app)
+    assert client.get("/metrics", headers={"X-Request-ID": "abc123"}).headers["X-Request-ID"] == "abc123"
+    assert len(client.get("/metrics").headers["X-Request-ID"]) == 32
+
+
+def test_configure_logging_replaces_handlers_installed_earlier():
+    """A handler installed before configuration (e.g. by basicConfig) must not bypass the queue."""
+    root = logging.getLogger()
+    saved_handlers, saved_listener = list(root.handlers), logging_config._listener
+    stray = logging.StreamHandler()
+    root.addHandler(stray)
+    logging_config._listener = None
+    try:
+        logging_config.configure_logging(filename=None)
+        assert stray not in root.handlers
+        assert [type(h) for h in root.handlers] == [logging_config.NonBlockingQueueHandler]
+    finally:
+        logging_config.shutdown_logging()
+        root.handlers[:] = saved_handlers
+        logging_config._listener = saved_listener
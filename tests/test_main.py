@@ -0,0 +1,173 @@
+import asyncio
+import json
+from unittest.mock import patch, AsyncMock
+from fastapi.testclient import TestClient
+import clarification
+import main
+
+client = TestClient(main.app)
+
+
+@patch("main.async_redis_client", None)
+def test_batch_endpoint_streams_ndjson():
+    """Each query gets one NDJSON line tagged with its position in the request."""
+    async def fake_batch(queries, concurrency):
+        assert concurrency == 3
+        for i in reversed(range(len(queries))):
+            yield i, {"company_name": "TestCo", "query_type": "Revenue", "response": queries[i], "confidence_score": 0.8}
+
+    with patch("main.aretrieve_batch", fake_batch):
+        response = client.post("/query/batch", json={"queries": ["q1", "q2"], "concurrency": 3})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [(line["index"], line["result"]["response"]) for line in lines] == [(1, "q2"), (0, "q1")]
+
+
+def test_batch_endpoint_validates_concurrency():
+    response = client.post("/query/batch", json={"queries": ["q1"], "concurrency": 0})
+    assert response.status_code == 422
+
+
+MERCURY_ANSWER = {
+    "company_name": "Mercury Systems", "query_type": "Revenue", "response": "$1B",
+    "confidence_score": 0.8, "source": "Wikipedia", "citation_url": "Wikipedia",
+}
+
+
+def test_clarify_uses_token_lookup():
+    """/clarify/ resolves through the clarification token instead of scanning Redis."""
+    pending = {"query": "Mercury revenue", "options": ["Mercury Systems"], "query_type": None, "selection": "Mercury Systems"}
+    with patch("main.clarification.aresolve", AsyncMock(return_value=pending)) as mock_resolve, \
+            patch("main.aretrieve_information", AsyncMock(return_value=MERCURY_ANSWER)) as mock_retrieve:
+        response = client.get("/clarify/", params={"selection": "mercury systems", "token": "abc"})
+
+    assert response.status_code == 200
+    mock_resolve.assert_awaited_once_with("mercury systems", "abc")
+    mock_retrieve.assert_awaited_once_with("Mercury revenue (referring to Mercury Systems)")
+
+
+@patch("main.async_redis_client", None)
+def test_clarify_skips_classification_and_caches_answer():
+    """With the category known from the first pass, /clarify/ goes straight to retrieval and caches the result."""
+    pending = {"query": "Mercury revenue", "options": ["Mercury Systems"], "query_type": "Revenue", "selection": "Mercury Systems"}
+    answer = MERCURY_ANSWER
+    with patch("main.clarification.aresolve", AsyncMock(return_value=pending)), \
+            patch("main.aretrieve_information", AsyncMock()) as mock_full_pipeline, \
+            patch("main.aretrieve_company_info", AsyncMock(return_value=answer)) as mock_company_info:
+        response = client.get("/clarify/", params={"selection": "Mercury Systems"})
+
+    assert response.json()["response"] == "$1B"
+    mock_full_pipeline.assert_not_called()
+    query_data = mock_company_info.await_args.args[0]
+    assert (query_data["company_name"], query_data["query_type"]) == ("Mercury Systems", "Revenue")
+    assert main.cache.get(None, "query_result:mercury revenue (referring to mercury systems)") == answer
+
+
+def test_clarify_maps_errors_like_query():
+    """Without a known category, /clarify/ runs the full pipeline and its errors get /query/'s status codes."""
+    pending = {"query": "Mercury revenue", "options": ["Mercury Systems"], "query_type": None, "selection": "Mercury Systems"}
+    error = {"error": "Company not found: 'Mercury Systems' does not exist."}
+    with patch("main.clarification.aresolve", AsyncMock(return_value=pending)), \
+            patch("main.aretrieve_information", AsyncMock(return_value=error)):
+        response = client.get("/clarify/", params={"selection": "Mercury Systems"})
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == error["error"]
+
+def test_clarify_rejects_unknown_selection():
+    with patch("main.clarification.aresolve", AsyncMock(return_value=None)):
+        response = client.get("/clarify/", params={"selection": "Nope"})
+    assert response.status_code == 400
+
+
+def test_metrics_endpoint_exposes_prometheus_text():
+    client.get("/metrics")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'company_info_http_request_duration_seconds_count{method="GET",route="/metrics",status="200"}' in response.text
+
+
+def _sse_events(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+@patch("main.async_redis_client", None)
+def test_stream_endpoint_emits_stage_events_then_caches():
+    """/query/stream sends each stage as it finishes; the next identical query is one cached event."""
+    answer = {
+        "company_name": "TestCo", "query_type": "Location", "response": "Springfield",
+        "confidence_score": 0.7, "source": "Wikipedia", "citation_url": "Wikipedia",
+    }
+
+    async def fake_pipeline(user_query):
+        main.progress.emit("classification", {"company_name": "TestCo", "query_type": "Location"})
+        main.progress.emit("source", {"source": "wikipedia", "text": "TestCo is in Springfield.", "url": "https://w"})
+        for token in ["Spring", "field"]:
+            main.progress.emit("token", {"text": token})
+        return answer
+
+    with patch("main.aretrieve_information", AsyncMock(side_effect=fake_pipeline)) as mock_pipeline:
+        first = client.get("/query/stream", params={"user_query": "Where is TestCo?"})
+        second = client.get("/query/stream", params={"user_query": "Where is TestCo?"})
+
+    assert first.headers["content-type"].startswith("text/event-stream")
+    events = _sse_events(first.text)
+    assert [name for name, _ in events] == ["classification", "source", "token", "token", "result"]
+    assert "".join(data["text"] for name, data in events if name == "token") == "Springfield"
+    assert events[-1][1] == answer
+    assert _sse_events(second.text) == [("result", answer)]
+    assert mock_pipeline.await_count == 1
+
+
+@patch("main.async_redis_client", None)
+def test_stream_endpoint_reports_ambiguity():
+    ambiguous = {"ambiguous": True, "message": "Multiple companies match 'Mercury'.", "options": ["Mercury Systems"],
+                 "clarification_token": "abc"}
+    with patch("main.aretrieve_information", AsyncMock(return_value=ambiguous)):
+        response = client.get("/query/stream", params={"user_query": "Mercury revenue"})
+
+    assert _sse_events(response.text) == [("ambiguous", ambiguous)]
+
+
+def test_clear_cache_forwards_filters():
+    with patch("main.cache.ainvalidate", AsyncMock(return_value=3)) as mock_invalidate:
+        response = client.post("/clear-cache/", params={"company_name": "OpenAI", "query_type": "Financials"})
+
+    assert response.status_code == 200
+    assert response.json()["invalidated"] == 3
+    mock_invalidate.assert_awaited_once_with(main.async_redis_client, "OpenAI", "Financials", None)
+
+
+def test_clear_cache_rejects_unknown_namespace():
+    response = client.post("/clear-cache/", params={"namespace": "ambiguity"})
+    assert response.status_code == 400
+
+
+@patch("main.async_redis_client", None)
+@patch("clarification.async_redis_client", None)
+def test_concurrent_ambiguous_queries_get_their_own_tokens():
+    """Identical queries share one retrieval, but each caller can resolve its own clarification token."""
+    async def fake_pipeline(user_query):
+        await asyncio.sleep(0.01)
+        token = await clarification.aregister(user_query, ["Delta Air Lines", "Delta Faucet"], "Location")
+        return {"ambiguous": True, "message": "Your query is ambiguous.", "options": ["Delta Air Lines", "Delta Faucet"],
+                "clarification_token": token}
+
+    async def run():
+        with patch("main.aretrieve_information", AsyncMock(side_effect=fake_pipeline)) as mock_pipeline:
+            responses = await asyncio.gather(*[main._aanswer("Where is Delta headquartered?") for _ in range(2)])
+        pending = [await clarification.aresolve("Delta Faucet", r["clarification_token"]) for r in responses]
+        return mock_pipeline.await_count, responses, pending
+
+    calls, responses, pending = asyncio.run(run())
+
+    assert calls == 1
+    assert responses[0]["clarification_token"] != responses[1]["clarification_token"]
+    assert all(p is not None and p["query_type"] == "Location" for p in pending)
@@ -0,0 +1,47 @@
+import asyncio
+import pytest
+from prometheus_client import REGISTRY
+import cache
+import metrics
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_stage_records_latency_and_in_flight():
+    """Each stage observation lands in the histogram, and the in-flight gauge returns to zero."""
+    before = _sample("company_info_stage_duration_seconds_count", stage="test_stage", outcome="ok")
+
+    @metrics.timed("test_stage")
+    async def work():
+        assert _sample("company_info_stage_in_flight", stage="test_stage") == 1
+        await asyncio.sleep(0)
+
+    asyncio.run(work())
+    assert _sample("company_info_stage_duration_seconds_count", stage="test_stage", outcome="ok") == before + 1
+    assert _sample("company_info_stage_in_flight", stage="test_stage") == 0
+
+
+def test_stage_records_errors():
+    before = _sample("company_info_stage_duration_seconds_count", stage="test_failing", outcome="error")
+    with pytest.raises(ValueError):
+        with metrics.stage("test_failing"):
+            raise ValueError("boom")
+    assert _sample("company_info_stage_duration_seconds_count", stage="test_failing", outcome="error") == before + 1
+
+
+def test_cache_hits_and_misses_are_counted_per_namespace():
+    """The namespace is the key prefix, so every cache shows up separately."""
+    def count(result):
+        return _sample("company_info_cache_requests_total", namespace="metricstest", result=result)
+
+    misses, hits = count("miss"), count("hit")
+
+    async def compute():
+        return "value"
+
+    asyncio.run(cache.aget_or_compute(None, "metricstest:key", compute, ttl=60))
+    asyncio.run(cache.aget_or_compute(None, "metricstest:key", compute, ttl=60))
+    assert count("miss") == misses + 1
+    assert count("hit") == hits + 1
@@ -0,0 +1,82 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock, patch
+import httpx
+import page_store
+from page_store import PageStore, aget_page
+from data_retrieval import graph, RetrievalState
+
+PAGE = {"title": "OpenAI", "url": "https://en.wikipedia.org/wiki/OpenAI", "content": "OpenAI is an AI company. " * 50, "revision_id": 7}
+
+
+def _fetch(store, title, page=PAGE, revision=7):
+    fetch_page, fetch_revision = AsyncMock(return_value=page), AsyncMock(return_value=revision)
+    result = asyncio.run(aget_page(store, title, fetch_page, fetch_revision))
+    return result, fetch_page, fetch_revision
+
+
+def test_store_round_trips_pages_and_redirect_aliases():
+    store = PageStore(":memory:")
+    store.put("Open AI", PAGE)
+    for title in ("OpenAI", "openai", "Open AI"):
+        entry = store.get(title)
+        assert (entry["title"], entry["content"], entry["revision_id"]) == ("OpenAI", PAGE["content"], 7)
+    assert store.get("Anthropic") is None
+
+
+def test_fresh_page_needs_no_network():
+    store = PageStore(":memory:")
+    store.put("OpenAI", PAGE)
+    result, fetch_page, fetch_revision = _fetch(store, "OpenAI")
+    assert result["content"] == PAGE["content"]
+    fetch_page.assert_not_awaited()
+    fetch_revision.assert_not_awaited()
+
+
+def test_unchanged_revision_is_not_downloaded_again():
+    """After the check interval only the revision is fetched; the page body is reused."""
+    store = PageStore(":memory:")
+    store.put("OpenAI", PAGE, now=time.time() - page_store.REVISION_CHECK_INTERVAL - 1)
+
+    result, fetch_page, fetch_revision = _fetch(store, "OpenAI")
+    assert result["revision_id"] == 7
+    fetch_revision.assert_awaited_once_with("OpenAI")
+    fetch_page.assert_not_awaited()
+    assert time.time() - store.get("OpenAI")["checked_at"] < 5
+
+
+def test_new_revision_or_expired_page_is_downloaded():
+    store = PageStore(":memory:")
+    updated = {**PAGE, "content": "Updated. " * 50, "revision_id": 8}
+
+    store.put("OpenAI", PAGE, now=time.time() - page_store.REVISION_CHECK_INTERVAL - 1)
+    result, fetch_page, _ = _fetch(store, "OpenAI", page=updated, revision=8)
+    assert result["revision_id"] == 8 and store.get("OpenAI")["revision_id"] == 8
+
+    store.put("OpenAI", PAGE, now=time.time() - page_store.PAGE_TTL - 1)
+    _, fetch_page, fetch_revision = _fetch(store, "OpenAI", page=updated)
+    fetch_page.assert_awaited_once()
+    fetch_revision.assert_not_awaited()
+
+
+def test_stored_copy_is_served_when_refresh_fails():
+    store = PageStore(":memory:")
+    store.put("OpenAI", PAGE, now=time.time() - page_store.PAGE_TTL - 1)
+    failing = AsyncMock(side_effect=httpx.ConnectError("down"))
+    result = asyncio.run(aget_page(store, "OpenAI", failing, failing))
+    assert result["content"] == PAGE["content"]
+
+
+@patch("data_retrieval.arefine_response", new_callable=AsyncMock)
+@patch("data_retrieval.clients")
+def test_categories_share_one_page_download(mock_clients, mock_refine):
+    """Overview, Key People and Products for one company download the article once."""
+    mock_clients.awiki_search = AsyncMock(return_value=["OpenAI"])
+    mock_clients.awiki_page = AsyncMock(return_value=PAGE)
+    mock_clients.atavily_search = AsyncMock(return_value=[])
+    mock_refine.return_value = "answer"
+
+    for query_type in ("Company Overview", "Key People", "Products"):
+        asyncio.run(graph.ainvoke(RetrievalState(query=f"OpenAI {query_type}", query_type=query_type)))
+
+    assert mock_clients.awiki_page.await_count == 1
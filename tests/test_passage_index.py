@@ -0,0 +1,71 @@
+import asyncio
+import passage_index
+
+PAGE = "\n".join([
+    "Acme Corp is an American manufacturer founded in 1949. It is known for anvils and rockets.",
+    "History. The company grew quickly after the war. Its first factory opened in Ohio.",
+    "In 2021 Acme acquired Roadrunner Logistics for $2 billion, its largest acquisition to date.",
+    "Acme reported annual revenue of $14 billion in fiscal 2023, mostly from industrial sales.",
+    "The headquarters are located in Phoenix, Arizona.",
+])
+
+
+def test_split_passages_respects_sentence_and_size_limits():
+    """Long paragraphs should be packed into passages of whole sentences no longer than the limit."""
+    text = " ".join(f"Sentence number {i} is here." for i in range(40))
+    passages = passage_index.split_passages(text, max_chars=120)
+    assert len(passages) > 1
+    assert all(len(p) <= 120 for p in passages)
+    assert all(p.endswith(".") for p in passages)
+    assert " ".join(passages) == text
+
+
+def test_bm25_ranks_matching_passages_first():
+    """Rarer query terms should outweigh common ones, and passages without any term are left out."""
+    index = passage_index.BM25Index(["apple banana", "apple cherry", "apple", "durian"])
+    assert index.top("cherry apple", 3) == [1, 2, 0]  # Shorter passages win ties on term frequency
+    assert index.top("kiwi", 3) == []
+
+
+def test_select_uses_category_terms():
+    """The same query should surface different passages depending on its category."""
+    documents = [(PAGE, "https://example.com/acme")]
+
+    revenue = asyncio.run(passage_index.aselect(documents, "Acme", "Revenue", k=1))
+    acquisitions = asyncio.run(passage_index.aselect(documents, "Acme", "Acquisitions", k=1))
+    location = asyncio.run(passage_index.aselect(documents, "Acme", "Location", k=1))
+
+    assert "revenue of $14 billion" in revenue[0][0]
+    assert "acquired Roadrunner" in acquisitions[0][0]
+    assert "Phoenix" in location[0][0]
+    assert revenue[0][1] == "https://example.com/acme"
+
+
+def test_select_falls_back_to_leading_passages():
+    """Text with no overlap with the query should still yield its opening passages."""
+    result = asyncio.run(passage_index.aselect([("Zyx qwv. Plk mno.", "u")], "Acme", "Unknown Category", k=2))
+    assert result == [("Zyx qwv. Plk mno.", "u")]
+
+
+def test_embeddings_rerank_candidates_and_failures_keep_bm25_order():
+    """Embedding similarity should reorder BM25 candidates, and an embedding error must not lose the answer."""
+    documents = [("\n".join(f"Acme revenue note {i}." for i in range(5)), "u")]
+
+    async def embed(texts):
+        # Query vector points at the last passage only
+        return [[0.0, 1.0]] + [[0.0, 1.0] if "note 4" in t else [1.0, 0.0] for t in texts[1:]]
+
+    async def broken(texts):
+        raise RuntimeError("embedding service down")
+
+    reranked = asyncio.run(passage_index.aselect(documents, "Acme revenue", "Revenue", k=1, embed=embed))
+    fallback = asyncio.run(passage_index.aselect(documents, "Acme revenue", "Revenue", k=1, embed=broken))
+    assert reranked[0][0] == "Acme revenue note 4."
+    assert fallback[0][0] == "Acme revenue note 0."
+
+
+def test_index_is_cached_by_key():
+    """Indexes built for a keyed page should be reused instead of re-tokenizing the text."""
+    first = passage_index.index_for([(PAGE, "u")], key="wiki:Acme:1")
+    assert passage_index.index_for([("ignored", "u")], key="wiki:Acme:1") is first
+    assert passage_index.index_for([(PAGE, "u")], key="wiki:Acme:2") is not first
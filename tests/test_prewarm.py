@@ -0,0 +1,83 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock, patch
+import fakeredis
+import cache
+import prewarm
+
+ANSWER = {"company_name": "TestCo", "query_type": "Location", "response": "Springfield", "confidence_score": 0.7,
+          "source": "Wikipedia", "citation_url": "Wikipedia"}
+
+
+def test_only_missing_or_expiring_entries_are_refreshed():
+    """Entries fresh beyond the refresh-ahead window are skipped; missing and soon-expiring ones are re-run."""
+    async def scenario():
+        client = fakeredis.FakeAsyncRedis()
+        await cache.aset(client, "company_info:testco:location", ANSWER, 86400)
+        await cache.aset(client, "company_info:testco:revenue", ANSWER, 60)
+        refresh = AsyncMock(return_value=ANSWER)
+        warmer = prewarm.Prewarmer(
+            client, ["TestCo"], top_n=0, categories=["Location", "Revenue", "Products"],
+            refresh_ahead=600, rate=0, refresh=refresh,
+        )
+        assert await warmer.run_once() == 2
+        return sorted(call.args for call in refresh.call_args_list)
+
+    assert asyncio.run(scenario()) == [("TestCo", "Products"), ("TestCo", "Revenue")]
+
+
+def test_top_companies_come_from_shared_traffic_counts():
+    """Answered requests are counted through Redis, so the busiest companies are warmed too."""
+    async def scenario():
+        client = fakeredis.FakeAsyncRedis()
+        warmer = prewarm.Prewarmer(client, [], top_n=2, categories=["Location"])
+        for name, count in [("Alpha", 3), ("Beta", 1), ("Gamma", 2)]:
+            for _ in range(count):
+                warmer.record({**ANSWER, "company_name": name})
+        warmer.record({"error": "Company not found"})  # Unanswered requests are not traffic
+        return await warmer.top_companies()
+
+    assert asyncio.run(scenario()) == ["Alpha", "Gamma"]
+
+
+def test_refreshes_are_rate_limited_and_failures_are_contained():
+    """Refreshes respect the rate limit, and a failing pair does not stop the rest."""
+    async def scenario():
+        async def refresh(company_name, query_type):
+            if query_type == "Revenue":
+                raise RuntimeError("quota exceeded")
+            return ANSWER
+
+        warmer = prewarm.Prewarmer(
+            None, ["TestCo"], top_n=0, categories=["Location", "Revenue", "Products"], rate=20, refresh=refresh,
+        )
+        start = time.monotonic()
+        refreshed = await warmer.run_once()
+        return refreshed, time.monotonic() - start
+
+    refreshed, elapsed = asyncio.run(scenario())
+    assert refreshed == 2
+    assert elapsed >= 0.09  # Three starts at 20/s are spaced over at least 100ms
+
+
+@patch("data_retrieval.async_redis_client", None)
+@patch("utils.async_redis_client", None)
+def test_forced_refresh_recomputes_fresh_entries():
+    """The pre-warmer's refresh must bypass fresh entries, or it would only re-serve the old answer."""
+    async def scenario():
+        await cache.aset(None, "company_info:testco:location", {**ANSWER, "response": "Old"}, 86400)
+        with patch("data_retrieval._arun_graph", new=AsyncMock(return_value=ANSWER)) as run_graph:
+            response = await prewarm.refresh_company_info("TestCo", "Location")
+        cached = await cache.aget(None, "company_info:testco:location")
+        return response, cached, run_graph.await_count
+
+    response, cached, runs = asyncio.run(scenario())
+    assert response["response"] == cached["response"] == "Springfield"
+    assert runs == 1
+
+
+def test_watchlist_merges_env_and_file(tmp_path):
+    """The watchlist combines the env list and file lines, skipping comments and duplicates."""
+    path = tmp_path / "watchlist.txt"
+    path.write_text("# hot companies\nOpenAI\nStripe\n\n")
+    assert prewarm.load_watchlist("OpenAI, Tesla", str(path)) == ["OpenAI", "Tesla", "Stripe"]
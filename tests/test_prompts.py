@@ -0,0 +1,83 @@
+import asyncio
+import threading
+from unittest.mock import patch, AsyncMock, MagicMock
+from langchain_core.messages import AIMessage
+import metrics
+import prompts
+import utils
+
+
+def test_prompt_carries_only_its_category_instruction():
+    """Each category's template should include its own rule and none of the other nine."""
+    prompt = prompts.build_refine_prompt("Acme is based in Phoenix.", "Location", "Where is Acme?")
+    assert prompts.CATEGORY_INSTRUCTIONS["Location"] in prompt
+    assert prompts.CATEGORY_INSTRUCTIONS["Revenue"] not in prompt
+    assert "**Question:** Where is Acme?" in prompt
+    assert prompts.DEFAULT_INSTRUCTION in prompts.build_refine_prompt("x", "Unlisted", "q")
+
+
+def test_evidence_is_trimmed_to_budget_across_sources():
+    """Oversized evidence should fit the token budget while keeping the best passage of each source."""
+    wiki = "\n".join(f"Wikipedia passage {i} " + "word " * 40 for i in range(5))
+    tavily = "\n".join(f"Tavily passage {i} " + "word " * 40 for i in range(5))
+    fitted = prompts.fit_evidence(f"{wiki}\n\n{tavily}", budget=120)
+
+    assert prompts.count_tokens(fitted) <= 120
+    assert "Wikipedia passage 0" in fitted and "Tavily passage 0" in fitted
+    assert "Wikipedia passage 4" not in fitted
+    assert prompts.fit_evidence("short text", budget=120) == "short text"
+
+
+@patch("utils.async_redis_client", None)
+def test_structured_answers_fill_query_formatting():
+    """With structured output on, JSON answers go through query_formatting; invalid JSON falls back to text."""
+    answers = iter([
+        AIMessage(content='{"amount": "14.2B"}'),
+        AIMessage(content='{"acquisitions": [{"company": "Roadrunner", "date": "2021"}]}'),
+        AIMessage(content="Revenue was large."),
+    ])
+    evidence = "Acme reported revenue of $14.2 billion in 2023. " * 5
+    with patch("prompts.REFINE_STRUCTURED_OUTPUT", True), patch("utils.llm") as mock_llm:
+        mock_llm.ainvoke = AsyncMock(side_effect=lambda *args, **kwargs: next(answers))
+        revenue = asyncio.run(utils.arefine_response(evidence, "Revenue", "Acme revenue"))
+        acquisitions = asyncio.run(utils.arefine_response(evidence, "Acquisitions", "Acme acquisitions"))
+        fallback = asyncio.run(utils.arefine_response(evidence, "Revenue", "Acme sales"))
+
+    assert revenue == "$14.2B"
+    assert acquisitions == "Roadrunner was acquired on 2021"
+    assert fallback == "Revenue was large."
+    assert mock_llm.ainvoke.call_args.kwargs["response_format"] == {"type": "json_object"}
+
+
+def test_token_usage_is_recorded():
+    """Prompt and completion token counts reported by the model should land in the histogram."""
+    def total(kind):
+        return sum(s.value for m in metrics.LLM_TOKENS.collect() for s in m.samples
+                   if s.name.endswith("_sum") and s.labels == {"call": "refine", "kind": kind})
+
+    before = total("prompt"), total("completion")
+    message = AIMessage(content="ok", usage_metadata={"input_tokens": 120, "output_tokens": 8, "total_tokens": 128})
+    metrics.record_tokens("refine", message)
+    metrics.record_tokens("refine", MagicMock())  # Responses without usage are ignored
+
+    assert (total("prompt") - before[0], total("completion") - before[1]) == (120, 8)
+
+
+def test_tokenizer_is_loaded_off_the_event_loop():
+    """The first tokenizer load can download its BPE file, so startup loads it in a worker thread."""
+    loaded_on = []
+
+    def load(model):
+        loaded_on.append(threading.get_ident())
+        return MagicMock()
+
+    prompts._encoding.cache_clear()
+    try:
+        with patch("tiktoken.encoding_for_model", side_effect=load):
+            asyncio.run(prompts.awarmup())
+            prompts.count_tokens("already loaded")
+    finally:
+        prompts._encoding.cache_clear()
+
+    assert len(loaded_on) == 1
+    assert loaded_on[0] != threading.get_ident()
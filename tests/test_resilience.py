@@ -0,0 +1,89 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+import httpx
+import openai
+import pytest
+import resilience
+from data_retrieval import graph, RetrievalState
+
+
+@patch("resilience.BACKOFF_BASE", 0.01)
+def test_retries_transient_failures_without_blocking():
+    func = AsyncMock(side_effect=[httpx.ConnectError("boom"), "ok"])
+    assert asyncio.run(resilience.call("wikipedia", func, "q", attempts=2)) == "ok"
+    assert func.await_count == 2
+    assert resilience.breaker("wikipedia").state == "closed"
+
+
+def test_client_errors_are_not_retried():
+    response = httpx.Response(400, request=httpx.Request("GET", "https://example.com"))
+    func = AsyncMock(side_effect=httpx.HTTPStatusError("bad request", request=response.request, response=response))
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(resilience.call("tavily", func, attempts=3))
+    assert func.await_count == 1
+
+
+def test_breaker_fails_fast_then_probes():
+    """After enough failures the upstream is skipped until one probe succeeds."""
+    breaker = resilience.CircuitBreaker("tavily", failure_threshold=2, reset_timeout=0.05)
+    with patch.dict(resilience._breakers, {"tavily": breaker}):
+        failing = AsyncMock(side_effect=httpx.ConnectError("down"))
+        for _ in range(2):
+            with pytest.raises(httpx.ConnectError):
+                asyncio.run(resilience.call("tavily", failing, attempts=1))
+        assert breaker.state == "open"
+
+        healthy = AsyncMock(return_value="ok")
+        with pytest.raises(resilience.CircuitOpenError):
+            asyncio.run(resilience.call("tavily", healthy))
+        healthy.assert_not_awaited()
+
+        time.sleep(0.06)
+        assert asyncio.run(resilience.call("tavily", healthy)) == "ok"
+        assert breaker.state == "closed"
+
+
+def test_deadline_caps_slow_calls_without_tripping_breaker():
+    async def slow():
+        await asyncio.sleep(1)
+
+    async def run():
+        with resilience.deadline(0.05):
+            await resilience.call("llm", slow)
+
+    start = time.perf_counter()
+    with pytest.raises(resilience.DeadlineExceeded):
+        asyncio.run(run())
+    assert time.perf_counter() - start < 0.5
+    assert resilience.breaker("llm").failures == 0
+
+
+@patch("data_retrieval.SOURCE_DEADLINE", 0.2)
+@patch("data_retrieval.arefine_response", new_callable=AsyncMock)
+@patch("data_retrieval.clients")
+def test_graph_returns_sources_that_finished_in_time(mock_clients, mock_refine):
+    """A source that misses the deadline is dropped; the answer uses what arrived in time."""
+    async def slow_tavily(query):
+        await asyncio.sleep(2)
+
+    mock_clients.awiki_search = AsyncMock(return_value=["TestCo"])
+    mock_clients.awiki_page = AsyncMock(return_value={
+        "title": "TestCo", "url": "https://en.wikipedia.org/wiki/TestCo", "content": "TestCo is a company."})
+    mock_clients.atavily_search.side_effect = slow_tavily
+    mock_refine.side_effect = lambda text, query_type, query, company_name=None: text
+
+    start = time.perf_counter()
+    final_state = asyncio.run(graph.ainvoke(RetrievalState(query="TestCo products", query_type="Products")))
+
+    assert time.perf_counter() - start < 1
+    assert final_state["final_result"]["response"] == "TestCo is a company."
+    assert final_state["final_result"]["confidence_score"] == 0.7
+
+
+def test_openai_client_errors_are_not_retried():
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    func = AsyncMock(side_effect=openai.BadRequestError("bad request", response=httpx.Response(400, request=request), body=None))
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(resilience.call("llm", func, attempts=3))
+    assert func.await_count == 1
@@ -1,6 +1,8 @@
+import asyncio
+import time
 import pytest
-from unittest.mock import patch, MagicMock
-from data_retrieval import retrieve_information
+from unittest.mock import patch, MagicMock, AsyncMock
+from data_retrieval import retrieve_information, aretrieve_information, aretrieve_batch, graph, RetrievalState
 from user_query import process_user_query
 from redis.exceptions import RedisError
 
@@ -103,3 +105,105 @@ def test_process_user_query_api_failure(mock_process):
 
     assert "error" in result
     assert result["error"] in ["API request failed", "Failed to extract company name or category."]
+
+
+@patch("data_retrieval.aprocess_user_query", new_callable=AsyncMock)
+@patch("data_retrieval.graph")
+@patch("data_retrieval.async_redis_client", new_callable=AsyncMock)
+def test_aretrieve_information_cache(mock_redis, mock_graph, mock_process_query):
+    """Ensures the async path returns cached responses without running the graph."""
+    mock_process_query.return_value = {
+        "company_name": "TestCo",
+        "query_type": "Revenue",
+        "structured_query": "TestCo revenue"
+    }
+
+    mock_redis.get.return_value = '{"response": "Cached revenue data"}'
+    result = asyncio.run(aretrieve_information("TestCo revenue"))
+    assert result["response"] == "Cached revenue data"
+    mock_graph.ainvoke.assert_not_called()
+
+
+@patch("data_retrieval.arefine_response", new_callable=AsyncMock)
+@patch("data_retrieval.clients")
+def test_graph_fetches_sources_concurrently(mock_clients, mock_refine):
+    """The wikipedia and tavily nodes should overlap instead of running back to back."""
+    async def slow_search(query):
+        await asyncio.sleep(0.3)
+        return ["TestCo"]
+
+    async def slow_tavily(query):
+        await asyncio.sleep(0.3)
+        return [{"content": "TestCo makes widgets.", "url": "https://example.com"}]
+
+    mock_clients.awiki_search.side_effect = slow_search
+    mock_clients.awiki_page = AsyncMock(return_value={
+        "title": "TestCo", "url": "https://en.wikipedia.org/wiki/TestCo", "content": "TestCo is a company."})
+    mock_clients.atavily_search.side_effect = slow_tavily
+    mock_refine.return_value = "Widgets"
+
+    start = time.perf_counter()
+    final_state = asyncio.run(graph.ainvoke(RetrievalState(query="TestCo products", query_type="Products")))
+    elapsed = time.perf_counter() - start
+
+    assert final_state["final_result"]["response"] == "Widgets"
+    assert elapsed < 0.55
+
+
+@patch("data_retrieval.aretrieve_company_info", new_callable=AsyncMock)
+@patch("data_retrieval.aprocess_user_queries", new_callable=AsyncMock)
+def test_aretrieve_batch_deduplicates(mock_process_queries, mock_company_info):
+    """Queries resolving to the same company and category should share one retrieval."""
+    query_data = {"company_name": "TestCo", "query_type": "Revenue", "structured_query": "TestCo revenue"}
+    mock_process_queries.return_value = [query_data, dict(query_data), {"error": "Company not found"}]
+    mock_company_info.return_value = {"response": "$1B"}
+
+    async def collect():
+        return [item async for item in aretrieve_batch(["a", "b", "c"], concurrency=2)]
+
+    results = dict(asyncio.run(collect()))
+    assert results == {0: {"response": "$1B"}, 1: {"response": "$1B"}, 2: {"error": "Company not found"}}
+    assert mock_company_info.await_count == 1
+
+
+@patch("data_retrieval.arefine_response", new_callable=AsyncMock)
+@patch("data_retrieval.clients")
+def test_empty_results_retry_with_rewritten_query(mock_clients, mock_refine):
+    """When no source finds anything, one more round runs with the category's rewritten query."""
+    async def search(query):
+        return ["TestCo"] if query == "TestCo headquarters" else []
+
+    async def tavily(query):
+        return []
+
+    mock_clients.awiki_search.side_effect = search
+    mock_clients.awiki_page = AsyncMock(return_value={
+        "title": "TestCo", "url": "https://en.wikipedia.org/wiki/TestCo",
+        "content": "TestCo is a company headquartered in Springfield, United States.", "revision_id": 1})
+    mock_clients.atavily_search.side_effect = tavily
+    mock_refine.return_value = "Springfield"
+
+    final_state = asyncio.run(graph.ainvoke(
+        RetrievalState(query="Where is TestCo?", query_type="Location", company_name="TestCo")))
+
+    assert final_state["final_result"]["response"] == "Springfield"
+    assert final_state["rewrites"] == 1
+    assert [c.args[0] for c in mock_clients.awiki_search.call_args_list] == ["Where is TestCo?", "TestCo headquarters"]
+    # The answer is refined for the user's question, not the rewrite
+    assert mock_refine.await_args.args[2] == "Where is TestCo?"
+
+
+@patch("data_retrieval.arefine_response", new_callable=AsyncMock)
+@patch("data_retrieval.clients")
+def test_failed_sources_are_not_retried_with_rewrites(mock_clients, mock_refine):
+    """If every source errored, rewriting the query cannot help, so the graph finishes immediately."""
+    mock_clients.awiki_search = AsyncMock(side_effect=RuntimeError("wikipedia down"))
+    mock_clients.atavily_search = AsyncMock(side_effect=RuntimeError("tavily down"))
+
+    final_state = asyncio.run(graph.ainvoke(
+        RetrievalState(query="Where is TestCo?", query_type="Location", company_name="TestCo")))
+
+    assert final_state["final_result"]["confidence_score"] == 0.0
+    assert final_state["rewrites"] == 0
+    assert {c.args[0] for c in mock_clients.awiki_search.call_args_list} == {"Where is TestCo?"}
+    mock_refine.assert_not_awaited()
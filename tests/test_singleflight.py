@@ -0,0 +1,48 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock
+import singleflight
+
+
+def test_concurrent_callers_share_one_computation():
+    """Identical in-flight keys should run the computation exactly once."""
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"response": "Shared"}
+
+    async def run():
+        return await asyncio.gather(*[singleflight.coalesce("company_info:testco:revenue", compute) for _ in range(10)])
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(result == {"response": "Shared"} for result in results)
+
+
+def test_errors_propagate_to_all_waiters():
+    """A failed computation should fail every coalesced caller and not stay registered."""
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def run():
+        return await asyncio.gather(*[singleflight.coalesce("k", compute) for _ in range(3)], return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert "k" not in singleflight._inflight
+
+
+def test_lease_holder_elsewhere_returns_its_result():
+    """When another replica holds the lease, the cached result it writes is returned instead of recomputing."""
+    client = AsyncMock()
+    client.set.return_value = False
+    client.exists.return_value = 1
+    lookup = AsyncMock(side_effect=[None, {"response": "From leader"}])
+    compute = AsyncMock()
+
+    result = asyncio.run(singleflight.coalesce("query_result:q", compute, client=client, lookup=lookup))
+    assert result == {"response": "From leader"}
+    compute.assert_not_called()
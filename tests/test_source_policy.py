@@ -0,0 +1,81 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock, patch
+import source_policy
+from source_policy import SourcePolicy, FIRST_SUFFICIENT, ALL_REQUIRED
+from data_retrieval import graph, RetrievalState
+
+
+def _source(result, delay, calls=None):
+    async def fetch():
+        if calls is not None:
+            calls.append(result)
+        await asyncio.sleep(delay)
+        return result
+    return fetch
+
+
+def _sufficient(result):
+    return result is not None
+
+
+def test_first_sufficient_result_wins():
+    """The slower source is cancelled once the faster one can answer on its own."""
+    policy = SourcePolicy(FIRST_SUFFICIENT, hedge=False)
+    start = time.perf_counter()
+    results = asyncio.run(source_policy.execute(
+        policy, {"wikipedia": _source("wiki", 0.01), "tavily": _source("tavily", 1)}, _sufficient))
+    assert results == {"wikipedia": "wiki"}
+    assert time.perf_counter() - start < 0.5
+
+
+def test_insufficient_first_result_waits_for_the_next():
+    policy = SourcePolicy(FIRST_SUFFICIENT, hedge=False)
+    results = asyncio.run(source_policy.execute(
+        policy, {"wikipedia": _source(None, 0.01), "tavily": _source("tavily", 0.05)}, _sufficient))
+    assert results == {"wikipedia": None, "tavily": "tavily"}
+
+
+def test_all_required_waits_for_every_source():
+    policy = SourcePolicy(ALL_REQUIRED, hedge=False)
+    results = asyncio.run(source_policy.execute(
+        policy, {"wikipedia": _source("wiki", 0.01), "tavily": _source("tavily", 0.05)}, _sufficient))
+    assert results == {"wikipedia": "wiki", "tavily": "tavily"}
+
+
+def test_slow_request_is_hedged():
+    """A call slower than the source's tail latency gets a duplicate; the faster copy wins."""
+    for _ in range(source_policy.HEDGE_MIN_SAMPLES):
+        source_policy.tracker("tavily").record(0.01)
+
+    delays = iter([1, 0.01])
+
+    async def fetch():
+        await asyncio.sleep(next(delays))
+        return "tavily"
+
+    start = time.perf_counter()
+    assert asyncio.run(source_policy.hedged("tavily", fetch)) == "tavily"
+    assert time.perf_counter() - start < 0.5
+
+
+@patch("data_retrieval.arefine_response", new_callable=AsyncMock)
+@patch("data_retrieval.clients")
+def test_stable_category_uses_the_first_source(mock_clients, mock_refine):
+    """Location is answered by Wikipedia alone instead of waiting for a slow Tavily."""
+    async def slow_tavily(query):
+        await asyncio.sleep(2)
+
+    mock_clients.awiki_search = AsyncMock(return_value=["TestCo"])
+    mock_clients.awiki_page = AsyncMock(return_value={
+        "title": "TestCo", "url": "https://en.wikipedia.org/wiki/TestCo",
+        "content": "TestCo is a company headquartered in Springfield, United States."})
+    mock_clients.atavily_search.side_effect = slow_tavily
+    mock_refine.return_value = "Springfield"
+
+    start = time.perf_counter()
+    final_state = asyncio.run(graph.ainvoke(RetrievalState(query="TestCo location", query_type="Location")))
+
+    assert time.perf_counter() - start < 1
+    assert final_state["final_result"]["response"] == "Springfield"
+    assert "Tavily" not in final_state["final_result"]["source"]
@@ -0,0 +1,122 @@
+import asyncio
+from unittest.mock import patch, MagicMock, AsyncMock
+import user_query
+from entity_index import CompanyIndex
+from query_classifier import classify_category, preclassify
+
+
+def _index(*names):
+    index = CompanyIndex()
+    for name in names:
+        index.add(name)
+    return index
+
+
+def test_classify_category_rules():
+    """Single-keyword queries map to their category; mixed queries are left to the LLM."""
+    assert classify_category("Where is OpenAI headquartered?") == "Location"
+    assert classify_category("Who is the CEO of Tesla?") == "Key People"
+    assert classify_category("How does Netflix make money?") == "Business Model"
+    assert classify_category("What is Stripe?") == "Company Overview"
+    assert classify_category("Revenue and acquisitions of Google") is None
+
+
+def test_founding_date_is_not_key_people():
+    """There is no founding/history category, so "when was X founded" is left to the LLM; "who founded" is still Key People."""
+    known = _index("Tesla")
+    assert classify_category("When was Tesla founded?") is None
+    assert preclassify("When was Tesla founded?", known) is None
+    assert preclassify("Who founded Tesla?", known) == ("Tesla", "Key People")
+
+def test_preclassify_needs_a_known_company():
+    known = _index("OpenAI", "Goldman Sachs")
+    assert preclassify("Who founded Goldman Sachs?", known) == ("Goldman Sachs", "Key People")
+    assert preclassify("What is OpenAI's revenue?", known) == ("OpenAI", "Revenue")
+    assert preclassify("What is Anthropic's revenue?", known) is None
+
+
+@patch("user_query.company_index", _index("OpenAI"))
+@patch("user_query.clients")
+@patch("user_query.query_chain")
+def test_known_company_skips_llm_and_verification(mock_chain, mock_clients):
+    """A confident local classification of a verified company needs no upstream calls."""
+    result = asyncio.run(user_query.aprocess_user_query("Where is OpenAI headquartered?"))
+
+    assert result["company_name"] == "OpenAI"
+    assert result["query_type"] == "Location"
+    mock_chain.ainvoke.assert_not_called()
+    mock_clients.awiki_search.assert_not_called()
+
+
+@patch("user_query.company_index", CompanyIndex())
+@patch("user_query.redis_client", None)
+@patch("user_query.query_chain")
+def test_llm_classification_is_cached(mock_chain):
+    """The second identical query should reuse the stored classification."""
+    mock_chain.invoke.return_value = MagicMock(content="Company Name: TestCo\nCategory: Revenue")
+
+    assert user_query.classify_query("Tell me TestCo's numbers") == ("TestCo", "Revenue")
+    assert user_query.classify_query("tell me  TestCo's numbers") == ("TestCo", "Revenue")
+    assert mock_chain.invoke.call_count == 1
+
+
+@patch("user_query.company_index", CompanyIndex())
+@patch("user_query.async_redis_client", None)
+@patch("user_query.batch_query_chain")
+@patch("user_query.query_chain")
+def test_batch_classification_uses_one_prompt(mock_chain, mock_batch_chain):
+    """Many queries are classified in one LLM call; duplicates and garbled lines are handled."""
+    mock_batch_chain.ainvoke = AsyncMock(return_value=MagicMock(content=(
+        "1. Company Name: TestCo | Category: Revenue\n"
+        "2. Company Name: OtherCo | Category: Location"
+    )))
+    mock_chain.ainvoke = AsyncMock(return_value=MagicMock(content="Company Name: ThirdCo\nCategory: Products"))
+
+    queries = ["TestCo numbers", "OtherCo place", "testco  numbers", "ThirdCo stuff"]
+    results = asyncio.run(user_query.aclassify_queries(queries))
+
+    assert results == [("TestCo", "Revenue"), ("OtherCo", "Location"), ("TestCo", "Revenue"), ("ThirdCo", "Products")]
+    assert mock_batch_chain.ainvoke.await_count == 1
+    assert mock_chain.ainvoke.await_count == 1
+
+
+@patch("user_query.BATCH_CLASSIFY_CONCURRENCY", 2)
+@patch("user_query.company_index", CompanyIndex())
+@patch("user_query.async_redis_client", None)
+@patch("user_query.batch_query_chain")
+@patch("user_query.query_chain")
+def test_batch_fallback_is_bounded(mock_chain, mock_batch_chain):
+    """When the whole batched prompt fails, single-query fallbacks run at most BATCH_CLASSIFY_CONCURRENCY at a time."""
+    mock_batch_chain.ainvoke = AsyncMock(return_value=MagicMock(content="Sorry, I can't help with that."))
+    active = peak = 0
+
+    async def classify(inputs):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return MagicMock(content="Company Name: TestCo\nCategory: Revenue")
+
+    mock_chain.ainvoke = AsyncMock(side_effect=classify)
+
+    queries = [f"TestCo question {i}" for i in range(10)]
+    results = asyncio.run(user_query.aclassify_queries(queries))
+
+    assert results == [("TestCo", "Revenue")] * 10
+    assert mock_chain.ainvoke.await_count == 10
+    assert peak == 2
+
+@patch("resilience.BACKOFF_BASE", 0.01)
+@patch("user_query.company_index", CompanyIndex())
+@patch("user_query.async_redis_client", None)
+@patch("user_query.query_chain")
+def test_llm_classification_retries_through_resilience(mock_chain):
+    """Classification LLM calls get resilience.call's retry and circuit breaker (the SDK does not retry)."""
+    mock_chain.ainvoke = AsyncMock(side_effect=[
+        ConnectionError("reset"), MagicMock(content="Company Name: TestCo\nCategory: Revenue"),
+    ])
+
+    assert asyncio.run(user_query.aclassify_query("TestCo revenue")) == ("TestCo", "Revenue")
+    assert mock_chain.ainvoke.await_count == 2
+    assert user_query.clients.llm.max_retries == 0
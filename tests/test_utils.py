@@ -43,3 +43,35 @@ def test_refine_response_with_short_text(mock_redis_client, mock_llm):
     result = refine_response("Short text", "Company Overview", "What is the company about?")
     print(f"Expected: Short text, Got: {result}")
     assert result == "Short text"
+
+def test_arefine_streams_tokens_to_listener():
+    """While a client is streaming, the refined answer is sent token by token and still returned whole."""
+    import asyncio
+    import progress
+    from langchain_core.messages import AIMessageChunk
+    from utils import arefine_response
+
+    async def fake_stream(prompt, **kwargs):
+        for token in ["Spring", "field", ", IL"]:
+            yield AIMessageChunk(content=token)
+
+    events = []
+    with patch("utils.async_redis_client", None), patch("utils.llm") as mock_llm:
+        mock_llm.astream = fake_stream
+        with progress.listening(lambda event, data: events.append((event, data["text"]))):
+            result = asyncio.run(arefine_response("TestCo is headquartered in Springfield. " * 5, "Location", "Where is TestCo?"))
+
+    assert result == "Springfield, IL"
+    assert events == [("token", "Spring"), ("token", "field"), ("token", ", IL")]
+    mock_llm.ainvoke.assert_not_called()
+
+
+def test_refine_stage_times_refinement_not_key_building():
+    """Building the cache key (done on every prefetch) must not be recorded as a `refine` stage."""
+    import metrics
+    from utils import refined_response_key
+
+    with patch.object(metrics, "stage") as mock_stage:
+        refined_response_key("Revenue", "TestCo revenue")
+    mock_stage.assert_not_called()
+    assert hasattr(refine_response, "__wrapped__")  # metrics.timed("refine") wraps refine_response
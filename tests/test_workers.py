@@ -0,0 +1,118 @@
+import json
+from unittest.mock import patch
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+import clarification
+from entity_index import CompanyIndex
+import workers
+
+
+def _router_app(down=()):
+    """Router over three fake workers that answer with their ID; workers in `down` refuse connections."""
+    def worker(worker_id):
+        def handle(request):
+            if worker_id in down:
+                raise httpx.ConnectError("connection refused", request=request)
+            body = json.dumps({"worker": worker_id, "query": str(request.url.params)}).encode()
+            # Streamed like a real worker connection, so the router can relay it unread
+            return httpx.Response(200, headers={"Content-Type": "application/json"}, stream=httpx.ByteStream(body))
+        return httpx.AsyncClient(transport=httpx.MockTransport(handle), base_url="http://worker")
+
+    index = CompanyIndex()
+    index.add("OpenAI")
+    index.add("Apple Inc.", aliases=["Apple"])
+    router = workers.Router({w: worker(w) for w in ("0", "1", "2")}, company_index=index)
+    app = FastAPI()
+
+    @app.api_route("/{path:path}", methods=["GET", "POST"])
+    async def proxy(request: Request):
+        return await router.forward(request)
+
+    return TestClient(app), router
+
+
+def test_ring_moves_only_the_new_nodes_share_of_keys():
+    keys = [f"company-{i}" for i in range(2000)]
+    before = workers.HashRing(["0", "1", "2"])
+    after = workers.HashRing(["0", "1", "2", "3"])
+
+    moved = [k for k in keys if before.node_for(k) != after.node_for(k)]
+    assert all(after.node_for(k) == "3" for k in moved)
+    assert 0.15 < len(moved) / len(keys) < 0.35
+    assert before.nodes_for("company-1")[0] == before.node_for("company-1")
+    assert sorted(before.nodes_for("company-1")) == ["0", "1", "2"]
+
+
+def test_requests_about_one_company_reach_one_worker():
+    client, router = _router_app()
+    seen = {
+        client.get("/query/", params={"user_query": query}).json()["worker"]
+        for query in ["Where is OpenAI headquartered?", "Who is the CEO of OpenAI?", "openai products"]
+    }
+    response = client.get("/query/", params={"user_query": "Who founded OpenAI?"})
+
+    assert seen == {router.ring.node_for("openai")}
+    assert response.headers["X-Worker"] in seen
+    assert response.json()["query"] == "user_query=Who+founded+OpenAI%3F"
+
+
+def test_clarification_goes_back_to_the_issuing_worker(monkeypatch):
+    monkeypatch.setattr(clarification, "WORKER_ID", "2")
+    token = clarification._new_token()
+    client, _ = _router_app()
+
+    response = client.get("/clarify/", params={"selection": "Apple Inc.", "token": token})
+    assert workers.clarification_shard(token) == "2"
+    assert response.json()["worker"] == "2"
+
+
+def test_failover_and_no_worker_left():
+    owner = workers.HashRing(["0", "1", "2"]).node_for("openai")
+    client, router = _router_app(down={owner})
+    response = client.get("/query/", params={"user_query": "Where is OpenAI headquartered?"})
+    assert response.status_code == 200
+    assert response.json()["worker"] == router.ring.nodes_for("openai")[1]
+
+    client, _ = _router_app(down={"0", "1", "2"})
+    response = client.get("/query/", params={"user_query": "Where is OpenAI headquartered?"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_selection_only_clarification_finds_the_worker_that_holds_it():
+    """Without a token, workers that do not know the ambiguity pass the selection on."""
+    holder = "1"
+
+    def worker(worker_id):
+        def handle(request):
+            body = json.dumps({"worker": worker_id}).encode()
+            return httpx.Response(200 if worker_id == holder else 400, stream=httpx.ByteStream(body))
+        return httpx.AsyncClient(transport=httpx.MockTransport(handle), base_url="http://worker")
+
+    router = workers.Router({w: worker(w) for w in ("0", "1", "2")}, company_index=CompanyIndex())
+    app = FastAPI()
+
+    @app.api_route("/{path:path}", methods=["GET"])
+    async def proxy(request: Request):
+        return await router.forward(request)
+
+    client = TestClient(app)
+    response = client.get("/clarify/", params={"selection": "Delta Air Lines"})
+    assert response.status_code == 200
+    assert response.json()["worker"] == holder
+
+    # With a token the issuing worker decides, and its rejection is final
+    rejected = client.get("/clarify/", params={"selection": "Delta Air Lines", "token": "0.abc"})
+    assert rejected.status_code == 400
+    assert rejected.json()["worker"] == "0"
+
+
+def test_workers_trust_the_routers_forwarded_for(tmp_path, monkeypatch):
+    """Behind the router, per-client rate limits must see callers, not the router's socket."""
+    monkeypatch.delenv("TRUST_FORWARDED_FOR", raising=False)
+    with patch("workers.subprocess.Popen") as mock_popen:
+        workers.Worker("1", str(tmp_path / "worker-1.sock")).start()
+    env = mock_popen.call_args.kwargs["env"]
+    assert env["TRUST_FORWARDED_FOR"] == "true"
+    assert env["WORKER_ID"] == "1"
@@ -1,16 +1,22 @@
-from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
 from langchain_core.runnables import RunnableSequence
 import os
-import json
-import wikipedia
+import re
+import asyncio
 import logging
-from redis_config import redis_client
-
-# Store for Ambiguity Handling 
-clarification_store = {}
-
-llm = ChatOpenAI(model="gpt-3.5-turbo", openai_api_key=os.getenv("OPENAI_API_KEY"))
+from redis.exceptions import RedisError
+from redis_config import redis_client, async_redis_client
+import admission
+import cache
+import clients
+import metrics
+import progress
+import resilience
+import clarification
+from query_classifier import normalize_query, preclassify
+from entity_index import company_index
+
+llm = clients.llm
 
 # prompt template
 query_template = PromptTemplate(
@@ -43,36 +49,269 @@ query_template = PromptTemplate(
 
 query_chain = RunnableSequence(query_template | llm)
 
-def verify_company_name(company_name):
-    """Verifies if a company name is ambiguous or non-existent using Wikipedia and LLM."""
+# Classifies many queries in one LLM round trip for the batch endpoint
+batch_query_template = PromptTemplate(
+    input_variables=["queries"],
+    template="""
+    For each numbered query below, extract the company name and classify the query into one of these categories:
+    Company Overview, Business Model, Location, Key People, Products, Investments, Acquisitions, Recent News, Customers, Revenue
+
+    If the company is highly recognizable (e.g., Tesla, Google, Microsoft), do not return "ambiguous."
+
+    Queries:
+    {queries}
+
+    Respond with exactly one line per query, in the same order, strictly in this format:
+    [number]. Company Name: [company] | Category: [category]
+    """
+)
+
+batch_query_chain = RunnableSequence(batch_query_template | llm)
+
+BATCH_CLASSIFY_CHUNK = int(os.getenv("BATCH_CLASSIFY_CHUNK", 20))
+BATCH_CLASSIFY_CONCURRENCY = int(os.getenv("BATCH_CLASSIFY_CONCURRENCY", 8))
+BATCH_VERIFY_CONCURRENCY = int(os.getenv("BATCH_VERIFY_CONCURRENCY", 8))
+_BATCH_LINE_RE = re.compile(r"^\s*\[?(\d+)\]?[.)]?\s*Company Name:\s*(.+?)\s*\|\s*Category:\s*(.+?)\s*$")
+
+# Classification of a given query text never changes, so keep it for a week
+CLASSIFICATION_TTL = int(os.getenv("CLASSIFICATION_TTL", 7 * 86400))
+
+def classification_key(user_query):
+    return f"classification:{normalize_query(user_query)}"
+
+def _local_classification(user_query):
+    """Keyword/known-company pre-classifier; returns (company_name, query_type) or None."""
+    local = preclassify(user_query, company_index)
+    if local is not None:
+        logging.info(f" Pre-classified locally: {local}")
+        return local
+    return None
+
+@metrics.timed("classification")
+def classify_query(user_query):
+    """Returns (company_name, query_type) or an error dict, calling the LLM only when nothing local knows."""
+    local = _local_classification(user_query)
+    if local is not None:
+        return local
+
+    key = classification_key(user_query)
     try:
-        search_results = wikipedia.search(company_name)
+        cached = cache.get(redis_client, key)
+        if cached:
+            return cached["company_name"], cached["query_type"]
+    except RedisError as e:
+        logging.warning(f"⚠️ Redis error when reading classification: {e}")
 
-        if not search_results:
-            return {"error": f"Company not found: '{company_name}' does not exist."}
+    response = query_chain.invoke({"query": user_query})
+    metrics.record_tokens("classification", response)
+    parsed = _parse_classification(response)
+    if isinstance(parsed, tuple):
+        try:
+            cache.set(
+                redis_client, key, {"company_name": parsed[0], "query_type": parsed[1]}, CLASSIFICATION_TTL,
+                cache.tags_for(*parsed),
+            )
+        except RedisError as e:
+            logging.warning(f"! Redis caching failed for classification: {e}")
+    return parsed
+
+@metrics.timed("classification")
+async def aclassify_query(user_query):
+    """Async variant of classify_query."""
+    local = _local_classification(user_query)
+    if local is not None:
+        return local
+
+    async def compute():
+        async with admission.admit():
+            response = await resilience.call("llm", query_chain.ainvoke, {"query": user_query})
+        metrics.record_tokens("classification", response)
+        parsed = _parse_classification(response)
+        return {"company_name": parsed[0], "query_type": parsed[1]} if isinstance(parsed, tuple) else parsed
+
+    result = await cache.aget_or_compute(
+        async_redis_client,
+        classification_key(user_query),
+        compute,
+        ttl=CLASSIFICATION_TTL,
+        cacheable=lambda value: "error" not in value,
+        tags=lambda value: cache.tags_for(value["company_name"], value["query_type"]),
+    )
+    if "error" in result:
+        return result
+    return result["company_name"], result["query_type"]
+
+@metrics.timed("classification.batch")
+async def _aclassify_chunk(user_queries):
+    """One batched LLM call; returns {position: (company_name, query_type)} for the lines it could parse."""
+    numbered = "\n".join(f"{i}. {query}" for i, query in enumerate(user_queries, 1))
+    async with admission.admit():
+        response = await resilience.call("llm", batch_query_chain.ainvoke, {"queries": numbered})
+    metrics.record_tokens("classification.batch", response)
+
+    parsed = {}
+    for line in getattr(response, "content", "").splitlines():
+        match = _BATCH_LINE_RE.match(line)
+        if match and 1 <= int(match.group(1)) <= len(user_queries):
+            parsed[int(match.group(1)) - 1] = (match.group(2), match.group(3))
+    return parsed
+
+async def aclassify_queries(user_queries):
+    """Classifies many queries at once.
+
+    Queries the pre-classifier or classification cache can answer skip the LLM; the
+    rest are deduplicated and sent in chunks of BATCH_CLASSIFY_CHUNK per prompt.
+    Returns a list aligned with `user_queries` of (company_name, query_type) tuples or error dicts.
+    """
+    results = [None] * len(user_queries)
+    pending = {}  # classification key -> indexes of queries with that text
 
-        normalized_results = [res.lower() for res in search_results]
-        normalized_company_name = company_name.lower()
+    for i, user_query in enumerate(user_queries):
+        local = _local_classification(user_query)
+        if local is not None:
+            results[i] = local
+        else:
+            pending.setdefault(classification_key(user_query), []).append(i)
 
-        if normalized_company_name in normalized_results:
-            return {"verified": company_name}
-        if company_name.lower() in search_results[0].lower():
-            return {"verified": search_results[0]}
-        if len(search_results) > 1:
-            return {
-                "ambiguous": True,
-                "message": f"Multiple companies found for '{company_name}'. Please clarify.",
-                "options": search_results[:5], 
-            }
+    try:
+        cached_classifications = await cache.aget_many(async_redis_client, list(pending))
+    except RedisError as e:
+        logging.warning(f"⚠️ Redis error when reading classifications: {e}")
+        cached_classifications = [None] * len(pending)
+
+    unresolved = []
+    for (key, indexes), cached in zip(pending.items(), cached_classifications):
+        if cached:
+            for i in indexes:
+                results[i] = (cached["company_name"], cached["query_type"])
+        else:
+            unresolved.append(key)
+
+    chunks = [unresolved[i:i + BATCH_CLASSIFY_CHUNK] for i in range(0, len(unresolved), BATCH_CLASSIFY_CHUNK)]
+    chunk_results = await asyncio.gather(
+        *[_aclassify_chunk([user_queries[pending[key][0]] for key in chunk]) for chunk in chunks],
+        return_exceptions=True,
+    )
+
+    fallbacks = []
+    writes = []
+    for chunk, parsed in zip(chunks, chunk_results):
+        if isinstance(parsed, Exception):
+            logging.warning(f"⚠️ Batched classification failed, classifying individually: {parsed}")
+            parsed = {}
+        for position, key in enumerate(chunk):
+            if position not in parsed:
+                fallbacks.append(key)
+                continue
+            company_name, query_type = parsed[position]
+            writes.append((
+                key, {"company_name": company_name, "query_type": query_type}, CLASSIFICATION_TTL,
+                cache.tags_for(company_name, query_type),
+            ))
+            for i in pending[key]:
+                results[i] = (company_name, query_type)
+    try:
+        await cache.aset_many(async_redis_client, writes)
+    except RedisError as e:
+        logging.warning(f"! Redis caching failed for {len(writes)} classifications: {e}")
+
+    # Lines the batched prompt dropped or garbled go through the single-query path,
+    # at most BATCH_CLASSIFY_CONCURRENCY at a time so a failed chunk doesn't fan out
+    semaphore = asyncio.Semaphore(BATCH_CLASSIFY_CONCURRENCY)
+
+    async def classify(user_query):
+        async with semaphore:
+            return await _aclassify_or_shed(user_query)
+
+    individual = await asyncio.gather(*[classify(user_queries[pending[key][0]]) for key in fallbacks])
+    for key, classification in zip(fallbacks, individual):
+        for i in pending[key]:
+            results[i] = classification
+
+    return results
+
+def _overloaded_result(error):
+    return {"error": "Server overloaded. Please try again later.", "retry_after": error.retry_after}
+
+async def _aclassify_or_shed(user_query):
+    """aclassify_query for one batch item; a shed item gets an error instead of failing the batch."""
+    try:
+        return await aclassify_query(user_query)
+    except admission.Overloaded as e:
+        return _overloaded_result(e)
+
+def _resolve_search_results(company_name, search_results):
+    """Decides verified/ambiguous/not-found from Wikipedia search results; None means ask the LLM."""
+    if not search_results:
+        return {"error": f"Company not found: '{company_name}' does not exist."}
+
+    normalized_results = [res.lower() for res in search_results]
+    normalized_company_name = company_name.lower()
+
+    if normalized_company_name in normalized_results:
+        return {"verified": company_name}
+    if company_name.lower() in search_results[0].lower():
+        return {"verified": search_results[0]}
+    if len(search_results) > 1:
+        return {
+            "ambiguous": True,
+            "message": f"Multiple companies found for '{company_name}'. Please clarify.",
+            "options": search_results[:5], 
+        }
+    return None
+
+def _learn_verification(company_name, result, search_results):
+    """Records a network verification in the company index so repeats stay local."""
+    wiki_title = None
+    if "verified" in result:
+        wiki_title = next((r for r in search_results or () if r.lower() == result["verified"].lower()), None)
+    return company_index.learn(company_name, result, wiki_title=wiki_title)
+
+@metrics.timed("verification")
+def verify_company_name(company_name):
+    """Verifies if a company name is ambiguous or non-existent using the local index, Wikipedia and LLM."""
+    known = company_index.resolve(company_name)
+    if known is not None:
+        return known
+
+    try:
+        search_results = clients.wiki_search(company_name)
+        result = _resolve_search_results(company_name, search_results)
+        if result is None:
+            result = check_company_with_llm(company_name)
 
-        return check_company_with_llm(company_name)
+        if _learn_verification(company_name, result, search_results):
+            company_index.save()
+        return result
 
     except Exception as e:
         return {"error": f"Failed to verify company: {str(e)}"}
 
-def check_company_with_llm(company_name):
-    """Uses LLM to determine if a company is real or ambiguous."""
-    prompt = f"""
+@metrics.timed("verification")
+async def averify_company_name(company_name):
+    """Async variant of verify_company_name."""
+    known = company_index.resolve(company_name)
+    if known is not None:
+        return known
+
+    try:
+        async with admission.admit():
+            search_results = await resilience.call("wikipedia", clients.awiki_search, company_name)
+            result = _resolve_search_results(company_name, search_results)
+            if result is None:
+                result = await acheck_company_with_llm(company_name)
+
+        if _learn_verification(company_name, result, search_results):
+            await asyncio.to_thread(company_index.save)
+        return result
+
+    except admission.Overloaded:
+        raise
+    except Exception as e:
+        return {"error": f"Failed to verify company: {str(e)}"}
+
+def _company_check_prompt(company_name):
+    return f"""
     You are an expert business analyst. Determine if '{company_name}' refers to a well-known company or if it is ambiguous.
 
     Respond in one of the following formats:
@@ -83,7 +322,7 @@ def check_company_with_llm(company_name):
     Return only the classification and the company name(s).
     """
 
-    response = llm.invoke(prompt)
+def _parse_company_check(company_name, response):
     if response and hasattr(response, "content"):
         content = response.content.strip()
 
@@ -100,10 +339,20 @@ def check_company_with_llm(company_name):
         return {"error": f"Company not found: '{company_name}' does not exist."}
     return {"error": "Failed to verify company via LLM."}
 
-def process_user_query(user_query):
-    """Extracts company name and query type from user input."""
-    response = query_chain.invoke({"query": user_query})
-
+def check_company_with_llm(company_name):
+    """Uses LLM to determine if a company is real or ambiguous."""
+    response = llm.invoke(_company_check_prompt(company_name))
+    metrics.record_tokens("verification", response)
+    return _parse_company_check(company_name, response)
+
+async def acheck_company_with_llm(company_name):
+    """Async variant of check_company_with_llm."""
+    response = await resilience.call("llm", llm.ainvoke, _company_check_prompt(company_name))
+    metrics.record_tokens("verification", response)
+    return _parse_company_check(company_name, response)
+
+def _parse_classification(response):
+    """Parses the classification chain output into (company_name, query_type) or an error dict."""
     if not hasattr(response, "content"):
         return {"error": "Invalid LLM response format.", "raw_response": str(response)}
 
@@ -115,27 +364,20 @@ def process_user_query(user_query):
 
     company_name = content[0].replace("Company Name:", "").strip()
     query_type = content[1].replace("Category:", "").strip()
+    return company_name, query_type
 
-    verification_result = verify_company_name(company_name)
-
-    if "ambiguous" in verification_result:
-        logging.warning(f"! Query is ambiguous: {verification_result['options']}")
-
-        #  Store in Redis
-        if redis_client:
-            redis_client.setex(f"ambiguity:{user_query}", 600, json.dumps(verification_result["options"])) 
-
-        clarification_store[user_query] = verification_result["options"]
-
-        return {
-            "message": "Your query is ambiguous.",
-            "options": verification_result["options"],
-            "next_step": "Please select one of the options using the /clarify/ endpoint."
-        }
-
-    if "error" in verification_result:
-        return verification_result  # Return error if company is not found
+def _ambiguous_result(verification_result, token):
+    logging.warning(f"! Query is ambiguous: {verification_result['options']}")
+    return {
+        "ambiguous": True,
+        "message": "Your query is ambiguous.",
+        "options": verification_result["options"],
+        "clarification_token": token,
+        "next_step": "Please select one of the options using the /clarify/ endpoint."
+    }
 
+def build_query_data(user_query, company_name, query_type):
+    """Query data for the retrieval stage: the structured query for `company_name` in `query_type`."""
     query_map = {
         "Company Overview": f"General information about {company_name}",
         "Business Model": f"How does {company_name} make money?",
@@ -157,3 +399,70 @@ def process_user_query(user_query):
         "query_type": query_type,
         "structured_query": structured_query
     }
+
+def process_user_query(user_query):
+    """Extracts company name and query type from user input."""
+    parsed = classify_query(user_query)
+    if isinstance(parsed, dict):
+        return parsed
+    company_name, query_type = parsed
+
+    verification_result = verify_company_name(company_name)
+
+    if "ambiguous" in verification_result:
+        token = clarification.register(user_query, verification_result["options"], query_type)
+        return _ambiguous_result(verification_result, token)
+
+    if "error" in verification_result:
+        return verification_result  # Return error if company is not found
+
+    # Use the canonical entity so every phrasing of a company shares one cache entry
+    return build_query_data(user_query, verification_result["verified"], query_type)
+
+async def _afinish_query(user_query, query_type, verification_result):
+    """Turns a verification result into query data, an ambiguity prompt or an error."""
+    if "ambiguous" in verification_result:
+        token = await clarification.aregister(user_query, verification_result["options"], query_type)
+        return _ambiguous_result(verification_result, token)
+
+    if "error" in verification_result:
+        return verification_result
+
+    return build_query_data(user_query, verification_result["verified"], query_type)
+
+async def aprocess_user_query(user_query):
+    """Async variant of process_user_query used by the FastAPI request path."""
+    parsed = await aclassify_query(user_query)
+    if isinstance(parsed, dict):
+        return parsed
+    company_name, query_type = parsed
+    progress.emit("classification", {"company_name": company_name, "query_type": query_type})
+
+    verification_result = await averify_company_name(company_name)
+    progress.emit("verification", verification_result)
+    return await _afinish_query(user_query, query_type, verification_result)
+
+async def aprocess_user_queries(user_queries):
+    """Batch variant of aprocess_user_query: one batched classification, one verification per distinct company."""
+    classifications = await aclassify_queries(user_queries)
+
+    semaphore = asyncio.Semaphore(BATCH_VERIFY_CONCURRENCY)
+
+    async def verify(company_name):
+        async with semaphore:
+            try:
+                return await averify_company_name(company_name)
+            except admission.Overloaded as e:
+                return _overloaded_result(e)
+
+    company_names = sorted({c[0] for c in classifications if isinstance(c, tuple)})
+    verified = dict(zip(company_names, await asyncio.gather(*[verify(name) for name in company_names])))
+
+    results = []
+    for user_query, classification in zip(user_queries, classifications):
+        if isinstance(classification, dict):
+            results.append(classification)
+            continue
+        company_name, query_type = classification
+        results.append(await _afinish_query(user_query, query_type, verified[company_name]))
+    return results
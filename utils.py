@@ -1,79 +1,120 @@
-from redis_config import redis_client  
+from redis_config import redis_client, async_redis_client
 import json
+import cache
+import metrics
+import resilience
+import prompts
+import progress
 import logging
-from langchain_openai import ChatOpenAI
-import os
+import clients
 from redis.exceptions import RedisError  
 
-openai_api_key = os.getenv("OPENAI_API_KEY")
-llm = ChatOpenAI(model="gpt-3.5-turbo", openai_api_key=openai_api_key)
+llm = clients.llm
 
-def refine_response(raw_text, query_type, user_query):
+def _refined_text(query_type, response):
+    """Answer text of a refinement response; structured answers go through query_formatting."""
+    metrics.record_tokens("refine", response)
+    content = response.content.strip()
+    if prompts.is_structured(query_type):
+        data = prompts.parse_structured(query_type, content)
+        if data is not None:
+            return query_formatting[query_type](data)
+    return content
+
+def refined_response_key(query_type, user_query):
+    return f"refined_response:{query_type}:{user_query.lower()}"
+
+@metrics.timed("refine")
+def refine_response(raw_text, query_type, user_query, company_name=None):
     """Uses OpenAI LLM to refine and extract the most relevant response with Redis caching."""
 
     logging.info(f"refine_response called with query_type={query_type}, user_query={user_query}")
-    logging.debug(f"Raw Text Preview: {raw_text[:250]}")  
+    logging.debug("Raw Text Preview: %s", raw_text[:250])
 
     if len(raw_text) < 100:
         logging.info("⚠️ Skipping LLM call: Raw text is too short.")
         return raw_text  
 
-    cache_key = f"refined_response:{query_type}:{user_query.lower()}"
-    cached_response = None
+    cache_key = refined_response_key(query_type, user_query)
 
-    if redis_client:
-        try:
-            cached_response = redis_client.get(cache_key)
-            if cached_response:
-                cached_response = cached_response.decode("utf-8") 
-                logging.info(f" Cache hit! Returning cached refined response for: {user_query}")
-                return cached_response
-        except RedisError as e:
-            logging.warning(f"⚠️ Redis error when retrieving cache: {str(e)}")
-
-    prompt = f"""
-    Extract only the **direct answer** to the following question from the provided text.
-    Follow the specific extraction rules based on the query type:
-
-    - **Company Overview**: Return a **concise summary** of the company's main industry, products, and key facts in **2-3 sentences max**.
-    - **Business Model**: Return only the **key revenue sources** (e.g., "subscription services, advertising, cloud computing").
-    - **Location**: Return only the **city and state** (or country if no state is available).
-    - **Key People**: Return only the **names and roles** of key executives (e.g., "CEO: John Doe, CFO: Jane Smith").
-    - **Products**: Return only the **main products or services** offered by the company (e.g., "Smartphones, cloud computing, and digital advertising").
-    - **Investments**: Return only the **most recent investment amount, investors, and date**.
-    - **Acquisitions**: Return only the **most recent acquisitions** with company names and date.
-    - **Recent News**: Return **only the latest news headline and date**.
-    - **Customers**: Return only the **types of customers** (e.g., businesses, individuals, industries, or key clients).
-    - **Revenue**: Return only the **latest reported revenue amount**.
-    
-    **Query Type:** {query_type}
-    **Question:** {user_query}
-    **Text:** {raw_text}
-    
-    **Answer:** (Only return the exact required information)
-    """
-
-    refined_response = llm.invoke(prompt)
+    try:
+        cached_response = cache.get(redis_client, cache_key)
+        if cached_response:
+            logging.info(f" Cache hit! Returning cached refined response for: {user_query}")
+            return cached_response
+    except RedisError as e:
+        logging.warning(f"⚠️ Redis error when retrieving cache: {str(e)}")
+
+    refined_response = llm.invoke(
+        prompts.build_refine_prompt(raw_text, query_type, user_query), **prompts.llm_options(query_type)
+    )
 
     if refined_response and hasattr(refined_response, "content"):  
-        refined_text = refined_response.content.strip()
+        refined_text = _refined_text(query_type, refined_response)
 
         # Store in Redis for Future Queries
-        if redis_client:
-            try:
-                redis_client.setex(cache_key, 3600, refined_text) 
-                logging.info(f" Cached refined response for {user_query} under key: {cache_key}")
-            except RedisError as e:
-                logging.warning(f"! Redis caching failed: {str(e)}")
+        try:
+            cache.set(redis_client, cache_key, refined_text, cache.ttl_for(query_type), cache.tags_for(company_name, query_type))
+            logging.info(f" Cached refined response for {user_query} under key: {cache_key}")
+        except RedisError as e:
+            logging.warning(f"! Redis caching failed: {str(e)}")
 
         return refined_text  
 
     logging.warning("⚠️ LLM failed to generate refined response, returning raw text.")
     return raw_text  # Fallback if LLM fails
 
+async def _astream_tokens(prompt, query_type):
+    """Streams the refinement to the progress listener token by token; returns the whole message."""
+    message = None
+    async for chunk in llm.astream(prompt, stream_usage=True, **prompts.llm_options(query_type)):
+        if chunk.content:
+            progress.emit("token", {"text": chunk.content})
+        message = chunk if message is None else message + chunk
+    return message
+
+@metrics.timed("refine")
+async def arefine_response(raw_text, query_type, user_query, company_name=None):
+    """Async variant of refine_response; reads through the two-tier cache with stale-while-revalidate."""
+
+    logging.info(f"arefine_response called with query_type={query_type}, user_query={user_query}")
+
+    if len(raw_text) < 100:
+        logging.info("⚠️ Skipping LLM call: Raw text is too short.")
+        return raw_text
+
+    async def compute():
+        prompt = prompts.build_refine_prompt(raw_text, query_type, user_query)
+        try:
+            if progress.is_listening() and not prompts.is_structured(query_type):
+                # One attempt only: a retry would resend tokens the client already has
+                refined_response = await resilience.call("llm", _astream_tokens, prompt, query_type, attempts=1)
+            else:
+                refined_response = await resilience.call("llm", llm.ainvoke, prompt, **prompts.llm_options(query_type))
+        except Exception as e:
+            logging.warning(f"⚠️ Refinement LLM call failed: {e!r}")
+            return None
+        if refined_response and hasattr(refined_response, "content"):
+            return _refined_text(query_type, refined_response)
+        return None
+
+    refined_text = await cache.aget_or_compute(
+        async_redis_client,
+        refined_response_key(query_type, user_query),
+        compute,
+        ttl=cache.ttl_for(query_type),
+        tags=cache.tags_for(company_name, query_type),
+    )
+    if refined_text is not None:
+        return refined_text
+
+    logging.warning("⚠️ LLM failed to generate refined response, returning raw text.")
+    return raw_text
+
 query_formatting = {
     "Acquisitions": lambda data: "\n".join([f"{company} was acquired on {date}" for company, date in data]),
     "Customers": lambda data: ", ".join(data.get("customer_types", ["Businesses", "Individuals", "Organizations"])),
     "Investments": lambda data: "\n".join([f"{firm} invested ${amount} million on {date}" for firm, amount, date in data]),
-    "Revenue": lambda data: f"${data['amount']}B" if "B" in data['amount'] else f"${data['amount']}M" if "M" in data['amount'] else f"${data['amount']}"
+    # The amount already carries its unit (e.g. "14.2B"), so only the currency sign is added
+    "Revenue": lambda data: f"${data['amount'].lstrip('$')}"
 }
\ No newline at end of file
@@ -0,0 +1,278 @@
+"""Multi-process mode: a routing front end in front of N single-process API workers.
+
+Each worker is an ordinary `uvicorn main:app` on its own UNIX socket with its own
+in-process caches. The router sends every request about a company to the same
+worker (consistent hashing on the company name), so those caches stay hot, and
+fails over to the next worker on the ring while one is restarting. Shared state
+(the answer cache, clarifications, cross-replica single-flight) lives in Redis.
+
+    python -m workers --workers 4 --port 8000
+"""
+import argparse
+import asyncio
+import bisect
+import hashlib
+import itertools
+import logging
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+import logging_config
+from entity_index import CompanyIndex, ENTITY_INDEX_PATH, normalize_name
+from query_classifier import normalize_query
+
+WORKERS = int(os.getenv("WORKERS", 1))
+# Points per worker on the hash ring; more points spread companies more evenly
+WORKER_VNODES = int(os.getenv("WORKER_VNODES", 100))
+WORKER_SOCKET_DIR = os.getenv("WORKER_SOCKET_DIR")
+# How long a stopping worker (and the router) may take to finish in-flight requests
+WORKER_DRAIN_TIMEOUT = int(os.getenv("WORKER_DRAIN_TIMEOUT", 30))
+WORKER_START_TIMEOUT = float(os.getenv("WORKER_START_TIMEOUT", 60))
+WORKER_RESTART_DELAY = float(os.getenv("WORKER_RESTART_DELAY", 1))
+# The router re-reads the company index the workers keep on disk this often
+WORKER_INDEX_RELOAD = float(os.getenv("WORKER_INDEX_RELOAD", 60))
+
+# Hop-by-hop headers are per connection and must not be forwarded
+HOP_HEADERS = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer", "transfer-encoding", "upgrade", "host", "content-length"}
+# Set again by the router's own server; the worker's Content-Length stays valid since bodies are relayed as-is
+RESPONSE_SKIP_HEADERS = (HOP_HEADERS - {"content-length"}) | {"date", "server"}
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+class HashRing:
+    """Consistent hash ring: adding or removing a node only moves the keys next to its points."""
+
+    def __init__(self, nodes, vnodes=WORKER_VNODES):
+        self.nodes = list(nodes)
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [node for _, node in points]
+
+    def nodes_for(self, key):
+        """Every node in ring order starting with `key`'s owner; the rest are its failover order."""
+        start = bisect.bisect(self._hashes, _hash(key))
+        seen = []
+        for i in range(len(self._owners)):
+            node = self._owners[(start + i) % len(self._owners)]
+            if node not in seen:
+                seen.append(node)
+                if len(seen) == len(self.nodes):
+                    break
+        return seen
+
+    def node_for(self, key):
+        return self.nodes_for(key)[0]
+
+def clarification_shard(token):
+    """Worker ID a clarification token was issued by (see clarification.register), or None."""
+    worker_id, sep, _ = (token or "").partition(".")
+    return worker_id if sep and worker_id.isdigit() else None
+
+def routing_key(path, params, company_index):
+    """The company a request is about, or None for requests that are not about one company."""
+    if path == "/clarify/":
+        return normalize_name(params["selection"]) if params.get("selection") else None
+    user_query = params.get("user_query")
+    if not user_query:
+        return None
+    # Unknown companies fall back to the query text, so repeats still hit the same worker
+    company_name = company_index.find_in(user_query)
+    return normalize_name(company_name) if company_name else normalize_query(user_query)
+
+class Router:
+    """Forwards requests to workers by company, failing over around the ring."""
+
+    def __init__(self, clients, company_index=None, vnodes=WORKER_VNODES):
+        self.clients = clients  # worker ID -> httpx.AsyncClient
+        self.ring = HashRing(clients, vnodes)
+        self.company_index = company_index or CompanyIndex()
+        self._round_robin = itertools.cycle(list(clients))
+
+    def candidates(self, request):
+        """Worker IDs to try for `request`, preferred first."""
+        params = request.query_params
+        shard = clarification_shard(params.get("token")) if request.url.path == "/clarify/" else None
+        key = routing_key(request.url.path, params, self.company_index)
+        if key is None:
+            first = next(self._round_robin)
+            ring = [first, *(w for w in self.ring.nodes if w != first)]
+        else:
+            ring = self.ring.nodes_for(key)
+        if shard in self.clients:
+            ring = [shard, *(w for w in ring if w != shard)]
+        return ring
+
+    @staticmethod
+    def _ask_next_on_rejection(request):
+        """A selection-only /clarify/ does not say which worker holds the ambiguity.
+
+        With Redis every worker can resolve it; without, each worker only knows its own,
+        so a worker that rejects the selection (400) passes it on to the next one.
+        """
+        return request.url.path == "/clarify/" and not request.query_params.get("token")
+
+    async def forward(self, request):
+        body = await request.body()
+        headers = [(k, v) for k, v in request.headers.raw if k.decode("latin-1").lower() not in HOP_HEADERS | {"x-forwarded-for"}]
+        # Workers see the router's socket, not the caller; pass the caller on for per-client rate limits
+        forwarded = [request.headers["x-forwarded-for"]] if "x-forwarded-for" in request.headers else []
+        if request.client:
+            forwarded.append(request.client.host)
+        if forwarded:
+            headers.append((b"x-forwarded-for", ", ".join(forwarded).encode("latin-1")))
+        candidates = self.candidates(request)
+        for position, worker_id in enumerate(candidates):
+            client = self.clients[worker_id]
+            upstream_request = client.build_request(
+                request.method, request.url.path, params=request.url.query, headers=headers, content=body
+            )
+            try:
+                upstream = await client.send(upstream_request, stream=True)
+            except (httpx.ConnectError, httpx.RemoteProtocolError) as e:
+                logging.warning(f"⚠️ Worker {worker_id} unavailable, trying the next one: {e!r}")
+                continue
+            if upstream.status_code == 400 and position + 1 < len(candidates) and self._ask_next_on_rejection(request):
+                await upstream.aclose()
+                continue
+            response_headers = {k: v for k, v in upstream.headers.items() if k.lower() not in RESPONSE_SKIP_HEADERS}
+            response_headers["X-Worker"] = worker_id
+            return StreamingResponse(
+                upstream.aiter_raw(), status_code=upstream.status_code, headers=response_headers,
+                background=BackgroundTask(upstream.aclose),
+            )
+        return JSONResponse({"detail": "No worker available. Please try again later."}, status_code=503, headers={"Retry-After": "1"})
+
+    def reload_index(self, path=ENTITY_INDEX_PATH):
+        if path and os.path.exists(path):
+            self.company_index = CompanyIndex.load(path)
+
+    async def aclose(self):
+        for client in self.clients.values():
+            await client.aclose()
+
+class Worker:
+    """One `uvicorn main:app` process serving on a UNIX socket."""
+
+    def __init__(self, worker_id, socket_path):
+        self.worker_id = worker_id
+        self.socket_path = socket_path
+        self.process = None
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        # Only the router reaches a worker's socket, so the X-Forwarded-For it sets can be
+        # trusted; otherwise every client would share the router's identity in rate limits
+        env = {"TRUST_FORWARDED_FOR": "true", **os.environ, "WORKER_ID": self.worker_id}
+        self.process = subprocess.Popen([
+            sys.executable, "-m", "uvicorn", "main:app", "--uds", self.socket_path,
+            "--timeout-graceful-shutdown", str(WORKER_DRAIN_TIMEOUT),
+        ], env=env, start_new_session=True)  # Ctrl+C reaches only the router, which stops workers in order
+        logging.info(f" Started worker {self.worker_id} (pid {self.process.pid}) on {self.socket_path}")
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    async def wait_ready(self, timeout=WORKER_START_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while not os.path.exists(self.socket_path):
+            if not self.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError(f"Worker {self.worker_id} did not start")
+            await asyncio.sleep(0.1)
+
+    def stop(self):
+        """Asks the worker to stop accepting requests and finish the ones in flight."""
+        if self.is_alive():
+            self.process.send_signal(signal.SIGTERM)
+
+    async def wait_stopped(self, timeout):
+        deadline = time.monotonic() + timeout
+        while self.is_alive() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self.is_alive():
+            logging.warning(f"⚠️ Worker {self.worker_id} did not drain within {timeout}s, killing it")
+            self.process.kill()
+        _mark_process_dead(self.process)
+
+def _mark_process_dead(process):
+    """Drops a dead worker's live gauges from the shared Prometheus directory."""
+    if process is not None and os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(process.pid)
+
+async def supervise(workers):
+    """Restarts workers that exit on their own."""
+    while True:
+        await asyncio.sleep(WORKER_RESTART_DELAY)
+        for worker in workers:
+            if not worker.is_alive():
+                logging.error(f"Worker {worker.worker_id} exited with {worker.process.returncode}, restarting it")
+                _mark_process_dead(worker.process)
+                worker.start()
+
+async def reload_index_periodically(router):
+    while True:
+        await asyncio.sleep(WORKER_INDEX_RELOAD)
+        router.reload_index()
+
+def create_app(count=WORKERS, socket_dir=WORKER_SOCKET_DIR):
+    """The router app; its lifespan starts the workers and, on shutdown, drains and stops them."""
+    socket_dir = socket_dir or tempfile.mkdtemp(prefix="company-info-workers-")
+    # Workers share one metrics directory so any of them can serve an aggregated /metrics
+    os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="company-info-metrics-"))
+    workers = [Worker(str(i), os.path.join(socket_dir, f"worker-{i}.sock")) for i in range(count)]
+    router = Router({
+        w.worker_id: httpx.AsyncClient(transport=httpx.AsyncHTTPTransport(uds=w.socket_path), base_url="http://worker", timeout=None)
+        for w in workers
+    })
+    router.reload_index()
+
+    @asynccontextmanager
+    async def lifespan(app):
+        for worker in workers:
+            worker.start()
+        await asyncio.gather(*(worker.wait_ready() for worker in workers))
+        tasks = [asyncio.create_task(supervise(workers)), asyncio.create_task(reload_index_periodically(router))]
+        logging.info(f" Routing across {count} workers")
+        yield
+        # uvicorn has already stopped accepting and drained the router's in-flight requests
+        for task in tasks:
+            task.cancel()
+        for worker in workers:
+            worker.stop()
+        await asyncio.gather(*(worker.wait_stopped(WORKER_DRAIN_TIMEOUT) for worker in workers))
+        await router.aclose()
+
+    app = FastAPI(lifespan=lifespan, docs_url=None, redoc_url=None, openapi_url=None)
+
+    @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"])
+    async def proxy(request: Request):
+        return await router.forward(request)
+
+    return app
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Worker processes; 1 runs the API directly without a router")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+
+    import uvicorn
+    if args.workers <= 1:
+        uvicorn.run("main:app", host=args.host, port=args.port, timeout_graceful_shutdown=WORKER_DRAIN_TIMEOUT)
+        return
+    logging_config.configure_logging()
+    uvicorn.run(create_app(args.workers), host=args.host, port=args.port, timeout_graceful_shutdown=WORKER_DRAIN_TIMEOUT)
+
+if __name__ == "__main__":
+    main()